@@ -4,3 +4,6 @@ pip install --upgrade pip
 pip install -r requirements.txt
 python manage.py collectstatic --no-input
 python manage.py migrate
+python manage.py update_related_poems
+python manage.py update_rankings
+python manage.py schedule_featured_poems --days 30
@@ -15,7 +15,7 @@ class PoemAdmin(admin.ModelAdmin):
 
 class AuthorAdmin(admin.ModelAdmin):
     search_fields = ['name']
-    list_display = ('name', 'views')
+    list_display = ('name', 'poems_count', 'views')
     prepopulated_fields = {'slug': ('name',)}
 
 
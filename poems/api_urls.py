@@ -1,15 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from . import api_views
+from . import api_views, async_views
+
+# Under ASGI the async versions of the views are served (see wuserade/asgi.py)
+views = async_views if getattr(settings, 'API_ASYNC_VIEWS', False) else api_views
 
 urlpatterns = [
-    path('poems/', api_views.poem_list, name='api_poems_list'),
-    path('poems/<int:pk>/', api_views.poem_detail, name='api_poem_detail'),
-    path('poems/latest/', api_views.latest_poems, name='api_latest_poems'),
-    path('poems/search/', api_views.search_poems, name='api_search_poems'),
-    path('authors/', api_views.author_list, name='api_authors_list'),
-    path('authors/<int:pk>/', api_views.author_detail, name='api_author_detail'),
-    path('authors/<int:pk>/poems/', api_views.author_poems, name='api_author_poems'),
-    path('themes/', api_views.theme_list, name='api_themes_list'),
-    path('themes/<int:pk>/poems/', api_views.theme_poems, name='api_theme_poems'),
-    path('poems/featured/', api_views.featured_poem, name='api_featured_poem'),
+    path('poems/', views.poem_list, name='api_poems_list'),
+    path('poems/<int:pk>/', views.poem_detail, name='api_poem_detail'),
+    path('poems/<int:pk>/like/', views.like_poem, name='api_like_poem'),
+    path('poems/latest/', views.latest_poems, name='api_latest_poems'),
+    path('poems/search/', views.search_poems, name='api_search_poems'),
+    path('poems/trending/', views.trending_poems, name='api_trending_poems'),
+    path('autocomplete/', views.autocomplete_titles, name='api_autocomplete'),
+    path('authors/', views.author_list, name='api_authors_list'),
+    path('authors/popular/', views.popular_authors, name='api_popular_authors'),
+    path('authors/<int:pk>/', views.author_detail, name='api_author_detail'),
+    path('authors/<int:pk>/poems/', views.author_poems, name='api_author_poems'),
+    path('themes/', views.theme_list, name='api_themes_list'),
+    path('themes/<int:pk>/poems/', views.theme_poems, name='api_theme_poems'),
+    path('poems/featured/', views.featured_poem, name='api_featured_poem'),
+    path('poems/random/', views.random_poem, name='api_random_poem'),
+    path('export/poems.ndjson', views.export_poems, name='api_export_poems'),
+    path('export/authors.ndjson', views.export_authors, name='api_export_authors'),
+    path('export/themes.ndjson', views.export_themes, name='api_export_themes'),
 ] 
@@ -1,49 +1,56 @@
 from django.core.exceptions import ObjectDoesNotExist
+from django.views.decorators.http import require_safe
 from rest_framework import status
-from rest_framework.decorators import api_view
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
-from django.db.models import Q, Count
 
-from .models import Poem, Author, Theme
+from . import autocomplete, catalog, export, likes, listings, search, selection
+from .cache import cache_response
+from .decorators import count_view_once
+from .listings import LIST_DEFAULT_EXCLUDE
+from .models import Author, Poem
+from .pagination import KeysetPagination, StandardResultsSetPagination
+from .queries import poems_for_detail
 from .serializers import (
-    PoemSerializer,
+    sparse_fields,
     PoemDetailSerializer,
-    AuthorSerializer,
     AuthorDetailSerializer,
-    ThemeSerializer,
     FeaturedPoemSerializer
 )
 from .services import FeaturedPoemService
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 21
-    page_query_param = 'page'
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET'])
+@cache_response('poem_list', tags=['poems'])
 def poem_list(request):
     """
-    List all poems with pagination
+    List all poems with pagination. Send ?cursor= for keyset pagination,
+    otherwise ?page= is used.
     """
-    paginator = StandardResultsSetPagination()
-    poems = Poem.objects.all().order_by('-created_at')
-    result_page = paginator.paginate_queryset(poems, request)
-    serializer = PoemSerializer(result_page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    return _poem_feed_response(request)
 
 
 @api_view(['GET'])
+@count_view_once(Poem, 'viewed_poems')
+@cache_response('poem_detail', tags=['poem:{pk}'])
 def poem_detail(request, pk):
     """
-    Retrieve a specific poem by ID
+    Retrieve a specific poem by ID, counting a view once per client
     """
+    if catalog.enabled():
+        fields, exclude = sparse_fields(request)
+        data = catalog.get().poem_detail(pk, fields, exclude)
+        if data is not None:
+            return Response(data)
+        return Response(
+            {'error': 'Poem does not exist'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
     try:
-        poem = Poem.objects.get(id=pk)
-        serializer = PoemDetailSerializer(poem)
+        poem = poems_for_detail().get(id=pk)
+        fields, exclude = sparse_fields(request)
+        serializer = PoemDetailSerializer(poem, fields=fields, exclude=exclude)
         return Response(serializer.data)
     except ObjectDoesNotExist:
         return Response(
@@ -52,10 +59,57 @@ def poem_detail(request, pk):
         )
 
 
+@api_view(['POST', 'DELETE'])
+@permission_classes([likes.AllowedOrigin])
+@throttle_classes([likes.LikeRateThrottle])
+def like_poem(request, pk):
+    """
+    Like (POST) or unlike (DELETE) a poem, once per client that keeps the
+    likes cookie; repeating either changes nothing
+    """
+    data, liked_ids = likes.like(request, pk, liked=request.method == 'POST')
+    if data is None:
+        return Response(
+            {'error': 'Poem does not exist'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    response = Response(data)
+    if liked_ids is not None:
+        likes.remember(response, liked_ids)
+    return response
+
+
+@api_view(['GET'])
+def random_poem(request):
+    """
+    Get a random poem; a worker does not repeat a poem until it has served
+    every poem once
+    """
+    # A drawn id may belong to a poem deleted since the bag was filled
+    for _ in range(3):
+        poem_id = selection.random_bag.draw()
+        if poem_id is None:
+            break
+        fields, exclude = sparse_fields(request)
+        if catalog.enabled():
+            data = catalog.get().poem_detail(poem_id, fields, exclude)
+            if data is not None:
+                return Response(data)
+        else:
+            poem = poems_for_detail().filter(id=poem_id).first()
+            if poem is not None:
+                return Response(PoemDetailSerializer(poem, fields=fields, exclude=exclude).data)
+        selection.random_bag.discard()
+    return Response(
+        {'error': 'No poems available'},
+        status=status.HTTP_404_NOT_FOUND
+    )
+
+
 @api_view(['GET'])
 def search_poems(request):
     """
-    Search poems by title or author name
+    Search poems by title, author name or text, ranked by relevance
     """
     query = request.query_params.get("q", "")
     if not query:
@@ -63,75 +117,96 @@ def search_poems(request):
             {'error': 'Search query parameter "q" is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
-        
-    poems = Poem.objects.filter(Q(title__icontains=query) | Q(author__name__icontains=query)).distinct()
-    serializer = PoemSerializer(poems, many=True)
-    return Response(serializer.data)
+
+    paginator = StandardResultsSetPagination()
+    page = paginator.paginate_queryset(search.ranked(query), request)
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    poems, results = listings.search_results(query, [row['poem_id'] for row in page], fields, exclude)
+    return paginator.get_paginated_response(results(poems))
 
 
 @api_view(['GET'])
-def latest_poems(request):
+def autocomplete_titles(request):
     """
-    Get the 9 latest poems
+    Complete a poem title or author name from a per-worker prefix index,
+    without database queries (see poems/autocomplete.py). ?limit= caps the
+    number of suggestions.
     """
-    latest_poems = Poem.objects.all().order_by('-created_at')[:9]
-    serializer = PoemSerializer(latest_poems, many=True)
-    return Response(serializer.data)
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return Response(
+            {'error': 'Query parameter "q" is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(autocomplete.complete(query, autocomplete.parse_limit(request.GET.get('limit'))))
 
 
 @api_view(['GET'])
-def author_list(request):
+@cache_response('latest_poems', tags=['poems'])
+def latest_poems(request):
     """
-    List all authors with at least one poem, including poem count
+    Get the 9 latest poems
     """
-    authors = Author.objects.annotate(
-        poems_count=Count('poems')
-    ).filter(poems_count__gt=0).order_by('name')
-    
-    serializer = AuthorSerializer(authors, many=True)
-    return Response(serializer.data)
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    if catalog.enabled():
+        snapshot = catalog.get()
+        return Response(snapshot.poems(snapshot.feed().ids[:listings.LATEST_COUNT], fields, exclude))
+    return Response(listings.serialize_poems(listings.latest_rows(fields, exclude), fields, exclude))
 
 
 @api_view(['GET'])
-def author_detail(request, pk):
+@cache_response('trending_poems', tags=['poems', 'rankings'])
+def trending_poems(request):
     """
-    Retrieve a specific author by ID with poem count, incrementing view count once per session.
+    The poems read most lately, best first (see poems/rankings.py)
     """
-    try:
-        # Retrieve the author
-        author = Author.objects.annotate(
-            poems_count=Count('poems')  # Annotate might be handled by serializer, but safe to keep
-        ).get(id=pk)
-
-        # --- Session Logic Start ---
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    return Response(listings.serialize_poems(listings.trending_rows(fields, exclude), fields, exclude))
 
-        # Get the set of viewed author IDs from the session, default to an empty set
-        # Using a set is efficient for checking membership
-        viewed_authors = set(request.session.get('viewed_authors', []))
 
-        # Convert pk to string for consistent storage and comparison in session
-        author_id_str = str(pk)
-
-        # Check if this author ID has *not* been viewed in the current session
-        if author_id_str not in viewed_authors:
-            # Increment the view count in the database
-            author.views += 1
-            author.save(update_fields=['views']) # Optimization: only update the 'views' field
+@api_view(['GET'])
+@cache_response('author_list', tags=['authors'])
+def author_list(request):
+    """
+    List all authors with at least one poem, including poem count
+    """
+    fields, exclude = sparse_fields(request)
+    if catalog.enabled():
+        snapshot = catalog.get()
+        return Response(snapshot.authors(snapshot.authors_by_name, fields, exclude))
+    return Response(listings.serialize_authors(listings.listed_author_rows(), fields, exclude))
 
-            # Add the author ID to the set of viewed authors for this session
-            viewed_authors.add(author_id_str)
 
-            # Update the session data (convert set back to list for JSON serialization)
-            request.session['viewed_authors'] = list(viewed_authors)
+@api_view(['GET'])
+@cache_response('popular_authors', tags=['authors', 'rankings'])
+def popular_authors(request):
+    """
+    The authors read most lately, best first (see poems/rankings.py)
+    """
+    fields, exclude = sparse_fields(request)
+    return Response(listings.serialize_authors(listings.popular_author_rows(), fields, exclude))
 
-            # Explicitly mark the session as modified because we altered a mutable object (the list)
-            # This ensures Django saves the session
-            request.session.modified = True
 
-        # --- Session Logic End ---
+@api_view(['GET'])
+@count_view_once(Author, 'viewed_authors')
+def author_detail(request, pk):
+    """
+    Retrieve a specific author by ID with poem count, counting a view once per client
+    """
+    if catalog.enabled():
+        fields, exclude = sparse_fields(request)
+        data = catalog.get().author_detail(pk, fields, exclude)
+        if data is not None:
+            return Response(data)
+        return Response(
+            {'error': 'Author does not exist'},
+            status=status.HTTP_404_NOT_FOUND
+        )
 
-        # Serialize the author data (including the potentially updated view count)
-        serializer = AuthorDetailSerializer(author)
+    try:
+        author = Author.objects.get(id=pk)
+        fields, exclude = sparse_fields(request)
+        serializer = AuthorDetailSerializer(author, fields=fields, exclude=exclude)
         return Response(serializer.data)
 
     except ObjectDoesNotExist:
@@ -143,33 +218,56 @@ def author_detail(request, pk):
 
 
 @api_view(['GET'])
+@cache_response('author_poems', tags=['author:{pk}'])
 def author_poems(request, pk):
     """
-    Get all poems by a specific author
+    Poems by a specific author, newest first, paginated like poem_list
     """
-    poems = Poem.objects.filter(author_id=pk)
-    serializer = PoemSerializer(poems, many=True)
-    return Response(serializer.data)
+    return _poem_feed_response(request, author_id=pk)
 
 
 @api_view(['GET'])
+@cache_response('theme_list', tags=['themes'])
 def theme_list(request):
     """
     List all themes
     """
-    themes = Theme.objects.annotate(poems_count=Count('poems')).all()
-    serializer = ThemeSerializer(themes, many=True)
-    return Response(serializer.data)
+    fields, exclude = sparse_fields(request)
+    if catalog.enabled():
+        return Response(catalog.get().themes(fields, exclude))
+    return Response(listings.serialize_themes(listings.theme_rows(), fields, exclude))
 
 
 @api_view(['GET'])
+@cache_response('theme_poems', tags=['theme:{pk}'])
 def theme_poems(request, pk):
     """
-    Get all poems for a specific theme
+    Poems for a specific theme, newest first, paginated like poem_list
     """
-    poems = Poem.objects.filter(category_id=pk)
-    serializer = PoemSerializer(poems, many=True)
-    return Response(serializer.data)
+    return _poem_feed_response(request, category_id=pk)
+
+
+def _poem_feed_response(request, **filters):
+    """
+    A page of the newest-first feed of all poems, or of those matching
+    filters (author_id or category_id)
+    """
+    if KeysetPagination.requested(request):
+        paginator = KeysetPagination()
+    else:
+        paginator = StandardResultsSetPagination()
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    if catalog.enabled():
+        snapshot = catalog.get()
+        feed = snapshot.feed(**filters)
+        if isinstance(paginator, KeysetPagination):
+            poem_ids = catalog.keyset_page(paginator, feed, request)
+        else:
+            poem_ids = paginator.paginate_queryset(feed.ids, request)
+        return paginator.get_paginated_response(snapshot.poems(poem_ids, fields, exclude))
+
+    result_page = paginator.paginate_queryset(listings.feed_rows(fields, exclude, **filters), request)
+    return paginator.get_paginated_response(listings.serialize_poems(result_page, fields, exclude))
 
 
 @api_view(['GET'])
@@ -179,7 +277,33 @@ def featured_poem(request):
     """
     try:
         featured = FeaturedPoemService.get_todays_featured_poem()
-        serializer = FeaturedPoemSerializer(featured)
-        return Response(serializer.data)
+        fields, exclude = sparse_fields(request)
+        return Response(FeaturedPoemSerializer(featured, fields=fields, exclude=exclude).data)
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+
+# Plain Django views: DRF's content negotiation would refuse clients
+# asking for application/x-ndjson
+@require_safe
+def export_poems(request):
+    """
+    Stream every poem as NDJSON, optionally only those updated since=
+    """
+    return export.response(request, 'poems')
+
+
+@require_safe
+def export_authors(request):
+    """
+    Stream every author as NDJSON, optionally only those updated since=
+    """
+    return export.response(request, 'authors')
+
+
+@require_safe
+def export_themes(request):
+    """
+    Stream every theme as NDJSON
+    """
+    return export.response(request, 'themes')
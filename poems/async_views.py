@@ -0,0 +1,325 @@
+"""
+Async versions of the read endpoints in api_views, served when the app
+runs under ASGI (settings.API_ASYNC_VIEWS, see poems/api_urls.py).
+
+DRF's views are sync only, so these are plain Django async views that
+query through the async ORM and return the same JSON as their api_views
+counterparts (see tests); a worker keeps serving other requests while
+one waits on the database. There is no browsable API on this path.
+
+Database connections are not persistent on this path (CONN_MAX_AGE 0),
+so each request pays for a new connection unless a pooler sits in front
+of the database (see DATABASES in the settings).
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, PermissionDenied, Throttled
+from rest_framework.request import Request
+
+from . import autocomplete, catalog, export, likes, listings, search, selection
+from .cache import cache_response
+from .decorators import count_view_once
+from .listings import LIST_DEFAULT_EXCLUDE
+from .models import Author, Poem
+from .pagination import KeysetPagination, StandardResultsSetPagination
+from .queries import poems_for_detail
+from .renderers import FastJSONRenderer
+from .serializers import (
+    sparse_fields,
+    PoemDetailSerializer,
+    AuthorDetailSerializer,
+    FeaturedPoemSerializer,
+)
+from .services import FeaturedPoemService
+
+_renderer = FastJSONRenderer()
+
+
+class JSONResponse(HttpResponse):
+    """JSON response that keeps its data, for cache_response"""
+
+    def __init__(self, data, status=200):
+        super().__init__(_renderer.render(data), status=status, content_type='application/json')
+        self.data = data
+
+
+def api_methods(*methods):
+    """
+    Allow the given methods only, answering others like DRF does; like
+    DRF's views, the view is exempt from CSRF checks and DRF's exceptions
+    (an invalid page or cursor) are turned into their error responses
+    """
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = JSONResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                response = JSONResponse(detail, status=exc.status_code)
+                if getattr(exc, 'wait', None):
+                    response['Retry-After'] = '%d' % exc.wait
+                return response
+        return wrapper
+    return decorator
+
+
+api_get = api_methods('GET', 'HEAD')
+
+
+def _not_found(message):
+    return JSONResponse({'error': message}, status=404)
+
+
+async def _rows(queryset):
+    return [row async for row in queryset]
+
+
+async def _paginated_response(items, request, serialize):
+    """
+    A StandardResultsSetPagination page of a queryset (loaded through the
+    async ORM) or of a list, as the sync views return it
+    """
+    paginator = StandardResultsSetPagination()
+    # DRF's paginators read the query string from a DRF request
+    request = Request(request)
+    if isinstance(items, list):
+        page = paginator.paginate_queryset(items, request)
+    else:
+        page = await paginator.apaginate_queryset(items, request)
+    return JSONResponse(paginator.get_paginated_response(await serialize(page)).data)
+
+
+async def _keyset_response(poems, request, fields, exclude):
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(poems, request)
+    return JSONResponse({
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        'results': listings.serialize_poems(page, fields, exclude),
+    })
+
+
+@api_get
+@cache_response('poem_list', tags=['poems'], response_class=JSONResponse)
+async def poem_list(request):
+    return await _poem_feed_response(request)
+
+
+@api_get
+@count_view_once(Poem, 'viewed_poems')
+@cache_response('poem_detail', tags=['poem:{pk}'], response_class=JSONResponse)
+async def poem_detail(request, pk):
+    if catalog.enabled():
+        fields, exclude = sparse_fields(request)
+        data = (await catalog.aget()).poem_detail(pk, fields, exclude)
+        return _not_found('Poem does not exist') if data is None else JSONResponse(data)
+    try:
+        poem = await poems_for_detail().aget(id=pk)
+    except ObjectDoesNotExist:
+        return _not_found('Poem does not exist')
+    fields, exclude = sparse_fields(request)
+    return JSONResponse(PoemDetailSerializer(poem, fields=fields, exclude=exclude).data)
+
+
+@api_methods('POST', 'DELETE')
+async def like_poem(request, pk):
+    # The checks of api_views.like_poem's permission and throttle classes
+    if not likes.AllowedOrigin().has_permission(request, None):
+        raise PermissionDenied(likes.AllowedOrigin.message)
+    throttle = likes.LikeRateThrottle()
+    # The throttle's history is in the (file-based) default cache
+    if not await sync_to_async(throttle.allow_request)(Request(request), None):
+        raise Throttled(throttle.wait())
+    # The spool is a local SQLite file, written synchronously
+    data, liked_ids = await sync_to_async(likes.like)(request, pk, liked=request.method == 'POST')
+    if data is None:
+        return _not_found('Poem does not exist')
+    response = JSONResponse(data)
+    if liked_ids is not None:
+        likes.remember(response, liked_ids)
+    return response
+
+
+@api_get
+async def random_poem(request):
+    for _ in range(3):
+        # Refilling the bag reads every poem id
+        poem_id = await sync_to_async(selection.random_bag.draw)()
+        if poem_id is None:
+            break
+        fields, exclude = sparse_fields(request)
+        if catalog.enabled():
+            data = (await catalog.aget()).poem_detail(poem_id, fields, exclude)
+            if data is not None:
+                return JSONResponse(data)
+        else:
+            poem = await poems_for_detail().filter(id=poem_id).afirst()
+            if poem is not None:
+                return JSONResponse(PoemDetailSerializer(poem, fields=fields, exclude=exclude).data)
+        selection.random_bag.discard()
+    return _not_found('No poems available')
+
+
+@api_get
+async def search_poems(request):
+    query = request.GET.get('q', '')
+    if not query:
+        return JSONResponse({'error': 'Search query parameter "q" is required'}, status=400)
+
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+
+    async def serialize(page):
+        poems, results = listings.search_results(query, [row['poem_id'] for row in page], fields, exclude)
+        return results(await _rows(poems))
+    return await _paginated_response(search.ranked(query), request, serialize)
+
+
+@api_get
+async def autocomplete_titles(request):
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return JSONResponse({'error': 'Query parameter "q" is required'}, status=400)
+    version = await catalog.acurrent_version()
+    if autocomplete.index.stale(version):
+        await sync_to_async(autocomplete.index.refresh)(version)
+    return JSONResponse(autocomplete.index.complete(query, autocomplete.parse_limit(request.GET.get('limit'))))
+
+
+@api_get
+@cache_response('latest_poems', tags=['poems'], response_class=JSONResponse)
+async def latest_poems(request):
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    if catalog.enabled():
+        snapshot = await catalog.aget()
+        return JSONResponse(snapshot.poems(snapshot.feed().ids[:listings.LATEST_COUNT], fields, exclude))
+    poems = await _rows(listings.latest_rows(fields, exclude))
+    return JSONResponse(listings.serialize_poems(poems, fields, exclude))
+
+
+@api_get
+@cache_response('trending_poems', tags=['poems', 'rankings'], response_class=JSONResponse)
+async def trending_poems(request):
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    poems = await _rows(listings.trending_rows(fields, exclude))
+    return JSONResponse(listings.serialize_poems(poems, fields, exclude))
+
+
+@api_get
+@cache_response('author_list', tags=['authors'], response_class=JSONResponse)
+async def author_list(request):
+    fields, exclude = sparse_fields(request)
+    if catalog.enabled():
+        snapshot = await catalog.aget()
+        return JSONResponse(snapshot.authors(snapshot.authors_by_name, fields, exclude))
+    authors = await _rows(listings.listed_author_rows())
+    return JSONResponse(listings.serialize_authors(authors, fields, exclude))
+
+
+@api_get
+@cache_response('popular_authors', tags=['authors', 'rankings'], response_class=JSONResponse)
+async def popular_authors(request):
+    fields, exclude = sparse_fields(request)
+    authors = await _rows(listings.popular_author_rows())
+    return JSONResponse(listings.serialize_authors(authors, fields, exclude))
+
+
+@api_get
+@count_view_once(Author, 'viewed_authors')
+async def author_detail(request, pk):
+    if catalog.enabled():
+        fields, exclude = sparse_fields(request)
+        data = (await catalog.aget()).author_detail(pk, fields, exclude)
+        return _not_found('Author does not exist') if data is None else JSONResponse(data)
+    try:
+        author = await Author.objects.aget(id=pk)
+    except ObjectDoesNotExist:
+        return _not_found('Author does not exist')
+    fields, exclude = sparse_fields(request)
+    return JSONResponse(AuthorDetailSerializer(author, fields=fields, exclude=exclude).data)
+
+
+@api_get
+@cache_response('author_poems', tags=['author:{pk}'], response_class=JSONResponse)
+async def author_poems(request, pk):
+    return await _poem_feed_response(request, author_id=pk)
+
+
+@api_get
+@cache_response('theme_list', tags=['themes'], response_class=JSONResponse)
+async def theme_list(request):
+    fields, exclude = sparse_fields(request)
+    if catalog.enabled():
+        return JSONResponse((await catalog.aget()).themes(fields, exclude))
+    themes = await _rows(listings.theme_rows())
+    return JSONResponse(listings.serialize_themes(themes, fields, exclude))
+
+
+@api_get
+@cache_response('theme_poems', tags=['theme:{pk}'], response_class=JSONResponse)
+async def theme_poems(request, pk):
+    return await _poem_feed_response(request, category_id=pk)
+
+
+async def _poem_feed_response(request, **filters):
+    fields, exclude = sparse_fields(request, LIST_DEFAULT_EXCLUDE)
+    if catalog.enabled():
+        return await _catalog_feed_response(request, fields, exclude, **filters)
+    poems = listings.feed_rows(fields, exclude, **filters)
+    if KeysetPagination.requested(request):
+        return await _keyset_response(poems, request, fields, exclude)
+
+    async def serialize(page):
+        return listings.serialize_poems(page, fields, exclude)
+    return await _paginated_response(poems, request, serialize)
+
+
+async def _catalog_feed_response(request, fields, exclude, **filters):
+    snapshot = await catalog.aget()
+    feed = snapshot.feed(**filters)
+    if KeysetPagination.requested(request):
+        paginator = KeysetPagination()
+        poem_ids = catalog.keyset_page(paginator, feed, request)
+        return JSONResponse({
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': snapshot.poems(poem_ids, fields, exclude),
+        })
+
+    async def serialize(poem_ids):
+        return snapshot.poems(poem_ids, fields, exclude)
+    return await _paginated_response(feed.ids, request, serialize)
+
+
+@api_get
+async def featured_poem(request):
+    try:
+        featured = await FeaturedPoemService.aget_todays_featured_poem()
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status=404)
+    fields, exclude = sparse_fields(request)
+    return JSONResponse(FeaturedPoemSerializer(featured, fields=fields, exclude=exclude).data)
+
+
+@api_get
+async def export_poems(request):
+    return export.aresponse(request, 'poems')
+
+
+@api_get
+async def export_authors(request):
+    return export.aresponse(request, 'authors')
+
+
+@api_get
+async def export_themes(request):
+    return export.aresponse(request, 'themes')
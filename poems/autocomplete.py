@@ -0,0 +1,131 @@
+"""
+Type-ahead completion of poem titles and author names.
+
+Each worker keeps a prefix index in memory: sorted arrays of normalized
+keys (search.normalize, so palochka spellings and case don't matter),
+searched with bisect. A title or name is indexed once as a whole and once
+from each later word, so "гъащӏэ" finds "Си гъащӏэр" too; matches from the
+start of the label are returned first.
+
+Lookups don't touch the database. The index is rebuilt lazily, on the
+first lookup after the catalog version changes (catalog.current_version(),
+bumped by every catalog write, from any worker, and read at most every
+CATALOG_CHECK_INTERVAL seconds).
+"""
+import bisect
+import threading
+
+from . import catalog, search
+from .models import Author, Poem
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 20
+
+
+def normalize(text):
+    return ' '.join(search.normalize(text or '').split())
+
+
+def _keys(label):
+    """The whole label, then the label from each later word on"""
+    words = normalize(label).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class _Snapshot:
+    """Immutable index arrays; lookups use whichever snapshot is current"""
+
+    def __init__(self, version, items):
+        # items: (label, kind, id, extra)
+        whole, later = [], []
+        for number, (label, *_) in enumerate(items):
+            keys = _keys(label)
+            if not keys:
+                continue
+            whole.append((keys[0], number))
+            later.extend((key, number) for key in keys[1:])
+        whole.sort()
+        later.sort()
+        self.version = version
+        self.items = items
+        self.arrays = [([key for key, _ in array], [number for _, number in array]) for array in (whole, later)]
+
+    def complete(self, prefix, limit):
+        found = []
+        seen = set()
+        for keys, numbers in self.arrays:
+            position = bisect.bisect_left(keys, prefix)
+            while position < len(keys) and len(found) < limit and keys[position].startswith(prefix):
+                number = numbers[position]
+                if number not in seen:
+                    seen.add(number)
+                    found.append(self.items[number])
+                position += 1
+        return found
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def discard(self):
+        """Drop the index; the next lookup rebuilds it"""
+        self.snapshot = None
+
+    def stale(self, version):
+        """Whether the index was not built from the given catalog version"""
+        return self.snapshot is None or self.snapshot.version != version
+
+    def refresh(self, version):
+        """Rebuild from the database; one thread builds, others keep the old snapshot"""
+        if not self.lock.acquire(blocking=self.snapshot is None):
+            return
+        try:
+            if self.snapshot is not None and self.snapshot.version == version:
+                return
+            items = [
+                (title, 'poem', pk, author)
+                for pk, title, author in Poem.objects.values_list('id', 'title', 'author__name').iterator()
+            ]
+            items += [
+                (name, 'author', pk, None)
+                for pk, name in Author.objects.filter(poems_count__gt=0).values_list('id', 'name').iterator()
+            ]
+            self.snapshot = _Snapshot(version, items)
+        finally:
+            self.lock.release()
+
+    def complete(self, query, limit=DEFAULT_LIMIT):
+        """
+        Returns:
+            list: up to `limit` matches as dicts with type, id, label (and
+                author for poems); empty without a query
+        """
+        prefix = normalize(query)
+        if not prefix or self.snapshot is None:
+            return []
+        results = []
+        for label, kind, pk, author in self.snapshot.complete(prefix, limit):
+            result = {'type': kind, 'id': pk, 'label': label}
+            if kind == 'poem':
+                result['author'] = author
+            results.append(result)
+        return results
+
+
+index = PrefixIndex()
+
+
+def parse_limit(value):
+    try:
+        return max(1, min(int(value), MAX_LIMIT))
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+
+
+def complete(query, limit=DEFAULT_LIMIT):
+    version = catalog.current_version()
+    if index.stale(version):
+        index.refresh(version)
+    return index.complete(query, limit)
@@ -0,0 +1,356 @@
+"""
+Load and latency benchmark of the public endpoints.
+
+generate_corpus() fills an empty local database with a deterministic
+synthetic catalog (the same seed and size always produce the same rows),
+and run() requests every route of poems/urls.py and poems/api_urls.py
+in-process through the Django test client, recording throughput,
+latency percentiles, query count and response size per route.
+Reports are plain dicts, saved as JSON and compared against a stored
+baseline with regressions().
+"""
+import datetime
+import itertools
+import platform
+import random
+import statistics
+import time
+
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache, catalog, search
+from .models import Author, Poem, Theme, make_excerpt
+from .queries import recount_poems
+
+DEFAULT_SEED = 1
+VOCABULARY_SIZE = 5000
+POEMS_PER_AUTHOR = 40
+THEMES_COUNT = 24
+
+# Routes that don't answer GET; a client's repeat likes are no-ops, so
+# these measure the deduplicated path after the first request
+ROUTE_METHODS = {'api_like_poem': 'post'}
+
+# Kabardian-looking syllables, so that word lengths, palochka spellings and
+# text size are close to the real catalog
+_onsets = [
+    '', 'б', 'в', 'г', 'гъ', 'гу', 'д', 'дж', 'дз', 'ж', 'жь', 'з', 'й', 'к', 'къ', 'кӏ', 'кхъ', 'л', 'лъ',
+    'лӏ', 'м', 'н', 'п', 'пӏ', 'р', 'с', 'т', 'тӏ', 'ф', 'фӏ', 'х', 'хъ', 'хь', 'ц', 'цӏ', 'ч', 'щ', 'щӏ', 'ӏ',
+]
+_vowels = ['а', 'э', 'ы', 'и', 'о', 'у', 'е', 'я', 'уэ']
+_codas = ['', '', '', 'р', 'м', 'н', 'щ', 'хэ', 'къ', 'гъ']
+
+
+def _vocabulary(rng):
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        syllables = rng.choice((1, 2, 2, 3, 3, 4))
+        word = ''.join(rng.choice(_onsets) + rng.choice(_vowels) for _ in range(syllables)) + rng.choice(_codas)
+        words.add(word)
+    # Sorted before shuffling so set ordering can't leak into the result
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+class Corpus:
+    """
+    Deterministic word source; word frequencies follow Zipf's law, so the
+    most common word (search_term) matches a large share of the poems.
+    """
+
+    def __init__(self, seed=DEFAULT_SEED):
+        self.rng = random.Random(seed)
+        self.words = _vocabulary(self.rng)
+        self.cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(self.words) + 1)))
+
+    @property
+    def search_term(self):
+        return self.words[0]
+
+    def phrase(self, low, high):
+        count = self.rng.randint(low, high)
+        return ' '.join(self.rng.choices(self.words, cum_weights=self.cum_weights, k=count))
+
+    def name(self):
+        return ' '.join(self.rng.choice(self.words[:2000]).capitalize() for _ in range(2))
+
+    def text(self):
+        stanzas = [
+            '\n'.join(self.phrase(3, 6).capitalize() for _ in range(4))
+            for _ in range(self.rng.randint(2, 6))
+        ]
+        return '\n\n'.join(stanzas)
+
+
+def generate_corpus(poems=1000, seed=DEFAULT_SEED, batch_size=5000, index=True, progress=None):
+    """
+    Create `poems` synthetic poems with proportional authors and themes
+
+    Args:
+        index: also build the search index
+        progress: called with the number of poems created after each batch
+
+    Returns:
+        Corpus: the word source, for picking search terms
+    """
+    corpus = Corpus(seed)
+    started = timezone.make_aware(datetime.datetime(2020, 1, 1))
+
+    with transaction.atomic():
+        Theme.objects.bulk_create([
+            Theme(title=corpus.phrase(1, 2).capitalize(), slug=f'bench-theme-{i}')
+            for i in range(THEMES_COUNT)
+        ])
+        Author.objects.bulk_create([
+            Author(name=corpus.name(), slug=f'bench-author-{i}', created_at=started, updated_at=started)
+            for i in range(max(1, poems // POEMS_PER_AUTHOR))
+        ])
+    theme_ids = list(Theme.objects.filter(slug__startswith='bench-theme-').order_by('id').values_list('id', flat=True))
+    author_ids = list(Author.objects.filter(slug__startswith='bench-author-').order_by('id').values_list('id', flat=True))
+
+    for start in range(0, poems, batch_size):
+        batch = []
+        for i in range(start, min(start + batch_size, poems)):
+            text = corpus.text()
+            created_at = started + datetime.timedelta(minutes=i)
+            batch.append(Poem(
+                title=corpus.phrase(1, 4).capitalize(),
+                slug=f'bench-poem-{i}',
+                # A long tail: a few authors wrote most of the poems
+                author_id=author_ids[int(len(author_ids) * corpus.rng.random() ** 2)],
+                category_id=corpus.rng.choice(theme_ids) if corpus.rng.random() < 0.8 else None,
+                text=text,
+                excerpt=make_excerpt(text),
+                views=int(corpus.rng.paretovariate(1.2)),
+                created_at=created_at,
+                updated_at=created_at,
+            ))
+        Poem.objects.bulk_create(batch)
+        if progress:
+            progress(start + len(batch))
+
+    recount_poems(author_ids, theme_ids)
+    if index:
+        search.rebuild_index()
+    catalog.bump()
+    cache.invalidate('poems', 'authors', 'themes', 'featured')
+    return corpus
+
+
+def _sample_id(model):
+    """The object in the middle of the id range, so lookups aren't all on the first page"""
+    ids = model.objects.order_by('id').values_list('id', flat=True)
+    first, last = ids.first(), ids.last()
+    if first is None:
+        return None
+    return ids.filter(id__gte=(first + last) // 2).first()
+
+
+def route_urls():
+    """
+    Yields:
+        tuple: (route name, URL) for every route of the public URLconfs,
+            detail routes pointing at an object from the middle of the catalog
+    """
+    from . import api_urls, urls
+
+    sample = {'poem': _sample_id(Poem), 'author': _sample_id(Author), 'theme': _sample_id(Theme)}
+    for pattern in [*urls.urlpatterns, *api_urls.urlpatterns]:
+        kwargs = {}
+        if 'pk' in pattern.pattern.converters:
+            route = str(pattern.pattern)
+            owner = 'theme' if 'theme' in route else ('author' if 'author' in route else 'poem')
+            kwargs['pk'] = sample[owner]
+        yield pattern.name, reverse(pattern.name, kwargs=kwargs)
+
+
+def _percentile(samples, percent):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(client, url, params, requests, warmup=3, cold=False, method='get'):
+    """
+    Time `requests` sequential requests of one URL
+
+    Args:
+        cold: clear the response cache before every request
+        method: the HTTP method, GET by default
+
+    Returns:
+        dict: the route's report entry
+    """
+    send = getattr(client, method)
+    # getvalue() also reads streaming responses to the end
+    for _ in range(warmup):
+        send(url, params).getvalue()
+
+    latencies = []
+    size = status = 0
+    for _ in range(requests):
+        if cold:
+            cache.get_cache().clear()
+        begin = time.perf_counter()
+        response = send(url, params)
+        size = len(response.getvalue())
+        latencies.append(time.perf_counter() - begin)
+        status = response.status_code
+
+    # Queries are counted on a separate request: capturing them forces a
+    # debug cursor, which would skew the timings
+    if cold:
+        cache.get_cache().clear()
+    with CaptureQueriesContext(connection) as queries:
+        send(url, params).getvalue()
+
+    return {
+        'status': status,
+        'requests': requests,
+        'throughput': round(requests / sum(latencies), 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'queries': len(queries),
+        'bytes': size,
+    }
+
+
+def run(requests=50, warmup=3, cold=False, search_term=None, routes=None, progress=None):
+    """
+    Benchmark every route, or the named `routes`
+
+    Returns:
+        dict: {'meta': {...}, 'routes': {name: {...}}}
+    """
+    hosts = [host for host in settings.ALLOWED_HOSTS if '*' not in host and not host.startswith('.')]
+    headers = {'HTTP_HOST': hosts[0] if hosts else 'localhost', 'HTTP_ACCEPT': 'application/json'}
+    params = {'q': search_term or Corpus().search_term}
+
+    results = {}
+    for name, url in route_urls():
+        if routes and name not in routes:
+            continue
+        # A fresh client per route: no cookies carried over between routes
+        method = ROUTE_METHODS.get(name, 'get')
+        results[name] = measure(Client(**headers), url, params, requests, warmup, cold, method)
+        if progress:
+            progress(name, results[name])
+
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'poems': Poem.objects.count(),
+            'authors': Author.objects.count(),
+            'themes': Theme.objects.count(),
+            'requests': requests,
+            'cold': cold,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        },
+        'routes': results,
+    }
+
+
+def regressions(report, baseline, tolerance=0.25, noise_ms=1.0):
+    """
+    Compare a report against a baseline report
+
+    Args:
+        tolerance: allowed relative slowdown of p50/p95 and growth of
+            response size
+        noise_ms: latency differences below this are never reported
+
+    Returns:
+        list: one human-readable line per regression
+    """
+    found = []
+    for key in ('poems', 'cold', 'database'):
+        if report['meta'][key] != baseline['meta'][key]:
+            found.append(f"baseline is not comparable: {key} {baseline['meta'][key]} -> {report['meta'][key]}")
+    for name, current in report['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        if current['status'] != previous['status']:
+            found.append(f"{name}: status {previous['status']} -> {current['status']}")
+        for metric in ('p50_ms', 'p95_ms'):
+            before, after = previous[metric], current[metric]
+            if after - before > noise_ms and after > before * (1 + tolerance):
+                found.append(f'{name}: {metric} {before} -> {after}')
+        if current['queries'] > previous['queries']:
+            found.append(f"{name}: queries {previous['queries']} -> {current['queries']}")
+        if current['bytes'] > previous['bytes'] * (1 + tolerance):
+            found.append(f"{name}: bytes {previous['bytes']} -> {current['bytes']}")
+    return found
+
+
+def load(base_url, paths, concurrency=50, duration=10.0, timeout=30.0):
+    """
+    Drive a running server with `concurrency` clients for `duration`
+    seconds, each requesting `paths` in turn; used to compare the WSGI
+    and ASGI profiles at a fixed worker count.
+
+    Returns:
+        dict: requests, errors, throughput and latency percentiles
+    """
+    import http.client
+    import threading
+    import urllib.parse
+
+    target = urllib.parse.urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        conn = connection_class(target.netloc, timeout=timeout)
+        own, failed = [], 0
+        for i in itertools.count(offset):
+            if time.perf_counter() >= deadline:
+                break
+            begin = time.perf_counter()
+            try:
+                conn.request('GET', target.path.rstrip('/') + paths[i % len(paths)], headers={'Accept': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = connection_class(target.netloc, timeout=timeout)
+                continue
+            own.append(time.perf_counter() - begin)
+        conn.close()
+        with lock:
+            latencies.extend(own)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
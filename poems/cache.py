@@ -0,0 +1,242 @@
+"""
+Response cache for the read-only API endpoints.
+
+Entries are keyed by endpoint, URL kwargs and query parameters, and carry
+a set of tags such as ``poems`` or ``author:12``. Each tag has a version
+token stored in the cache; the entry key includes the current tokens, so
+invalidating a tag is a single ``set`` of a new token and works with any
+Django cache backend, including the local-memory and file-based ones
+that cannot enumerate or delete keys by pattern.
+
+Compressed bodies of cached responses are stored next to them by
+CompressionMiddleware, and a hit the client accepts one of is answered
+with the stored body, without rendering the data again.
+
+Hit and miss counts are kept in memory per worker and added to the
+shared counters in the cache at most every RESPONSE_CACHE_STATS_INTERVAL
+seconds, so stats() from another process lags by up to that long.
+"""
+import functools
+import hashlib
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.response import Response
+
+DEFAULT_TIMEOUT = 300
+STATS_TIMEOUT = None
+DEFAULT_STATS_INTERVAL = 30
+
+# Names of all endpoints wrapped by cache_response, for stats()
+ENDPOINTS = []
+
+_stats_lock = threading.Lock()
+_pending_stats = defaultdict(int)
+_last_stats_flush = {'at': time.monotonic()}
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def _tag_key(tag):
+    return f'response-tag:{tag}'
+
+
+def _tag_versions(cache, tags):
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def versions(*tags):
+    """
+    Current version tokens of the tags; a change means one was invalidated.
+    In-process copies of catalog data use this to notice writes made by
+    any worker.
+    """
+    return tuple(_tag_versions(get_cache(), tags))
+
+
+def invalidate(*tags):
+    """Expire every cached response carrying any of the tags"""
+    get_cache().set_many({_tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+def compressed_key(key, encoding, request):
+    """
+    Key of a cached response's compressed body. The rendered body also
+    depends on the Accept header, through DRF's content negotiation (e.g.
+    indented JSON), so the key includes it.
+    """
+    accept = hashlib.sha1(request.META.get('HTTP_ACCEPT', '').encode()).hexdigest()
+    return f'{key}:{encoding}:{accept}'
+
+
+def store_compressed(body_key, content_type, body):
+    get_cache().set(body_key, (content_type, body), getattr(settings, 'RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def _compressed_response(cache, key, request):
+    """
+    The stored compressed body of the response, as a response, if the
+    client accepts its encoding
+    """
+    # Imported here: the middleware module imports this one
+    from .middleware import negotiate
+
+    encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    stored = None if encoding is None else cache.get(compressed_key(key, encoding, request))
+    if stored is None:
+        return None
+    content_type, body = stored
+    response = HttpResponse(body, content_type=content_type)
+    response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(len(body))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def _stats_key(endpoint, outcome):
+    return f'response-stats:{endpoint}:{outcome}'
+
+
+def _record(endpoint, outcome):
+    with _stats_lock:
+        _pending_stats[(endpoint, outcome)] += 1
+    if time.monotonic() - _last_stats_flush['at'] >= getattr(
+        settings, 'RESPONSE_CACHE_STATS_INTERVAL', DEFAULT_STATS_INTERVAL
+    ):
+        flush_stats()
+
+
+def flush_stats():
+    """Add this worker's pending hit/miss counts to the shared counters"""
+    _last_stats_flush['at'] = time.monotonic()
+    with _stats_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    cache = get_cache()
+    for (endpoint, outcome), count in pending.items():
+        key = _stats_key(endpoint, outcome)
+        if not cache.add(key, count, STATS_TIMEOUT):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(key, count, STATS_TIMEOUT)
+
+
+def stats(endpoints=None):
+    """
+    Returns:
+        dict: endpoint -> {'hits': int, 'misses': int}
+    """
+    endpoints = ENDPOINTS if endpoints is None else endpoints
+    flush_stats()
+    cache = get_cache()
+    keys = {
+        (endpoint, outcome): _stats_key(endpoint, outcome)
+        for endpoint in endpoints for outcome in ('hits', 'misses')
+    }
+    values = cache.get_many(keys.values())
+    result = {endpoint: {'hits': 0, 'misses': 0} for endpoint in endpoints}
+    for (endpoint, outcome), key in keys.items():
+        result[endpoint][outcome] = values.get(key, 0)
+    return result
+
+
+def lookup(endpoint, tags, request, kwargs):
+    """
+    Returns:
+        tuple: (cache key of the request, cached data or None, compressed
+            response or None); a hit has one of the last two
+    """
+    cache = get_cache()
+    entry_tags = [tag.format(**kwargs) for tag in tags]
+    params = sorted(request.GET.lists())
+    fingerprint = repr((
+        request.get_host(), sorted(kwargs.items()), params, _tag_versions(cache, entry_tags),
+    ))
+    key = f'response:{endpoint}:{hashlib.sha1(fingerprint.encode()).hexdigest()}'
+    compressed = _compressed_response(cache, key, request)
+    cached = None if compressed is not None else cache.get(key)
+    _record(endpoint, 'misses' if cached is None and compressed is None else 'hits')
+    return key, cached, compressed
+
+
+def store(key, data):
+    get_cache().set(key, data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def cache_response(endpoint, tags=(), response_class=Response):
+    """
+    Cache the data of successful responses of a function view.
+
+    Args:
+        endpoint: name used in the cache key and the hit/miss stats
+        tags: tag templates formatted with the view's URL kwargs,
+            e.g. ['poems', 'poem:{pk}']
+        response_class: builds a response from cached data; DRF's Response
+            by default, so content negotiation keeps working
+
+    Async views are supported; their cache lookups run in a thread. Views
+    must return responses with a data attribute. Responses carry an
+    X-Cache: HIT/MISS header, and a cache_key attribute that
+    CompressionMiddleware stores compressed bodies under; a hit served
+    from a compressed body is already encoded, and has neither.
+    """
+    if endpoint not in ENDPOINTS:
+        ENDPOINTS.append(endpoint)
+
+    def hit(key, cached, compressed):
+        if compressed is not None:
+            response = compressed
+        else:
+            response = response_class(cached)
+            response.cache_key = key
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def miss(key, response):
+        if response.status_code == 200:
+            response.cache_key = key
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                key, cached, compressed = await sync_to_async(lookup)(endpoint, tags, request, kwargs)
+                if cached is not None or compressed is not None:
+                    return hit(key, cached, compressed)
+                response = await view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    await sync_to_async(store)(key, response.data)
+                return miss(key, response)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, cached, compressed = lookup(endpoint, tags, request, kwargs)
+            if cached is not None or compressed is not None:
+                return hit(key, cached, compressed)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                store(key, response.data)
+            return miss(key, response)
+
+        return wrapper
+    return decorator
@@ -0,0 +1,284 @@
+"""
+Per-worker in-memory snapshot of the catalog, serving the read endpoints
+of poems/urls.py and poems/api_urls.py without touching the database
+(settings.API_CATALOG_SNAPSHOT).
+
+A snapshot holds every poem, author and theme as a tuple keyed by id,
+each poem's precomputed similar poems, and the feeds in the orders the
+endpoints list them: all poems, and each author's and each theme's, by
+(created_at, id), plus the authors by name. A detail is a dict lookup, a
+page is a slice, and a keyset page is a bisect and a slice. Responses are
+built by the same projections as the database path.
+
+The single CatalogVersion row is bumped by every catalog write: the Poem,
+Author, Theme and FeaturedPoem signals, and the bulk writers (catalog
+import, text cleaning, count repair, similar poems, the benchmark
+corpus), once their transactions commit. A worker reads the row at most every
+CATALOG_CHECK_INTERVAL seconds and reloads when it changed; one thread
+reloads while the others keep serving the previous snapshot. A write
+discards its own worker's snapshot as it commits. The featured poem and
+the autocomplete index, kept per worker too, follow the same version
+(current_version()).
+
+A snapshot is read in one transaction (REPEATABLE READ on PostgreSQL), so
+its poems, authors and similar poems agree even while a write commits.
+The view counter flush does not bump the version, so views and likes are
+as of the last reload, as in cached responses. The order of the authors
+by name is read from the database, so it follows its collation.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import projections
+from .models import Author, CatalogVersion, Poem, RelatedPoem, Theme
+
+DEFAULT_CHECK_INTERVAL = 1.0
+
+# {'checked': (monotonic time, version)} of this worker's last version read
+_last_check = {}
+
+PoemRow = namedtuple('PoemRow', 'id title author_id category_id text excerpt views likes created_at')
+AuthorRow = namedtuple('AuthorRow', 'id name bio photo views poems_count created_at')
+ThemeRow = namedtuple('ThemeRow', 'id title poems_count')
+
+
+def enabled():
+    return getattr(settings, 'API_CATALOG_SNAPSHOT', False)
+
+
+def version():
+    return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def _recent_version():
+    """The version read less than CATALOG_CHECK_INTERVAL ago, or None"""
+    interval = getattr(settings, 'CATALOG_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+    checked = _last_check.get('checked')
+    if checked is not None and time.monotonic() - checked[0] < interval:
+        return checked[1]
+    return None
+
+
+def current_version():
+    """
+    The version, read at most every CATALOG_CHECK_INTERVAL seconds; for
+    the other per-worker copies of catalog data (the featured poem, the
+    autocomplete index) to notice writes made by any worker
+    """
+    current = _recent_version()
+    if current is None:
+        current = version()
+        _last_check['checked'] = (time.monotonic(), current)
+    return current
+
+
+async def acurrent_version():
+    """current_version() for async views; only a version check leaves the event loop"""
+    from asgiref.sync import sync_to_async
+
+    current = _recent_version()
+    return current if current is not None else await sync_to_async(current_version)()
+
+
+def _bump():
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+    discard()
+
+
+def discard():
+    """Forget this worker's snapshot and version; the next reads reload them"""
+    _last_check.clear()
+    store.discard()
+
+
+def bump():
+    """
+    Mark the catalog changed once the write's transaction commits; until
+    then a reload could only read the old rows, and the version row would
+    stay locked for the whole transaction.
+    """
+    transaction.on_commit(_bump)
+
+
+class Feed:
+    """Poems in feed order: keys ascending for keyset pages, ids newest first for numbered pages"""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.ids = [pk for _, pk in reversed(keys)]
+
+
+EMPTY_FEED = Feed([])
+
+
+class Snapshot:
+    def __init__(self, version, poems, authors, themes, related, authors_by_name):
+        self.version = version
+        self.poem_rows = {row.id: row for row in poems}
+        self.author_rows = {row.id: row for row in authors}
+        self.theme_rows = {row.id: row for row in themes}
+        self.related = related
+
+        keys = sorted((row.created_at, row.id) for row in poems)
+        by_author, by_theme = defaultdict(list), defaultdict(list)
+        for key in keys:
+            row = self.poem_rows[key[1]]
+            by_author[row.author_id].append(key)
+            if row.category_id is not None:
+                by_theme[row.category_id].append(key)
+        self.all_poems = Feed(keys)
+        self.feeds = {
+            'author_id': {pk: Feed(author_keys) for pk, author_keys in by_author.items()},
+            'category_id': {pk: Feed(theme_keys) for pk, theme_keys in by_theme.items()},
+        }
+        self.authors_by_name = authors_by_name
+
+    @classmethod
+    def load(cls, version):
+        fields = {row: row._fields for row in (PoemRow, AuthorRow, ThemeRow)}
+        connection = transaction.get_connection()
+        outermost = not connection.in_atomic_block
+        with transaction.atomic():
+            if outermost and connection.vendor == 'postgresql':
+                # Under READ COMMITTED each query would see its own snapshot
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            poems = [
+                PoemRow(*values) for values in Poem.objects.values_list(*fields[PoemRow]).iterator(chunk_size=2000)
+            ]
+            authors = [AuthorRow(*values) for values in Author.objects.values_list(*fields[AuthorRow])]
+            themes = [ThemeRow(*values) for values in Theme.objects.values_list(*fields[ThemeRow])]
+            related = defaultdict(list)
+            entries = RelatedPoem.objects.order_by('poem_id', 'rank').values_list('poem_id', 'related_id')
+            for pk, related_id in entries.iterator(chunk_size=2000):
+                related[pk].append(related_id)
+            authors_by_name = list(
+                Author.objects.filter(poems_count__gt=0).order_by('name', 'id').values_list('id', flat=True)
+            )
+        related = {pk: tuple(ids) for pk, ids in related.items()}
+        return cls(version, poems, authors, themes, related, authors_by_name)
+
+    def feed(self, author_id=None, category_id=None):
+        """The newest-first feed of all poems, or of one author's or theme's"""
+        if author_id is not None:
+            return self.feeds['author_id'].get(int(author_id), EMPTY_FEED)
+        if category_id is not None:
+            return self.feeds['category_id'].get(int(category_id), EMPTY_FEED)
+        return self.all_poems
+
+    def poem_values(self, pk):
+        """The poem as a projections.poem_values() row, or None"""
+        poem = self.poem_rows.get(int(pk))
+        if poem is None:
+            return None
+        author = self.author_rows[poem.author_id]
+        theme = self.theme_rows.get(poem.category_id)
+        return {
+            **poem._asdict(),
+            'author__name': author.name,
+            'author__views': author.views,
+            'author__poems_count': author.poems_count,
+            'category__title': theme and theme.title,
+            'category__poems_count': theme and theme.poems_count,
+        }
+
+    def poems(self, ids, fields=None, exclude=None):
+        """PoemSerializer dicts of the poems, in the given order"""
+        return projections.poems([self.poem_values(pk) for pk in ids], fields, exclude)
+
+    def poem_detail(self, pk, fields=None, exclude=None):
+        """
+        Returns:
+            dict: PoemDetailSerializer's dict, or None if there is no such poem
+        """
+        row = self.poem_values(pk)
+        if row is None:
+            return None
+        row['related'] = [
+            {
+                'id': related.id,
+                'title': related.title,
+                'author': {'id': related.author_id, 'name': self.author_rows[related.author_id].name},
+            }
+            for related in (self.poem_rows[related_id] for related_id in self.related.get(row['id'], ()))
+        ]
+        return projections.poem_detail(row, fields, exclude)
+
+    def authors(self, ids, fields=None, exclude=None):
+        return projections.authors([self.author_rows[pk]._asdict() for pk in ids], fields, exclude)
+
+    def author_detail(self, pk, fields=None, exclude=None):
+        """
+        Returns:
+            dict: AuthorDetailSerializer's dict, or None if there is no such author
+        """
+        author = self.author_rows.get(int(pk))
+        return None if author is None else projections.author_detail(author._asdict(), fields, exclude)
+
+    def themes(self, fields=None, exclude=None):
+        return projections.themes([row._asdict() for row in self.theme_rows.values()], fields, exclude)
+
+
+def keyset_page(paginator, feed, request):
+    """A KeysetPagination page of a feed; returns the poem ids, newest first"""
+    return [pk for _, pk in paginator.paginate_keys(feed.keys, request)]
+
+
+class CatalogStore:
+    def __init__(self):
+        self.snapshot = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def discard(self):
+        """Drop the snapshot; the next read reloads it"""
+        self.snapshot = None
+
+    def fresh(self):
+        """The snapshot, if its version was checked less than CATALOG_CHECK_INTERVAL ago"""
+        interval = getattr(settings, 'CATALOG_CHECK_INTERVAL', DEFAULT_CHECK_INTERVAL)
+        snapshot = self.snapshot
+        if snapshot is not None and self.checked_at is not None and time.monotonic() - self.checked_at < interval:
+            return snapshot
+        return None
+
+    def get(self):
+        """The current snapshot, reloaded if the version row changed"""
+        snapshot = self.fresh()
+        if snapshot is not None:
+            return snapshot
+        current = version()
+        self.checked_at = time.monotonic()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == current:
+            return snapshot
+        # One thread loads; the others keep the previous snapshot, if any
+        if not self.lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if self.snapshot is None or self.snapshot.version != current:
+                self.snapshot = Snapshot.load(current)
+            return self.snapshot
+        finally:
+            self.lock.release()
+
+
+store = CatalogStore()
+
+
+def get():
+    return store.get()
+
+
+async def aget():
+    """get() for async views; only a version check or reload leaves the event loop"""
+    from asgiref.sync import sync_to_async
+
+    snapshot = store.fresh()
+    return snapshot if snapshot is not None else await sync_to_async(store.get)()
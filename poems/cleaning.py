@@ -0,0 +1,125 @@
+"""
+Normalization of poem texts: strips HTML tags and entities left over from
+the original scrape, carriage returns and tabs, and runs of spaces.
+
+Texts are read in id order and cleaned in a process pool; only the rows
+whose text actually changes are written back, with bulk_update, so
+re-cleaning an already clean corpus writes nothing and updated_at is
+never touched.
+"""
+import collections
+import re
+from concurrent.futures import ProcessPoolExecutor
+from html import unescape
+
+from django.db import transaction
+
+from . import cache, catalog, search
+from .models import Poem, make_excerpt
+
+_tag_re = re.compile(r'<.*?>')
+_control_re = re.compile(r'[\r\t]+')
+_spaces_re = re.compile(r' +')
+
+
+def clean_text(text):
+    text = unescape(text)
+    text = _tag_re.sub('', text)
+    text = _control_re.sub('', text)
+    return _spaces_re.sub(' ', text).strip()
+
+
+def clean_batch(rows):
+    """
+    Args:
+        rows: (id, text) pairs
+
+    Returns:
+        list: (id, cleaned text) pairs for the texts that changed
+    """
+    changed = []
+    for pk, text in rows:
+        cleaned = clean_text(text)
+        if cleaned != text:
+            changed.append((pk, cleaned))
+    return changed
+
+
+def _batches(start_id, end_id, batch_size):
+    poems = Poem.objects.order_by('id')
+    if start_id is not None:
+        poems = poems.filter(id__gte=start_id)
+    if end_id is not None:
+        poems = poems.filter(id__lte=end_id)
+    batch = []
+    for row in poems.values_list('id', 'text', 'author_id', 'category_id').iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _cleaned(batches, workers):
+    """Yield (batch, changed) pairs in order, keeping at most 2 batches per worker in flight"""
+    if workers <= 1:
+        for batch in batches:
+            yield batch, clean_batch([row[:2] for row in batch])
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = collections.deque()
+        for batch in batches:
+            in_flight.append((batch, pool.submit(clean_batch, [row[:2] for row in batch])))
+            if len(in_flight) >= workers * 2:
+                batch, future = in_flight.popleft()
+                yield batch, future.result()
+        while in_flight:
+            batch, future = in_flight.popleft()
+            yield batch, future.result()
+
+
+def clean_poems(start_id=None, end_id=None, batch_size=500, workers=1, dry_run=False, on_change=None, progress=None):
+    """
+    Clean the texts of the poems with ids in [start_id, end_id]
+
+    Args:
+        dry_run: compute the changes without writing them
+        on_change: called with (poem_id, old_text, new_text) for each change
+        progress: called with (last_id, checked, changed) after each batch;
+            a run stopped midway resumes from start_id=last_id + 1
+
+    Returns:
+        tuple: (poems checked, poems changed)
+    """
+    checked = changed_count = 0
+    for batch, changed in _cleaned(_batches(start_id, end_id, batch_size), workers):
+        checked += len(batch)
+        changed_count += len(changed)
+        if changed:
+            rows = {row[0]: row for row in batch}
+            if on_change:
+                for pk, text in changed:
+                    on_change(pk, rows[pk][1], text)
+            if not dry_run:
+                _save(changed, [rows[pk] for pk, _ in changed])
+        if progress:
+            progress(batch[-1][0], checked, changed_count)
+    return checked, changed_count
+
+
+def _save(changed, rows):
+    poems = [Poem(id=pk, text=text, excerpt=make_excerpt(text)) for pk, text in changed]
+    poem_ids = [poem.id for poem in poems]
+    with transaction.atomic():
+        # bulk_update bypasses save(), so updated_at is left as it was
+        Poem.objects.bulk_update(poems, ['text', 'excerpt'])
+        search.index_poems(Poem.objects.filter(id__in=poem_ids).select_related('author'))
+        catalog.bump()
+
+    # bulk_update sends no signals; expire the responses showing these texts
+    tags = {'poems', 'featured'}
+    tags.update(f'poem:{pk}' for pk in poem_ids)
+    tags.update(f'author:{author_id}' for _, _, author_id, _ in rows)
+    tags.update(f'theme:{category_id}' for _, _, _, category_id in rows if category_id is not None)
+    cache.invalidate(*tags)
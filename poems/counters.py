@@ -0,0 +1,243 @@
+"""
+Write-behind view and like counters.
+
+Page views and likes are recorded in a small SQLite spool on local disk
+instead of updating the hot Author/Poem rows on every request. All gunicorn workers on
+a host share the spool, and SQLite's file lock serializes their writes, so
+no increment is lost between workers. Pending increments are flushed to the
+main database with one batched ``F()`` update per model, field and delta, either
+lazily by whichever worker notices the flush interval has passed, or
+explicitly with ``manage.py flush_view_counters``.
+
+A worker crash loses nothing: increments are durable as soon as they are
+written to the spool. A flush first moves the increments to a batch with a
+new flush id, in the spool's write lock, and applies the batch in one
+database transaction that also records the flush id (CounterFlush). It then
+deletes the batch from the spool. A batch left behind by a crash or a
+database error is applied by the next flush, unless its id shows it
+already was, so nothing is counted twice. Flush ids are kept for
+FLUSH_ID_RETENTION.
+
+However many workers record likes of one poem, its row is updated once
+per flush, so a burst on a popular poem never queues the workers on the
+row lock. The spool keeps the hour of each view, and flushed views are
+added to that hour's bucket for the trending rankings (see
+poems/rankings.py), however late the flush.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+DEFAULT_SPOOL_PATH = os.path.join(settings.BASE_DIR, 'view_counters.sqlite3')
+DEFAULT_FLUSH_INTERVAL = 30
+LOCK_TIMEOUT = 5
+FLUSH_ID_RETENTION = datetime.timedelta(days=7)
+
+_local = threading.local()
+_last_flush = {'at': time.monotonic()}
+
+
+def spool_path():
+    return str(getattr(settings, 'VIEW_COUNTER_SPOOL', DEFAULT_SPOOL_PATH))
+
+
+def flush_interval():
+    return getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+def enable_wal(conn, timeout):
+    """
+    Switch a spool connection to WAL. On a new file this fails at once,
+    without waiting out the busy timeout, while another worker is creating
+    it, so it is retried for up to timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            return
+        except sqlite3.OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
+
+
+INCREMENTS_TABLE = (
+    'CREATE TABLE IF NOT EXISTS increments ('
+    ' model TEXT NOT NULL, pk INTEGER NOT NULL, field TEXT NOT NULL, hour INTEGER NOT NULL, delta INTEGER NOT NULL,'
+    ' PRIMARY KEY (model, pk, field, hour))'
+)
+FLUSHING_TABLE = (
+    'CREATE TABLE IF NOT EXISTS flushing ('
+    ' flush_id TEXT NOT NULL, model TEXT NOT NULL, pk INTEGER NOT NULL, field TEXT NOT NULL,'
+    ' hour INTEGER NOT NULL, delta INTEGER NOT NULL)'
+)
+
+
+def _connection():
+    """
+    One spool connection per thread and process; connections are not
+    shared across a fork.
+    """
+    path = spool_path()
+    key = (os.getpid(), path)
+    conn = getattr(_local, 'conns', {}).get(key)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        enable_wal(conn, LOCK_TIMEOUT)
+        conn.execute(INCREMENTS_TABLE)
+        conn.execute(FLUSHING_TABLE)
+        _local.conns = {key: conn}
+    return conn
+
+
+def _view_hour():
+    """The start of the current hour, in seconds since the epoch"""
+    now = int(time.time())
+    return now - now % 3600
+
+
+def increment(instance, amount=1, field='views'):
+    """
+    Record a change of a counter field of a model instance: a view, or a
+    like (+1) or unlike (-1). Views are kept per hour, for the rankings.
+    """
+    hour = _view_hour() if field == 'views' else 0
+    try:
+        _connection().execute(
+            'INSERT INTO increments (model, pk, field, hour, delta) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (model, pk, field, hour) DO UPDATE SET delta = delta + excluded.delta',
+            (instance._meta.label, instance.pk, field, hour, amount),
+        )
+    except sqlite3.OperationalError:
+        # Spool locked or unavailable: fall back to a direct update
+        _apply([(instance._meta.label, instance.pk, field, hour, amount)])
+        return
+    if time.monotonic() - _last_flush['at'] >= flush_interval():
+        flush(blocking=False)
+
+
+def pending(field='views'):
+    """
+    Returns:
+        dict: {(model label, pk): delta} of increments of the field not yet flushed
+    """
+    rows = _connection().execute(
+        'SELECT model, pk, SUM(delta) FROM (SELECT model, pk, field, delta FROM increments'
+        ' UNION ALL SELECT model, pk, field, delta FROM flushing) WHERE field = ? GROUP BY model, pk',
+        (field,),
+    )
+    return {(model, pk): delta for model, pk, delta in rows if delta}
+
+
+def pending_for(instance, field='views'):
+    """
+    Returns:
+        int: the instance's increments of the field not yet flushed
+    """
+    try:
+        row = _connection().execute(
+            'SELECT SUM(delta) FROM (SELECT model, pk, field, delta FROM increments'
+            ' UNION ALL SELECT model, pk, field, delta FROM flushing)'
+            ' WHERE model = ? AND pk = ? AND field = ?',
+            (instance._meta.label, instance.pk, field),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def flush(blocking=True):
+    """
+    Apply pending increments to the database
+
+    Args:
+        blocking: wait for another process' flush to finish instead of
+            skipping this one
+
+    Returns:
+        int: number of rows updated
+    """
+    _last_flush['at'] = time.monotonic()
+    conn = _connection()
+    if not blocking:
+        conn.execute('PRAGMA busy_timeout = 0')
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError:
+        # Another worker is writing to or flushing the spool
+        return 0
+    finally:
+        if not blocking:
+            conn.execute(f'PRAGMA busy_timeout = {LOCK_TIMEOUT * 1000}')
+
+    try:
+        conn.execute(
+            'INSERT INTO flushing (flush_id, model, pk, field, hour, delta)'
+            ' SELECT ?, model, pk, field, hour, delta FROM increments WHERE delta != 0',
+            (uuid.uuid4().hex,),
+        )
+        conn.execute('DELETE FROM increments')
+        # Batches left by an interrupted flush are applied with this one
+        rows = conn.execute('SELECT flush_id, model, pk, field, hour, delta FROM flushing').fetchall()
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+    batches = defaultdict(list)
+    for flush_id, *row in rows:
+        batches[flush_id].append(row)
+    updated = 0
+    for flush_id, batch in batches.items():
+        updated += _apply(batch, flush_id)
+        conn.execute('DELETE FROM flushing WHERE flush_id = ?', (flush_id,))
+    return updated
+
+
+def _apply(rows, flush_id=None):
+    totals, views = defaultdict(int), defaultdict(int)
+    for model, pk, field, hour, delta in rows:
+        totals[(model, pk, field)] += delta
+        if field == 'views' and delta > 0:
+            views[(model, pk, hour)] += delta
+    # Group pks by model, field and delta, so each distinct delta is one UPDATE
+    batches = defaultdict(list)
+    for (model, pk, field), delta in totals.items():
+        if delta:
+            batches[(model, field, delta)].append(pk)
+
+    # Imported here: the models module imports this one
+    from .rankings import record_views
+
+    updated = 0
+    with transaction.atomic():
+        if flush_id is not None:
+            flushes = apps.get_model('poems.CounterFlush').objects
+            # Another worker applying the same batch makes this wait for its
+            # commit, then find the id
+            if not flushes.get_or_create(flush_id=flush_id)[1]:
+                return 0
+            flushes.filter(applied_at__lt=timezone.now() - FLUSH_ID_RETENTION).delete()
+        for (label, field, delta), pks in batches.items():
+            model = apps.get_model(label)
+            value = F(field) + delta
+            if delta < 0:
+                # Never below zero, even if the count had drifted
+                value = Greatest(value, 0)
+            updated += model.objects.filter(pk__in=pks).update(**{field: value})
+        if views:
+            # The hourly buckets trending and popular rankings are built from
+            record_views(views)
+    return updated
@@ -0,0 +1,99 @@
+import functools
+import time
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+
+from . import counters
+
+DEFAULT_WINDOW = 3 * 60 * 60  # seconds
+MAX_ENTRIES = 100
+
+
+def _decode(value, now, window):
+    """
+    Parse 'id.minute-id.minute' into {id: minute}, dropping expired entries
+    """
+    seen = {}
+    for entry in (value or '').split('-'):
+        try:
+            pk, minute = (int(part, 36) for part in entry.split('.'))
+        except ValueError:
+            continue
+        if now - minute * 60 < window:
+            seen[pk] = minute
+    return seen
+
+
+def _encode(seen):
+    recent = sorted(seen.items(), key=lambda item: item[1])[-MAX_ENTRIES:]
+    return '-'.join(f'{base36(pk)}.{base36(minute)}' for pk, minute in recent)
+
+
+def base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        out = digits[remainder] + out
+        if not number:
+            return out
+
+
+def count_view_once(model, cookie_name):
+    """
+    Count a view of the object a detail view shows (its `pk` URL kwarg)
+    at most once per client within VIEW_DEDUP_WINDOW seconds.
+
+    The ids a client has viewed recently are kept in a compact signed
+    cookie instead of the database session, so counting a view costs no
+    session write. Clients that don't keep cookies (most crawlers) are
+    counted on every request, as they were with sessions.
+    """
+    salt = f'poems.views.{cookie_name}'
+
+    def unseen(request, response, kwargs):
+        """
+        Remember the view in the response cookie
+
+        Returns:
+            int or None: the pk to count, or None if already counted
+        """
+        window = getattr(settings, 'VIEW_DEDUP_WINDOW', DEFAULT_WINDOW)
+        now = int(time.time())
+        value = request.get_signed_cookie(cookie_name, None, salt=salt, max_age=window)
+        seen = _decode(value, now, window)
+        pk = int(kwargs['pk'])
+        if pk in seen:
+            return None
+
+        seen[pk] = now // 60
+        response.set_signed_cookie(
+            cookie_name, _encode(seen), salt=salt, max_age=window, httponly=True,
+            secure=settings.SESSION_COOKIE_SECURE, samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+        return pk
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response = await view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    pk = unseen(request, response, kwargs)
+                    if pk is not None:
+                        # May flush the spool to the database
+                        await sync_to_async(counters.increment)(model(pk=pk))
+                return response
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                pk = unseen(request, response, kwargs)
+                if pk is not None:
+                    counters.increment(model(pk=pk))
+            return response
+        return wrapper
+    return decorator
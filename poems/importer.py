@@ -0,0 +1,282 @@
+"""
+Streaming bulk import of authors, themes and poems.
+
+Reads Django dumpdata JSON arrays or NDJSON one record at a time, and
+upserts in batches with bulk_create(update_conflicts=True), matching
+existing rows by slug. Each batch runs in its own transaction.
+
+Records are either dumpdata objects ({"model": "poems.poem", "pk": 3,
+"fields": {...}}) or bare field dicts when the model is given by the
+caller. A poem's author and category may reference a pk from the same
+dump, a slug, or an id already in the database. A malformed record or an
+unknown reference raises RecordError, naming the file and the record's
+position in it.
+"""
+import json
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import cache, catalog, search
+from .models import Author, Poem, Theme, make_excerpt
+from .queries import recount_poems
+
+READ_SIZE = 1 << 16
+
+MODELS = {
+    'poems.author': Author,
+    'poems.theme': Theme,
+    'poems.poem': Poem,
+}
+
+FIELD_NAMES = {
+    model: {field.name for field in model._meta.concrete_fields} - {'id'}
+    for model in MODELS.values()
+}
+
+# Fields refreshed when an existing row (same slug) is imported again.
+# View and like counters are left alone so re-imports don't reset them.
+UPDATE_FIELDS = {
+    Author: ['name', 'bio', 'photo', 'updated_at'],
+    Theme: ['title'],
+    Poem: ['title', 'author', 'text', 'excerpt', 'theme', 'category', 'updated_at'],
+}
+
+
+class RecordError(ValueError):
+    """A record can't be imported; the message says which one"""
+
+
+def iter_json_array(fp):
+    """
+    Yield the items of a top-level JSON array without reading it whole
+
+    Raises:
+        ValueError: If the top-level value is not an array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Skip whitespace up to the array, then separators between items
+        while position < len(buffer):
+            char = buffer[position]
+            if not started:
+                if char == '[':
+                    started = True
+                elif not char.isspace():
+                    raise ValueError('Expected a JSON array of records')
+            elif char not in ' \t\r\n,[]':
+                break
+            position += 1
+        if position < len(buffer) and started:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield item
+                position = end
+                continue
+        if eof:
+            return
+        chunk = fp.read(READ_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_ndjson(fp):
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_records(fp, fmt=None):
+    """
+    Args:
+        fmt: 'json' or 'ndjson'; guessed from the first character if None
+    """
+    if fmt is None:
+        first = fp.read(1)
+        while first and first.isspace():
+            first = fp.read(1)
+        fmt = 'json' if first == '[' else 'ndjson'
+        fp = _Prepend(first, fp)
+    return iter_json_array(fp) if fmt == 'json' else iter_ndjson(fp)
+
+
+class _Prepend:
+    def __init__(self, head, fp):
+        self.head, self.fp = head, fp
+
+    def read(self, size=-1):
+        head, self.head = self.head, ''
+        return head + self.fp.read(size if size < 0 else max(size - len(head), 0))
+
+    def __iter__(self):
+        head, self.head = self.head, ''
+        lines = iter(self.fp)
+        first = next(lines, '')
+        yield head + first
+        yield from lines
+
+
+class CatalogImporter:
+    """
+    Usage:
+        importer = CatalogImporter(batch_size=1000, progress=print)
+        importer.feed(records)
+        importer.finish()
+    """
+
+    def __init__(self, batch_size=1000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.pending = {Author: [], Theme: [], Poem: []}
+        # pk in the dump -> id in the database, per model
+        self.ids = {Author: {}, Theme: {}}
+        self.slugs = {Author: {}, Theme: {}}
+        # Ids referenced directly, checked to exist in the database
+        self.known_ids = {Author: set(), Theme: set()}
+        self.counts = {Author: 0, Theme: 0, Poem: 0}
+
+    def feed(self, records, model=None, source=None):
+        """
+        Args:
+            source: name of the file the records come from, for errors
+        """
+        for index, record in enumerate(records, 1):
+            self.add(record, model, f'{source}: record {index}' if source else f'record {index}')
+
+    def add(self, record, model=None, where='record'):
+        if not isinstance(record, dict):
+            raise RecordError(f'{where}: expected an object')
+        if 'fields' in record:
+            model = MODELS.get(str(record.get('model')).lower())
+            if model is None:
+                raise RecordError(f"{where}: unknown model {record.get('model')!r}")
+            dump_pk, fields = record.get('pk'), record['fields']
+        else:
+            if model is None:
+                raise RecordError(f'{where}: not a dumpdata object, and no model given')
+            dump_pk, fields = record.get('id'), record
+        if 'slug' not in fields:
+            raise RecordError(f'{where}: no slug')
+        self.pending[model].append((where, dump_pk, fields))
+        if len(self.pending[model]) >= self.batch_size:
+            self.flush(model)
+
+    def finish(self):
+        for model in (Author, Theme, Poem):
+            self.flush(model)
+        return self.counts
+
+    def flush(self, model):
+        if model is Poem:
+            # Poems reference authors and themes, which must exist first
+            self.flush(Author)
+            self.flush(Theme)
+        batch, self.pending[model] = self.pending[model], []
+        if not batch:
+            return
+
+        # A slug may appear twice in a dump; the last record wins, and the
+        # database would reject a batch touching the same row twice
+        batch = list({fields['slug']: (where, dump_pk, fields) for where, dump_pk, fields in batch}.values())
+        now = timezone.now()
+        objects = [self._build(model, fields, now, where) for where, _, fields in batch]
+        with transaction.atomic():
+            rows = model.objects.filter(slug__in=[obj.slug for obj in objects])
+            if model is Poem:
+                # An upsert may move a poem away from its author and theme
+                existing = {slug: relations for slug, *relations in rows.values_list('slug', 'author_id', 'category_id')}
+            else:
+                existing = set(rows.values_list('slug', flat=True))
+            objects = model.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=UPDATE_FIELDS[model],
+            )
+            if model in self.ids:
+                for (_, dump_pk, _), obj in zip(batch, objects):
+                    if dump_pk is not None:
+                        self.ids[model][dump_pk] = obj.pk
+            if model is Poem:
+                self._reindex(objects)
+                self._recount(objects, existing.values())
+            catalog.bump()
+
+        self._invalidate(model, objects, existing)
+        self.counts[model] += len(objects)
+        if self.progress:
+            self.progress(model, self.counts[model])
+
+    def _build(self, model, fields, now, where):
+        names = FIELD_NAMES[model]
+        values = {name: fields[name] for name in fields if name in names}
+        if model is Poem:
+            if values.get('author') is None:
+                raise RecordError(f'{where}: no author')
+            values['author_id'] = self._resolve(Author, values.pop('author'), where)
+            category = values.pop('category', None)
+            values['category_id'] = self._resolve(Theme, category, where) if category is not None else None
+            values['excerpt'] = make_excerpt(values.get('text', ''))
+        if model is not Theme:
+            created_at = values.get('created_at')
+            values['created_at'] = parse_datetime(created_at) if isinstance(created_at, str) else (created_at or now)
+            values['updated_at'] = now
+        return model(**values)
+
+    def _resolve(self, model, reference, where):
+        """Map a dump pk, a slug or a [slug] natural key to a database id"""
+        if isinstance(reference, list) and reference:
+            reference = reference[0]
+        pk = None
+        if isinstance(reference, str):
+            if reference not in self.slugs[model]:
+                rows = model.objects.filter(slug=reference).values_list('id', flat=True)
+                self.slugs[model][reference] = rows.first()
+            pk = self.slugs[model][reference]
+        elif isinstance(reference, int):
+            pk = self.ids[model].get(reference)
+            if pk is None and (reference in self.known_ids[model] or model.objects.filter(pk=reference).exists()):
+                self.known_ids[model].add(reference)
+                pk = reference
+        if pk is None:
+            raise RecordError(f'{where}: unknown {model._meta.model_name} {reference!r}')
+        return pk
+
+    def _reindex(self, poems):
+        poem_ids = [poem.pk for poem in poems]
+        search.index_poems(Poem.objects.filter(id__in=poem_ids).select_related('author'))
+
+    def _recount(self, poems, previous_relations):
+        # bulk_create sends no signals, so the stored poem counts of every
+        # author and theme on either side of the batch are recomputed
+        author_ids = {poem.author_id for poem in poems} | {author_id for author_id, _ in previous_relations}
+        theme_ids = {poem.category_id for poem in poems} | {theme_id for _, theme_id in previous_relations}
+        recount_poems(author_ids, theme_ids - {None})
+
+    def _invalidate(self, model, objects, existing):
+        # bulk_create sends no signals; expire the responses it affects.
+        # Rows that didn't exist before have no cached responses of their own.
+        updated = [obj for obj in objects if obj.slug in existing]
+        prefix = {Author: 'author', Theme: 'theme', Poem: 'poem'}[model]
+        tags = ['poems', 'authors', 'themes', 'featured']
+        tags.extend(f'{prefix}:{obj.pk}' for obj in updated)
+        if model is Poem:
+            relations = [(p.author_id, p.category_id) for p in objects] + list(existing.values())
+            tags.extend({f'author:{a}' for a, _ in relations} | {f'theme:{t}' for _, t in relations})
+        elif updated:
+            # Poem responses embed their author and theme
+            field = 'author_id__in' if model is Author else 'category_id__in'
+            poem_ids = Poem.objects.filter(**{field: [obj.pk for obj in updated]}).values_list('id', flat=True)
+            tags.extend(f'poem:{pk}' for pk in poem_ids)
+        cache.invalidate(*tags)
@@ -0,0 +1,123 @@
+"""
+Likes of poems: POST /api/v1/poems/<id>/like/ likes a poem, DELETE unlikes it.
+
+Both are idempotent per client. The ids of the poems a client likes are
+kept in a signed cookie, not in the database session, so liking a poem
+twice, or unliking one the client does not like, changes nothing. The
+cookie holds the LIKED_POEMS_LIMIT most recent likes.
+
+The cookie is the client's to keep: a client that does not send it back
+(curl, a script) is not deduplicated, and each of its likes counts. What
+bounds such a client is LikeRateThrottle, LIKE_THROTTLE_RATE likes and
+unlikes per client address. Both routes are exempt from CSRF checks, like
+DRF's views, so a browser request from another site is refused by
+AllowedOrigin instead.
+
+The +1 or -1 goes through the write-behind counter spool (poems/counters.py)
+like a page view: every worker records it in the local SQLite spool, and
+the flush applies each poem's net change with one F() update. A burst of
+likes on the featured poem is one row update per flush interval, not one
+row lock per request.
+
+The count in the response is the stored count plus what is still in the
+spool. Cached poem responses show the count they were cached with, as
+they do for views.
+"""
+import datetime
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+from rest_framework.throttling import SimpleRateThrottle
+
+from . import counters
+from .decorators import base36
+from .models import Poem
+
+COOKIE_NAME = 'liked_poems'
+COOKIE_SALT = 'poems.likes'
+COOKIE_MAX_AGE = int(datetime.timedelta(days=365).total_seconds())
+# About 2 KB of cookie
+DEFAULT_LIMIT = 500
+DEFAULT_THROTTLE_RATE = '30/minute'
+
+
+class LikeRateThrottle(SimpleRateThrottle):
+    """
+    Likes and unlikes per client address (behind REST_FRAMEWORK's
+    NUM_PROXIES proxies), counted in the default cache
+    """
+    scope = 'likes'
+
+    def get_rate(self):
+        return getattr(settings, 'LIKE_THROTTLE_RATE', DEFAULT_THROTTLE_RATE)
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AllowedOrigin(BasePermission):
+    """
+    Refuse likes sent by a page on another site. Browsers send Origin
+    with every cross-site POST and DELETE; clients that send none are let
+    through (and throttled).
+    """
+    message = 'Origin not allowed.'
+
+    def has_permission(self, request, view):
+        origin = request.META.get('HTTP_ORIGIN')
+        if origin is None:
+            return True
+        allowed = {
+            f'{request.scheme}://{request.get_host()}',
+            *getattr(settings, 'CORS_ALLOWED_ORIGINS', ()),
+            *settings.CSRF_TRUSTED_ORIGINS,
+        }
+        return origin in allowed
+
+
+def liked_poems(request):
+    """
+    Returns:
+        list: ids of the poems the client likes, oldest like first
+    """
+    value = request.get_signed_cookie(COOKIE_NAME, None, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+    ids = []
+    for entry in (value or '').split('-'):
+        try:
+            ids.append(int(entry, 36))
+        except ValueError:
+            continue
+    return ids
+
+
+def remember(response, ids):
+    limit = getattr(settings, 'LIKED_POEMS_LIMIT', DEFAULT_LIMIT)
+    response.set_signed_cookie(
+        COOKIE_NAME, '-'.join(base36(pk) for pk in ids[-limit:]), salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE,
+        httponly=True, secure=settings.SESSION_COOKIE_SECURE, samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
+
+
+def like(request, pk, liked=True):
+    """
+    Like or unlike a poem for the requesting client
+
+    Returns:
+        tuple: (response data, or None if there is no such poem; the liked
+            ids to remember, or None if the client's likes are unchanged)
+    """
+    stored = Poem.objects.filter(pk=pk).values_list('likes', flat=True).first()
+    if stored is None:
+        return None, None
+
+    poem = Poem(pk=pk)
+    ids = liked_poems(request)
+    changed = (pk in ids) != liked
+    if changed:
+        ids = [other for other in ids if other != pk] + ([pk] if liked else [])
+    likes = stored + counters.pending_for(poem, 'likes')
+    if changed:
+        counters.increment(poem, 1 if liked else -1, field='likes')
+        likes += 1 if liked else -1
+    data = {'id': pk, 'liked': liked, 'likes': max(likes, 0)}
+    return data, (ids if changed else None)
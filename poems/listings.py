@@ -0,0 +1,109 @@
+"""
+Queries and serialization of the API's list responses, shared by the sync
+views (api_views) and their async versions (async_views).
+
+Each *_rows() function returns an unevaluated queryset: .values() rows on
+the fast path (settings.API_FAST_SERIALIZATION), model instances
+otherwise. The views only evaluate it, through the sync or the async ORM,
+and pass the rows to the matching serialize_*() function.
+"""
+from . import projections, search
+from .models import Author, Theme
+from .queries import poems_for_listing
+from .serializers import AuthorSerializer, PoemSerializer, ThemeSerializer
+
+# Poem bodies are left out of list responses unless asked for with ?fields=
+LIST_DEFAULT_EXCLUDE = ('text',)
+
+# Newest first, the order of KeysetPagination; served by the (created_at,
+# id) index and its per-author and per-theme variants
+FEED_ORDERING = ('-created_at', '-id')
+
+LATEST_COUNT = 9
+
+
+def poem_rows(fields=None, exclude=None):
+    """
+    Poems for list responses. Poem text is not loaded unless the response
+    includes it.
+    """
+    if projections.enabled():
+        return projections.poem_values(fields, exclude)
+    if 'text' not in projections.selected(PoemSerializer.Meta.fields, fields, exclude):
+        return poems_for_listing().defer('text')
+    return poems_for_listing()
+
+
+def serialize_poems(poems, fields=None, exclude=None):
+    if projections.enabled():
+        return projections.poems(poems, fields, exclude)
+    return PoemSerializer(poems, many=True, fields=fields, exclude=exclude).data
+
+
+def feed_rows(fields=None, exclude=None, **filters):
+    """The newest-first feed of all poems, or of those matching filters (author_id or category_id)"""
+    return poem_rows(fields, exclude).filter(**filters).order_by(*FEED_ORDERING)
+
+
+def latest_rows(fields=None, exclude=None):
+    return poem_rows(fields, exclude).order_by('-created_at')[:LATEST_COUNT]
+
+
+def trending_rows(fields=None, exclude=None):
+    return poem_rows(fields, exclude).filter(trending__isnull=False).order_by('trending__rank')
+
+
+def _author_rows():
+    return projections.author_values() if projections.enabled() else Author.objects.all()
+
+
+def listed_author_rows():
+    """Authors with at least one poem, by name"""
+    return _author_rows().filter(poems_count__gt=0).order_by('name')
+
+
+def popular_author_rows():
+    return _author_rows().filter(popularity__isnull=False).order_by('popularity__rank')
+
+
+def serialize_authors(authors, fields=None, exclude=None):
+    if projections.enabled():
+        return projections.authors(authors, fields, exclude)
+    return AuthorSerializer(authors, many=True, fields=fields, exclude=exclude).data
+
+
+def theme_rows():
+    return projections.theme_values() if projections.enabled() else Theme.objects.all()
+
+
+def serialize_themes(themes, fields=None, exclude=None):
+    if projections.enabled():
+        return projections.themes(themes, fields, exclude)
+    return ThemeSerializer(themes, many=True, fields=fields, exclude=exclude).data
+
+
+def search_results(query, page_ids, fields=None, exclude=None):
+    """
+    The poems of a page of search.ranked(query), with their snippets
+
+    Returns:
+        tuple: (queryset of the page's poems, function building the results
+            from its rows, in rank order)
+    """
+    # Always load the id (to keep the ranking) and the text (to cut the
+    # snippet from), then ship only the requested fields
+    shipped = projections.selected(PoemSerializer.Meta.fields, fields, exclude)
+    load_fields = None if fields is None else {*fields, 'id', 'text'}
+    load_exclude = exclude - {'id', 'text'}
+
+    def build(rows):
+        poems = {poem['id']: poem for poem in serialize_poems(rows, load_fields, load_exclude)}
+        results = []
+        # A poem deleted since the page was ranked is left out
+        for poem in (poems[poem_id] for poem_id in page_ids if poem_id in poems):
+            data = {name: poem[name] for name in shipped}
+            data['snippet'] = search.highlight(poem['text'], query)
+            results.append(data)
+        return results
+
+    return poem_rows(load_fields, load_exclude).filter(id__in=page_ids), build
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from poems import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a running server with concurrent clients, to compare the WSGI and ASGI '
+        'profiles (start.sh) at the same WEB_CONCURRENCY'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Base URL of the running server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, action='append', help='Concurrent clients; repeatable')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+        parser.add_argument('--seed', type=int, default=benchmark.DEFAULT_SEED, help='Seed the corpus was generated with')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        # A mix of API reads, with query strings so that the response
+        # cache doesn't answer everything
+        paths = [
+            url + ('&' if '?' in url else '?') + f'nocache={n}'
+            for n in range(50)
+            for name, url in benchmark.route_urls() if name.startswith('api_') and name != 'api_search_poems'
+        ]
+        paths += [f"{reverse('api_search_poems')}?q={benchmark.Corpus(options['seed']).search_term}"]
+
+        results = []
+        for concurrency in options['concurrency'] or [1, 10, 50]:
+            result = benchmark.load(options['url'], paths, concurrency=concurrency, duration=options['duration'])
+            results.append(result)
+            self.stdout.write(
+                f"{concurrency:>4} clients  {result['throughput']:>8.1f} req/s  p50 {result['p50_ms']} ms  "
+                f"p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  {result['errors']} errors"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fp:
+                json.dump({'url': options['url'], 'results': results}, fp, indent=2)
+                fp.write('\n')
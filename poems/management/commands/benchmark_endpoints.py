@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from poems import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measure throughput, latency, query count and response size of every public endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--cold', action='store_true', help='Clear the response cache before every request')
+        parser.add_argument('--seed', type=int, default=benchmark.DEFAULT_SEED, help='Seed the corpus was generated with')
+        parser.add_argument('--route', action='append', dest='routes', help='Only benchmark this route name')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='Report to compare against; regressions fail the command')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as fp:
+                    baseline = json.load(fp)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"{options['baseline']}: {e}")
+
+        def progress(name, result):
+            self.stdout.write(
+                f"{name:<22} {result['throughput']:>9.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  "
+                f"p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms  "
+                f"{result['queries']:>3} queries  {result['bytes']:>8} B"
+            )
+
+        report = benchmark.run(
+            requests=options['requests'],
+            warmup=options['warmup'],
+            cold=options['cold'],
+            search_term=benchmark.Corpus(options['seed']).search_term,
+            routes=options['routes'],
+            progress=progress,
+        )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fp:
+                json.dump(report, fp, indent=2, ensure_ascii=False)
+                fp.write('\n')
+
+        if baseline is not None:
+            found = benchmark.regressions(report, baseline, tolerance=options['tolerance'])
+            if found:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(found))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
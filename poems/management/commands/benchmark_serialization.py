@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from poems import projections
+from poems.queries import poems_for_listing
+from poems.renderers import FastJSONRenderer
+from poems.serializers import PoemSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare ModelSerializer and .values() serialization of poem list pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=21)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        size, repeat = options['page_size'], options['repeat']
+
+        def serializer_path():
+            poems = poems_for_listing().order_by('-created_at')[:size]
+            return PoemSerializer(poems, many=True).data
+
+        def values_path():
+            return projections.poems(projections.poem_values().order_by('-created_at')[:size])
+
+        serialized = serializer_path()
+        if serialized != values_path():
+            self.stderr.write(self.style.ERROR('Serializer and values() output differ'))
+            return
+
+        results = [
+            ('serializers', self._time(serializer_path, repeat)),
+            ('values()', self._time(values_path, repeat)),
+            ('JSONRenderer', self._time(lambda: JSONRenderer().render(serialized), repeat)),
+            ('FastJSONRenderer', self._time(lambda: FastJSONRenderer().render(serialized), repeat)),
+        ]
+        self.stdout.write(f'{len(serialized)} poems per page, {repeat} runs')
+        for name, seconds in results:
+            self.stdout.write(f'{name:<18} {seconds * 1000:8.3f} ms per page')
+        self.stdout.write(self.style.SUCCESS(
+            f'values() speedup: {results[0][1] / results[1][1]:.1f}x, '
+            f'renderer speedup: {results[2][1] / results[3][1]:.1f}x'
+        ))
+
+    def _time(self, func, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat
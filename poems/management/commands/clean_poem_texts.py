@@ -0,0 +1,41 @@
+import difflib
+import os
+
+from django.core.management.base import BaseCommand
+
+from poems.cleaning import clean_poems
+
+
+class Command(BaseCommand):
+    help = 'Strip HTML and stray whitespace from poem texts, writing back only the poems that change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-id', type=int, help='First poem id to clean (inclusive)')
+        parser.add_argument('--end-id', type=int, help='Last poem id to clean (inclusive)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Cleaning processes; 1 cleans in-process')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without saving them')
+        parser.add_argument('--diff', action='store_true', help='Print a unified diff of each changed text')
+
+    def handle(self, *args, **options):
+        def show_diff(pk, old, new):
+            for line in difflib.unified_diff(
+                old.splitlines(), new.splitlines(),
+                fromfile=f'poem {pk}', tofile=f'poem {pk} (cleaned)', lineterm='',
+            ):
+                self.stdout.write(line)
+
+        def progress(last_id, checked, changed):
+            self.stdout.write(f'Checked {checked} poems up to id {last_id}, {changed} changed')
+
+        checked, changed = clean_poems(
+            start_id=options['start_id'],
+            end_id=options['end_id'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            on_change=show_diff if options['diff'] else None,
+            progress=progress if options['verbosity'] > 0 else None,
+        )
+        verb = 'would change' if options['dry_run'] else 'changed'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} poems, {verb} {changed}'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from poems.snapshot import SnapshotExporter
+
+
+class Command(BaseCommand):
+    help = 'Pre-render the read API into static JSON files, rewriting only what changed since the last export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Output directory; its manifest.json tracks what was exported')
+        parser.add_argument('--base-url', default='/', help='URL the directory is served from, for pagination links')
+        parser.add_argument('--full', action='store_true', help='Ignore the manifest and rewrite every file')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        stats = SnapshotExporter(
+            options['directory'],
+            base_url=options['base_url'],
+            full=options['full'],
+            batch_size=options['batch_size'],
+        ).export()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {stats['written']} files, {stats['unchanged']} unchanged, {stats['removed']} removed "
+            f'in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from poems import counters
+
+
+class Command(BaseCommand):
+    help = 'Apply buffered page view increments to authors and poems'
+
+    def handle(self, *args, **options):
+        updated = counters.flush()
+        self.stdout.write(self.style.SUCCESS(f'Updated views on {updated} rows'))
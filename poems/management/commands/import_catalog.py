@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from poems.importer import MODELS, CatalogImporter, RecordError, iter_records
+
+
+class Command(BaseCommand):
+    help = 'Stream authors, themes and poems from JSON or NDJSON dumps into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Dump files, imported in the given order')
+        parser.add_argument('--format', choices=['json', 'ndjson'], help='Guessed from the file when omitted')
+        parser.add_argument(
+            '--model', choices=['author', 'theme', 'poem'],
+            help='Model of records that are bare field dicts rather than dumpdata objects',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        model = MODELS[f"poems.{options['model']}"] if options['model'] else None
+        started = time.monotonic()
+
+        def progress(batch_model, count):
+            rate = count / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'{batch_model._meta.verbose_name_plural}: {count} ({rate:.0f}/s)')
+
+        importer = CatalogImporter(batch_size=options['batch_size'], progress=progress)
+        for path in options['files']:
+            try:
+                with open(path, encoding='utf-8') as fp:
+                    importer.feed(iter_records(fp, options['format']), model=model, source=path)
+            except RecordError as e:
+                # Already names the file, which may be an earlier one
+                raise CommandError(e)
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'{path}: {e}')
+        try:
+            counts = importer.finish()
+        except RecordError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported ' + ', '.join(f'{count} {m._meta.verbose_name_plural.lower()}' for m, count in counts.items())
+            + f' in {time.monotonic() - started:.1f}s'
+        ))
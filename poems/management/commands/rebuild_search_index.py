@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from poems import search
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-index all poems, one batch at a time. A one-off repair after the '
+        'tokenizer or the weights change; the index is otherwise kept up to date.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} poems'))
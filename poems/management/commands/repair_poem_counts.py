@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from poems import cache, catalog
+from poems.models import Author, Poem, Theme
+from poems.services import FeaturedPoemService
+from poems.queries import drifted_poem_counts, recount_poems
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored poem counts of authors and themes that have drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted rows')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = drifted_poem_counts()
+            authors, themes = drifted[Author], drifted[Theme]
+            if not options['dry_run'] and (authors or themes):
+                recount_poems(authors, themes)
+                catalog.bump()
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        message = f'{verb} {len(authors)} author and {len(themes)} theme counts'
+        if options['dry_run'] or not (authors or themes):
+            self.stdout.write(message)
+            return
+
+        # Poem responses embed their author's and theme's counts
+        poem_ids = Poem.objects.filter(author_id__in=authors).values_list('id', flat=True).union(
+            Poem.objects.filter(category_id__in=themes).values_list('id', flat=True)
+        )
+        cache.invalidate(
+            'poems', 'authors', 'themes', 'featured',
+            *(f'author:{pk}' for pk in authors),
+            *(f'theme:{pk}' for pk in themes),
+            *(f'poem:{pk}' for pk in poem_ids),
+        )
+        FeaturedPoemService.clear_cache()
+        self.stdout.write(self.style.SUCCESS(message))
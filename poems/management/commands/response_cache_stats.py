@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from poems import api_views  # noqa: F401  registers the cached endpoints
+from poems import cache
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counts of the API response cache'
+
+    def handle(self, *args, **options):
+        for endpoint, counts in cache.stats().items():
+            total = counts['hits'] + counts['misses']
+            ratio = counts['hits'] / total if total else 0
+            self.stdout.write(f"{endpoint:<16} hits={counts['hits']:<8} misses={counts['misses']:<8} ratio={ratio:.2%}")
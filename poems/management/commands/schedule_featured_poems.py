@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from poems.services import FeaturedPoemService
+
+
+class Command(BaseCommand):
+    help = 'Pick featured poems ahead of time for the next N days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        try:
+            scheduled = FeaturedPoemService.schedule(today, options['days'])
+        except ValueError as e:
+            self.stderr.write(self.style.ERROR(str(e)))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Scheduled {scheduled} new featured poems through the next {options['days']} days"
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from poems.benchmark import DEFAULT_SEED, generate_corpus
+from poems.models import Poem
+
+
+class Command(BaseCommand):
+    help = 'Fill a local SQLite database with a deterministic synthetic catalog for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poems', type=int, default=1000, help='e.g. 1000, 100000 or 1000000')
+        parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-index', action='store_true', help='Skip building the search index')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(
+                'Refusing to seed a non-SQLite database; point DATABASE_URL at a local file, '
+                'e.g. DATABASE_URL=sqlite:///benchmark.sqlite3'
+            )
+        if Poem.objects.filter(slug__startswith='bench-poem-').exists():
+            raise CommandError('This database already holds a benchmark corpus')
+
+        started = time.monotonic()
+
+        def progress(count):
+            self.stdout.write(f'Poems: {count} ({count / max(time.monotonic() - started, 1e-9):.0f}/s)')
+
+        corpus = generate_corpus(
+            poems=options['poems'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            index=not options['no_index'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {options['poems']} poems in {time.monotonic() - started:.1f}s; "
+            f'most common word: {corpus.search_term}'
+        ))
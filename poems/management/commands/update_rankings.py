@@ -0,0 +1,28 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from poems.rankings import HALF_LIFE, SIZE, WINDOW, update_rankings
+
+
+class Command(BaseCommand):
+    help = 'Recompute the trending poems and popular authors from the recent view buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=SIZE, help='Poems and authors kept in each ranking')
+        parser.add_argument(
+            '--half-life', type=float, default=HALF_LIFE.total_seconds() / 3600,
+            help='Hours after which a view counts half',
+        )
+        parser.add_argument(
+            '--window', type=float, default=WINDOW.days,
+            help='Days of views to rank; older view buckets are deleted',
+        )
+
+    def handle(self, *args, **options):
+        poems, authors = update_rankings(
+            size=options['size'],
+            half_life=datetime.timedelta(hours=options['half_life']),
+            window=datetime.timedelta(days=options['window']),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Ranked {poems} trending poems and {authors} popular authors'))
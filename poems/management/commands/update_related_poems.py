@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from poems.related import TOP_K, update_related
+
+
+class Command(BaseCommand):
+    help = 'Recompute the similar poems shown with each poem, for the poems changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every poem, with fresh word weights')
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Similar poems kept per poem')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        def progress(written, total):
+            self.stdout.write(f'Wrote {written} of {total} poems')
+
+        compared, changed = update_related(
+            full=options['full'],
+            top_k=options['top_k'],
+            batch_size=options['batch_size'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Compared {compared} poems, {changed} with new similar poems'))
@@ -0,0 +1,354 @@
+"""
+Per-route request metrics in Prometheus text format.
+
+MetricsMiddleware records, per resolved URL name, a latency histogram,
+request counts by status, database query count and time, response bytes
+and response cache hits and misses (from the X-Cache header set by
+poems.cache.cache_response).
+
+Queries are counted by an execute wrapper installed on every database
+connection, which adds to the timer of the request being served, found
+through a context variable. The async ORM runs queries in other threads
+with their own connections, and the context follows it there. Streaming
+responses (the NDJSON exports) are recorded when the stream ends, so
+their size, duration and queries cover the whole body.
+
+Each worker accumulates its samples in memory and adds them to a SQLite
+file shared by all workers on the host (METRICS_SPOOL) at most every
+METRICS_FLUSH_INTERVAL seconds, in one transaction. The /metrics view
+flushes its own worker first and renders the shared totals, so a scrape
+sees every worker, at most one interval behind. Values are cumulative and
+survive worker restarts, like Prometheus counters expect.
+"""
+import contextvars
+import hmac
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+
+from .counters import enable_wal
+
+DEFAULT_SPOOL_PATH = os.path.join(settings.BASE_DIR, 'metrics.sqlite3')
+DEFAULT_FLUSH_INTERVAL = 10
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOCK_TIMEOUT = 5
+UNMATCHED = 'unmatched'
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+PREFIX = 'wuserade_'
+METRICS = {
+    # name: (type, help)
+    'http_request_duration_seconds': ('histogram', 'Time spent handling requests, by route'),
+    'http_requests_total': ('counter', 'Requests handled, by route and status code'),
+    'http_response_bytes_total': ('counter', 'Response body bytes sent, after compression'),
+    'db_queries_total': ('counter', 'Database queries run while handling requests'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in database queries'),
+    'response_cache_requests_total': ('counter', 'Response cache lookups, by result (hit or miss)'),
+}
+
+_local = threading.local()
+_current_timer = contextvars.ContextVar('metrics_query_timer', default=None)
+_lock = threading.Lock()
+_pending = defaultdict(float)
+_last_flush = {'at': time.monotonic()}
+
+
+def spool_path():
+    return str(getattr(settings, 'METRICS_SPOOL', DEFAULT_SPOOL_PATH))
+
+
+def buckets():
+    return getattr(settings, 'METRICS_BUCKETS', DEFAULT_BUCKETS)
+
+
+def _connection():
+    path = spool_path()
+    key = (os.getpid(), path)
+    conn = getattr(_local, 'conns', {}).get(key)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        enable_wal(conn, LOCK_TIMEOUT)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS samples ('
+            ' name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,'
+            ' PRIMARY KEY (name, labels))'
+        )
+        _local.conns = {key: conn}
+    return conn
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def record(route, method, status, duration, size, queries=0, query_time=0.0, cache_result=None):
+    """
+    Add one request's samples to this worker's pending totals
+    """
+    labels = _labels(route=route, method=method)
+    # Bucket counts are stored per bucket and made cumulative when rendered
+    bucket = next((f'{bound}' for bound in buckets() if duration <= bound), '+Inf')
+    with _lock:
+        _pending[('http_request_duration_seconds_bucket', _labels(route=route, method=method, le=bucket))] += 1
+        _pending[('http_request_duration_seconds_sum', labels)] += duration
+        _pending[('http_request_duration_seconds_count', labels)] += 1
+        _pending[('http_requests_total', _labels(route=route, method=method, status=status))] += 1
+        _pending[('http_response_bytes_total', labels)] += size
+        _pending[('db_queries_total', labels)] += queries
+        _pending[('db_query_duration_seconds_total', labels)] += query_time
+        if cache_result:
+            _pending[('response_cache_requests_total', _labels(route=route, result=cache_result))] += 1
+    if time.monotonic() - _last_flush['at'] >= getattr(settings, 'METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL):
+        flush()
+
+
+def flush():
+    """
+    Add this worker's pending samples to the shared totals
+
+    Returns:
+        int: number of samples written
+    """
+    _last_flush['at'] = time.monotonic()
+    with _lock:
+        samples = dict(_pending)
+        _pending.clear()
+    if not samples:
+        return 0
+
+    conn = _connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(
+            'INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) '
+            'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+            [(name, labels, value) for (name, labels), value in samples.items()],
+        )
+        conn.execute('COMMIT')
+    except sqlite3.OperationalError:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        # Keep the samples for the next flush rather than losing them
+        with _lock:
+            for key, value in samples.items():
+                _pending[key] += value
+        return 0
+    return len(samples)
+
+
+def _bucket_bound(labels):
+    bound = dict(part.split('=', 1) for part in labels.split(','))['le'].strip('"')
+    return math.inf if bound == '+Inf' else float(bound)
+
+
+def _without_le(labels):
+    return ','.join(part for part in labels.split(',') if not part.startswith('le='))
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def render():
+    """
+    Returns:
+        str: the totals of all workers in Prometheus text format
+    """
+    flush()
+    rows = _connection().execute('SELECT name, labels, value FROM samples ORDER BY name, labels').fetchall()
+    by_name = defaultdict(list)
+    for name, labels, value in rows:
+        by_name[name].append((labels, value))
+
+    lines = []
+    for metric, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {PREFIX}{metric} {description}')
+        lines.append(f'# TYPE {PREFIX}{metric} {kind}')
+        if kind != 'histogram':
+            for labels, value in by_name[metric]:
+                lines.append(f'{PREFIX}{metric}{{{labels}}} {_number(value)}')
+            continue
+
+        counts = defaultdict(dict)
+        for labels, value in by_name[f'{metric}_bucket']:
+            counts[_without_le(labels)][_bucket_bound(labels)] = value
+        sums = dict(by_name[f'{metric}_sum'])
+        totals = dict(by_name[f'{metric}_count'])
+        for labels in sorted(totals):
+            cumulative = 0
+            for bound in [*buckets(), math.inf]:
+                cumulative += counts[labels].get(bound, 0)
+                le = '+Inf' if bound == math.inf else f'{bound}'
+                lines.append(f'{PREFIX}{metric}_bucket{{{labels},le="{le}"}} {_number(cumulative)}')
+            lines.append(f'{PREFIX}{metric}_sum{{{labels}}} {_number(sums.get(labels, 0))}')
+            lines.append(f'{PREFIX}{metric}_count{{{labels}}} {_number(totals[labels])}')
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryTimer:
+    """Counts and times the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+def _count_queries(execute, sql, params, many, context):
+    """Execute wrapper of every connection; times the query for the request being served"""
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def _watch(connection):
+    if _count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_queries)
+
+
+@receiver(connection_created)
+def watch_new_connection(sender, connection, **kwargs):
+    _watch(connection)
+
+
+@receiver(request_started)
+def watch_open_connections(sender, **kwargs):
+    """
+    Connections opened before this module was imported. Runs in the thread
+    the request's sync code and ORM calls use, under ASGI too.
+    """
+    for connection in connections.all(initialized_only=True):
+        _watch(connection)
+
+
+class MetricsMiddleware:
+    """
+    Record per-route metrics (see the module docstring). Place it first,
+    so the timings cover the other middleware and the recorded size is
+    the compressed one.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        token = _current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        return self._finish(request, response, start, timer)
+
+    async def __acall__(self, request):
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        token = _current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        return self._finish(request, response, start, timer)
+
+    def _finish(self, request, response, start, timer):
+        if not response.streaming:
+            self._record(request, response, time.perf_counter() - start, len(response.content), timer)
+            return response
+
+        def done(size):
+            self._record(request, response, time.perf_counter() - start, size, timer)
+
+        if response.is_async:
+            response.streaming_content = _measure_async(response.streaming_content, timer, done)
+        else:
+            response.streaming_content = _measure(response.streaming_content, timer, done)
+        return response
+
+    def _record(self, request, response, duration, size, timer):
+        match = getattr(request, 'resolver_match', None)
+        # Unresolved paths share one label, so scanners can't blow up the
+        # number of series
+        route = (match.url_name or match.view_name) if match else UNMATCHED
+        method = request.method if request.method in METHODS else 'other'
+        cache_result = response.get('X-Cache', '').lower() or None
+        record(route, method, response.status_code, duration, size, timer.count, timer.duration, cache_result)
+
+
+def _measure(content, timer, done):
+    """Stream content, counting its bytes and the queries producing it; done(size) runs at the end"""
+    size = 0
+    chunks = iter(content)
+    try:
+        while True:
+            token = _current_timer.set(timer)
+            try:
+                chunk = next(chunks, None)
+            finally:
+                _current_timer.reset(token)
+            if chunk is None:
+                return
+            size += len(chunk)
+            yield chunk
+    finally:
+        done(size)
+
+
+async def _measure_async(content, timer, done):
+    size = 0
+    chunks = aiter(content)
+    try:
+        while True:
+            token = _current_timer.set(timer)
+            try:
+                chunk = await anext(chunks, None)
+            finally:
+                _current_timer.reset(token)
+            if chunk is None:
+                return
+            size += len(chunk)
+            yield chunk
+    finally:
+        done(size)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint. Disabled (404) unless METRICS_TOKEN is
+    set; scrapers authenticate with an "Authorization: Bearer <token>"
+    header.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        raise Http404
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
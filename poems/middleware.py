@@ -0,0 +1,189 @@
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from whitenoise.middleware import WhiteNoiseMiddleware as _WhiteNoiseMiddleware
+
+from . import cache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DEFAULT_MIN_SIZE = 512
+# HTML is left alone: the browsable API embeds CSRF tokens (BREACH)
+COMPRESSIBLE_TYPES = ('application/json',)
+
+_accept_encoding_re = _lazy_re_compile(r'\s*([^\s;,]+)\s*(?:;\s*q=([0-9.]+))?')
+
+
+def encoding_qualities(header):
+    """
+    Returns:
+        dict: encoding (or '*') -> q value, from an Accept-Encoding header
+    """
+    qualities = {}
+    for part in header.split(','):
+        match = _accept_encoding_re.match(part)
+        if not match:
+            continue
+        encoding, quality = match.group(1).lower(), match.group(2)
+        try:
+            qualities[encoding] = 1.0 if quality is None else float(quality)
+        except ValueError:
+            continue
+    return qualities
+
+
+def accepts(qualities, encoding):
+    """The encoding's own q value wins over '*': 'br;q=0, *' refuses brotli"""
+    return qualities.get(encoding, qualities.get('*', 0)) > 0
+
+
+def negotiate(header):
+    qualities = encoding_qualities(header)
+    if brotli is not None and accepts(qualities, 'br'):
+        return 'br'
+    if accepts(qualities, 'gzip'):
+        return 'gzip'
+    return None
+
+
+def compress(content, encoding, best=True):
+    """
+    Use the best (slowest) settings for cached bodies, recompressed off the
+    request path, and faster ones for bodies compressed within a request.
+    """
+    if encoding == 'br':
+        return brotli.compress(content, mode=brotli.MODE_TEXT, quality=11 if best else 5)
+    return gzip.compress(content, compresslevel=9 if best else 6, mtime=0)
+
+
+_recompressor = {}
+
+
+def _recompress(body_key, encoding, content_type, content):
+    cache.store_compressed(body_key, content_type, compress(content, encoding))
+
+
+def _recompress_later(*args):
+    """
+    Replace a cached body with its best compression, in a background
+    thread of this process; brotli and zlib release the GIL while they work
+    """
+    pool = _recompressor.get(os.getpid())
+    if pool is None:
+        # Threads don't survive a fork
+        pool = _recompressor.setdefault(os.getpid(), ThreadPoolExecutor(max_workers=1))
+    pool.submit(_recompress, *args)
+
+
+class CompressionMiddleware:
+    """
+    Compress JSON responses with brotli or gzip, whichever the client
+    accepts, brotli first.
+
+    Responses served through cache_response carry their cache key; their
+    compressed bodies are stored next to the cached response, and
+    cache_response serves later hits from them without rendering the data
+    again. A body is compressed with fast settings within the request and
+    recompressed with the best ones in the background. Other responses are
+    compressed on every request, with fast settings. Bodies below
+    API_COMPRESSION_MIN_SIZE bytes are sent as is. Under ASGI, bodies are
+    compressed in a thread, off the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        encoding = self.encoding_for(request, response)
+        if encoding is None:
+            return response
+        # Keep the event loop serving other requests while the body is
+        # compressed (and stored in the file-based cache)
+        return await sync_to_async(self.compress_response, thread_sensitive=False)(request, response, encoding)
+
+    def process_response(self, request, response):
+        encoding = self.encoding_for(request, response)
+        if encoding is None:
+            return response
+        return self.compress_response(request, response, encoding)
+
+    def encoding_for(self, request, response):
+        """
+        Returns:
+            str: the encoding to compress the response with, or None to send it as is
+        """
+        if response.streaming or response.status_code != 200 or response.has_header('Content-Encoding'):
+            return None
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return None
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        min_size = getattr(settings, 'API_COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)
+        if len(response.content) < min_size:
+            return None
+        return negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+    def compress_response(self, request, response, encoding):
+        body = compress(response.content, encoding, best=False)
+        if len(body) >= len(response.content):
+            return response
+        cache_key = getattr(response, 'cache_key', None)
+        if cache_key is not None:
+            body_key = cache.compressed_key(cache_key, encoding, request)
+            cache.store_compressed(body_key, response['Content-Type'], body)
+            _recompress_later(body_key, encoding, response['Content-Type'], response.content)
+
+        response.content = body
+        response['Content-Length'] = str(len(body))
+        response['Content-Encoding'] = encoding
+        if response.has_header('ETag'):
+            etag = response['ETag']
+            response['ETag'] = etag if etag.startswith('W/') else 'W/' + etag
+        return response
+
+
+class WhiteNoiseMiddleware(_WhiteNoiseMiddleware):
+    """
+    WhiteNoise's middleware is sync only, which under ASGI would run every
+    request through a thread. Static files are looked up in memory, so
+    this version also runs in async mode.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
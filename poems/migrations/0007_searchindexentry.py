@@ -0,0 +1,77 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:41
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# A copy of the tokenizer and weights of poems.search as of this
+# migration, so later changes to them don't change what this migration does
+_PALOCHKA_TABLE = str.maketrans({variant: 'ӏ' for variant in 'ӀӏIl1'})
+TOKEN_RE = re.compile(r'\w+')
+TITLE_WEIGHT = 10
+AUTHOR_WEIGHT = 5
+TEXT_WEIGHT = 1
+
+
+def tokenize(text):
+    folded = (text or '').translate(_PALOCHKA_TABLE)
+    lowered = folded.lower()
+    if len(lowered) != len(folded):
+        lowered = ''.join(c if len(c.lower()) != 1 else c.lower() for c in folded)
+    return TOKEN_RE.findall(lowered)
+
+
+def build_terms(poem):
+    weights = Counter()
+    for term in tokenize(poem.title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(poem.author.name):
+        weights[term] += AUTHOR_WEIGHT
+    for term in tokenize(poem.text):
+        weights[term] += TEXT_WEIGHT
+    return weights
+
+
+def fill_index(apps, schema_editor):
+    Poem = apps.get_model('poems', 'Poem')
+    SearchIndexEntry = apps.get_model('poems', 'SearchIndexEntry')
+    batch = []
+    for poem in Poem.objects.select_related('author').iterator(chunk_size=500):
+        batch.extend(
+            SearchIndexEntry(term=term[:100], poem_id=poem.id, weight=weight)
+            for term, weight in build_terms(poem).items()
+        )
+        if len(batch) >= 5000:
+            SearchIndexEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SearchIndexEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0006_featuredpoem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndexEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=100)),
+                ('weight', models.PositiveIntegerField(default=0)),
+                ('poem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_entries', to='poems.poem')),
+            ],
+            options={
+                'verbose_name': 'Search Index Entry',
+                'verbose_name_plural': 'Search Index Entries',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchindexentry',
+            constraint=models.UniqueConstraint(fields=('term', 'poem'), name='unique_search_term_per_poem'),
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0008_counter_flush'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='poem',
+            index=models.Index(fields=['created_at', 'id'], name='poem_created_at_id_idx'),
+        ),
+    ]
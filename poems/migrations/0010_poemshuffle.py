@@ -0,0 +1,43 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0009_poem_created_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PoemShuffle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Poem Shuffle',
+                'verbose_name_plural': 'Poem Shuffles',
+            },
+        ),
+        migrations.CreateModel(
+            name='PoemShuffleEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('poem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='poems.poem')),
+                ('shuffle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='poems.poemshuffle')),
+            ],
+            options={
+                'verbose_name': 'Poem Shuffle Entry',
+                'verbose_name_plural': 'Poem Shuffle Entries',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='poemshuffleentry',
+            constraint=models.UniqueConstraint(fields=('shuffle', 'position'), name='unique_shuffle_position'),
+        ),
+    ]
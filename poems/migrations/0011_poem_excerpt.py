@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+def make_excerpt(text, length=200):
+    # A copy of poems.models.make_excerpt as of this migration, so later
+    # changes to it don't change what this migration does
+    text = ' / '.join(line.strip() for line in (text or '').splitlines() if line.strip())
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(' ', 1)[0].rstrip(' /')
+    return cut + '…'
+
+
+def fill_excerpts(apps, schema_editor):
+    Poem = apps.get_model('poems', 'Poem')
+    batch = []
+    for poem in Poem.objects.only('id', 'text').iterator(chunk_size=500):
+        poem.excerpt = make_excerpt(poem.text)
+        batch.append(poem)
+        if len(batch) >= 500:
+            Poem.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    Poem.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0010_poemshuffle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poem',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=201, verbose_name='Excerpt'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
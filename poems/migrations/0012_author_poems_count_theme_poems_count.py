@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 13:12
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_poems_counts(apps, schema_editor):
+    Poem = apps.get_model('poems', 'Poem')
+    for model_name, field in (('Author', 'author_id'), ('Theme', 'category_id')):
+        counts = (
+            Poem.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        apps.get_model('poems', model_name).objects.update(
+            poems_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0011_poem_excerpt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='poems_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Poems'),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='poems_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Poems'),
+        ),
+        migrations.RunPython(fill_poems_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0012_author_poems_count_theme_poems_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='poem',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='poem_author_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='poem',
+            index=models.Index(fields=['category', 'created_at', 'id'], name='poem_category_created_at_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.2 on 2026-10-18 13:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0013_poem_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedPoem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+                ('poem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='poems.poem')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='poems.poem')),
+            ],
+            options={
+                'verbose_name': 'Related Poem',
+                'verbose_name_plural': 'Related Poems',
+            },
+        ),
+        migrations.CreateModel(
+            name='RelatedComputation',
+            fields=[
+                ('poem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='poems.poem')),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Related Computation',
+                'verbose_name_plural': 'Related Computations',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='relatedpoem',
+            constraint=models.UniqueConstraint(fields=('poem', 'rank'), name='unique_related_rank_per_poem'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.2 on 2026-10-18 13:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('poems', '0014_related_poems'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularAuthor',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='poems.author')),
+                ('rank', models.PositiveSmallIntegerField(unique=True)),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'Popular Author',
+                'verbose_name_plural': 'Popular Authors',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingPoem',
+            fields=[
+                ('poem', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='poems.poem')),
+                ('rank', models.PositiveSmallIntegerField(unique=True)),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'Trending Poem',
+                'verbose_name_plural': 'Trending Poems',
+            },
+        ),
+        migrations.CreateModel(
+            name='ViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'View Bucket',
+                'verbose_name_plural': 'View Buckets',
+                'indexes': [models.Index(fields=['hour'], name='view_bucket_hour_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='viewbucket',
+            constraint=models.UniqueConstraint(fields=('model', 'object_id', 'hour'), name='unique_view_bucket'),
+        ),
+    ]
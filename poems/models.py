@@ -4,11 +4,30 @@ from django.db import models
 from django.urls import reverse
 from django.utils import timezone
 
+from . import counters
 
-class Theme(models.Model):
+
+class PoemsCountMixin:
+    """
+    poems_count is maintained with UPDATE ... SET poems_count = poems_count + 1
+    (see signals.py), so saving an instance loaded earlier must not write
+    its stale copy back.
+    """
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'poems_count'
+            ]
+        return super().save(*args, **kwargs)
+
+
+class Theme(PoemsCountMixin, models.Model):
     title = models.CharField(max_length=150, verbose_name='Title')
     slug = models.SlugField(unique=True, verbose_name='Slug')
     views = models.PositiveIntegerField(default=0)
+    poems_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Poems')
 
     class Meta:
         verbose_name = 'Theme'
@@ -21,12 +40,13 @@ class Theme(models.Model):
         return reverse('poem', args=[self.slug])
 
 
-class Author(models.Model):
+class Author(PoemsCountMixin, models.Model):
     name = models.CharField(max_length=150, verbose_name='Name')
     slug = models.SlugField(unique=True, verbose_name='Slug')
     bio = models.TextField(blank=True, verbose_name='Bio')
     photo = models.ImageField(upload_to='photos', blank=True, verbose_name='Photo')
     views = models.PositiveIntegerField(default=0)
+    poems_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Poems')
     created_at = models.DateTimeField(editable=False, verbose_name='Date published')
     updated_at = models.DateTimeField()
 
@@ -44,13 +64,26 @@ class Author(models.Model):
         return super().save(*args, **kwargs)
 
     def update_views(self):
+        """Count a view; the row is updated later by the counter flush"""
+        counters.increment(self)
         self.views += 1
-        self.save()
 
     def get_absolute_url(self):
         return reverse('author', args=[self.slug])
 
 
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """First lines of a poem, cut at a word boundary"""
+    text = ' / '.join(line.strip() for line in (text or '').splitlines() if line.strip())
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(' ', 1)[0].rstrip(' /')
+    return cut + '…'
+
+
 class Poem(models.Model):
     LOVE = 'love'
     HOMELAND = 'homeland'
@@ -84,6 +117,7 @@ class Poem(models.Model):
     slug = models.SlugField(unique=True, verbose_name='Slug')
     author = models.ForeignKey(Author, on_delete=models.CASCADE, verbose_name='Author', related_name='poems')
     text = models.TextField(verbose_name='Poem\'s text')
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH + 1, blank=True, editable=False, verbose_name='Excerpt')
     theme = models.CharField(max_length=100, choices=THEMES, blank=True)
     category = models.ForeignKey(Theme, null=True, on_delete=models.CASCADE, verbose_name='Category', related_name='poems')
     views = models.PositiveIntegerField(default=0, verbose_name='Views')
@@ -94,6 +128,13 @@ class Poem(models.Model):
     class Meta:
         verbose_name = 'Poem'
         verbose_name_plural = 'Poems'
+        indexes = [
+            # Keyset pagination over the newest-first feed
+            models.Index(fields=['created_at', 'id'], name='poem_created_at_id_idx'),
+            # ... and over each author's and theme's feed
+            models.Index(fields=['author', 'created_at', 'id'], name='poem_author_created_at_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='poem_category_created_at_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -102,20 +143,33 @@ class Poem(models.Model):
         if not self.id:
             self.created_at = timezone.now()
         self.updated_at = timezone.now()
+        self.excerpt = make_excerpt(self.text)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'excerpt'}
         return super().save(*args, **kwargs)
 
     def update_views(self):
+        """Count a view; the row is updated later by the counter flush"""
+        counters.increment(self)
         self.views += 1
-        self.save()
 
     def get_absolute_url(self):
         return reverse('poem', args=[self.slug])
 
 
 class FeaturedPoemManager(models.Manager):
+    def _for_date(self, date):
+        return self.filter(featured_date=date).select_related('poem__author', 'poem__category').prefetch_related(
+            models.Prefetch('poem__related_entries', queryset=RelatedPoem.objects.for_display())
+        )
+
     def get_for_date(self, date):
         """Get featured poem for a specific date, or None if not exists"""
-        return self.filter(featured_date=date).select_related('poem__author', 'poem__category').first()
+        return self._for_date(date).first()
+
+    async def aget_for_date(self, date):
+        return await self._for_date(date).afirst()
     
     def get_latest(self):
         """Get the most recently featured poem"""
@@ -135,3 +189,145 @@ class FeaturedPoem(models.Model):
     
     def __str__(self):
         return f"{self.poem.title} - {self.featured_date.strftime('%Y-%m-%d')}"
+
+
+class SearchIndexEntry(models.Model):
+    term = models.CharField(max_length=100, db_index=True)
+    poem = models.ForeignKey(Poem, on_delete=models.CASCADE, related_name='search_entries')
+    weight = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Search Index Entry'
+        verbose_name_plural = 'Search Index Entries'
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'poem'], name='unique_search_term_per_poem'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.poem_id}"
+
+
+class PoemShuffle(models.Model):
+    """A shuffled bag of poems drawn from in order (see poems/selection.py)"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Poem Shuffle'
+        verbose_name_plural = 'Poem Shuffles'
+
+    def __str__(self):
+        return f"{self.name} (at {self.position})"
+
+
+class PoemShuffleEntry(models.Model):
+    """A poem's place in a shuffle; deleting the poem drops it from the bag"""
+    shuffle = models.ForeignKey(PoemShuffle, on_delete=models.CASCADE, related_name='entries')
+    position = models.PositiveIntegerField()
+    poem = models.ForeignKey(Poem, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        verbose_name = 'Poem Shuffle Entry'
+        verbose_name_plural = 'Poem Shuffle Entries'
+        constraints = [
+            models.UniqueConstraint(fields=['shuffle', 'position'], name='unique_shuffle_position'),
+        ]
+
+
+class RelatedPoemQuerySet(models.QuerySet):
+    def for_display(self):
+        """Best first, with only the columns shown of the similar poem"""
+        return self.select_related('related__author').only(
+            'poem_id', 'rank', 'related__id', 'related__title', 'related__author__id', 'related__author__name',
+        ).order_by('rank')
+
+
+class RelatedPoem(models.Model):
+    """One of a poem's most similar poems, precomputed by poems.related"""
+    poem = models.ForeignKey(Poem, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Poem, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    objects = RelatedPoemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Related Poem'
+        verbose_name_plural = 'Related Poems'
+        constraints = [
+            models.UniqueConstraint(fields=['poem', 'rank'], name='unique_related_rank_per_poem'),
+        ]
+
+
+class RelatedComputation(models.Model):
+    """
+    When poems.related last computed a poem's similar poems, kept even for
+    a poem with none; deleting a poem it lists drops the row (see signals)
+    """
+    poem = models.OneToOneField(Poem, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Related Computation'
+        verbose_name_plural = 'Related Computations'
+
+
+class ViewBucket(models.Model):
+    """Views of a poem or author within one hour, added by the view counter flush"""
+    model = models.CharField(max_length=50)
+    object_id = models.PositiveBigIntegerField()
+    hour = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'View Bucket'
+        verbose_name_plural = 'View Buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id', 'hour'], name='unique_view_bucket'),
+        ]
+        indexes = [
+            # Ranking reads and pruning by age
+            models.Index(fields=['hour'], name='view_bucket_hour_idx'),
+        ]
+
+
+class TrendingPoem(models.Model):
+    """A poem's place among the trending poems, refreshed by poems.rankings"""
+    poem = models.OneToOneField(Poem, on_delete=models.CASCADE, primary_key=True, related_name='trending')
+    rank = models.PositiveSmallIntegerField(unique=True)
+    score = models.FloatField()
+
+    class Meta:
+        verbose_name = 'Trending Poem'
+        verbose_name_plural = 'Trending Poems'
+
+
+class PopularAuthor(models.Model):
+    """An author's place among the popular authors, refreshed by poems.rankings"""
+    author = models.OneToOneField(Author, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    rank = models.PositiveSmallIntegerField(unique=True)
+    score = models.FloatField()
+
+    class Meta:
+        verbose_name = 'Popular Author'
+        verbose_name_plural = 'Popular Authors'
+
+
+class CatalogVersion(models.Model):
+    """A single row, bumped by every catalog write; see poems.catalog"""
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Catalog Version'
+        verbose_name_plural = 'Catalog Version'
+
+
+class CounterFlush(models.Model):
+    """A view counter spool batch already applied; see poems.counters"""
+    flush_id = models.CharField(max_length=32, unique=True)
+    applied_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = 'Counter Flush'
+        verbose_name_plural = 'Counter Flushes'
@@ -0,0 +1,186 @@
+import base64
+import bisect
+import datetime
+import json
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 21
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for async views: counts and loads the page through the async ORM"""
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        # Paginator.count is a cached property; set, it runs no sync COUNT
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [row async for row in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+
+class KeysetPagination:
+    """
+    Cursor pagination over newest-first feeds, keyed on (created_at, id).
+
+    Every page is a single indexed range scan with LIMIT, so its cost does
+    not depend on how deep the client has paged, and no COUNT(*) is run.
+    Cursors are opaque tokens; clients follow the next/previous links.
+
+    Opt in by sending the cursor query parameter (empty for the first page);
+    without it the views keep their page-number pagination.
+    """
+    page_size = 21
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, page_size=None):
+        if page_size is not None:
+            self.page_size = page_size
+
+    @classmethod
+    def requested(cls, request):
+        return cls.cursor_query_param in request.GET
+
+    def paginate_queryset(self, queryset, request):
+        return self._finish_page(list(self._page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self._finish_page([row async for row in self._page_queryset(queryset, request)])
+
+    def paginate_keys(self, keys, request):
+        """
+        paginate_queryset() over an in-memory feed
+
+        Args:
+            keys: (created_at, id) pairs in ascending order
+
+        Returns:
+            list: the page's keys, newest first
+        """
+        page_size = self._start(request)
+        try:
+            if self.reverse:
+                start = bisect.bisect_right(keys, self.position) if self.position else 0
+                rows = keys[start:start + page_size + 1]
+            else:
+                end = bisect.bisect_left(keys, self.position) if self.position else len(keys)
+                rows = keys[max(0, end - page_size - 1):end][::-1]
+        except TypeError:
+            # A cursor without a timezone
+            raise NotFound(self.invalid_cursor_message)
+        return self._finish_page(rows)
+
+    def _start(self, request):
+        self.request = request
+        self.position, self.reverse = self.decode_cursor(request.GET.get(self.cursor_query_param))
+        self.current_page_size = self.get_page_size(request)
+        return self.current_page_size
+
+    def _page_queryset(self, queryset, request):
+        page_size = self._start(request)
+
+        if self.reverse:
+            queryset = queryset.order_by('created_at', 'id')
+            if self.position:
+                created_at, pk = self.position
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        else:
+            queryset = queryset.order_by('-created_at', '-id')
+            if self.position:
+                created_at, pk = self.position
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return queryset[:page_size + 1]
+
+    def _finish_page(self, rows):
+        page_size = self.current_page_size
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def encode_cursor(self, row, reverse):
+        if isinstance(row, tuple):
+            created_at, pk = row
+        elif isinstance(row, dict):
+            created_at, pk = row['created_at'], row['id']
+        else:
+            created_at, pk = row.created_at, row.id
+        payload = {'c': created_at.isoformat(), 'i': pk}
+        if reverse:
+            payload['r'] = 1
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def decode_cursor(self, token):
+        """
+        Returns:
+            tuple: ((created_at, id) or None, reverse)
+        """
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            position = (datetime.datetime.fromisoformat(payload['c']), int(payload['i']))
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_cursor(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_cursor(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.get_next_cursor())
+
+    def get_previous_link(self):
+        return self._link(self.get_previous_cursor())
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,132 @@
+"""
+Fast read path for the list endpoints.
+
+Builds the same dicts as PoemSerializer, AuthorSerializer and
+ThemeSerializer straight from .values() rows, skipping model and
+serializer instantiation. Used when settings.API_FAST_SERIALIZATION is on;
+the output must stay identical to the serializers' (see tests). The
+detail builders serve the in-memory catalog (poems/catalog.py).
+"""
+from django.conf import settings
+from rest_framework import serializers
+
+from .models import Author, Theme
+from .queries import poems_for_listing
+from .serializers import AuthorDetailSerializer, AuthorSerializer, PoemDetailSerializer, PoemSerializer, ThemeSerializer
+
+# Columns each PoemSerializer field is built from
+POEM_FIELD_VALUES = {
+    'id': ('id',),
+    'title': ('title',),
+    'author': ('author_id', 'author__name', 'author__views', 'author__poems_count'),
+    'text': ('text',),
+    'excerpt': ('excerpt',),
+    'theme': ('category_id', 'category__title', 'category__poems_count'),
+    'created_at': ('created_at',),
+}
+# Keyset pagination reads these from every row
+ALWAYS_LOADED = ('id', 'created_at')
+
+_datetime_field = serializers.DateTimeField()
+
+
+def enabled():
+    return getattr(settings, 'API_FAST_SERIALIZATION', False)
+
+
+def selected(all_fields, fields=None, exclude=None):
+    """Field names kept by a sparse fieldset, in serializer order"""
+    return [
+        name for name in all_fields
+        if (fields is None or name in fields) and not (exclude and name in exclude)
+    ]
+
+
+def poem_values(fields=None, exclude=None):
+    columns = dict.fromkeys(ALWAYS_LOADED)
+    for name in selected(PoemSerializer.Meta.fields, fields, exclude):
+        columns.update(dict.fromkeys(POEM_FIELD_VALUES[name]))
+    return poems_for_listing().values(*columns)
+
+
+def author_values():
+    return Author.objects.values(*AuthorSerializer.Meta.fields)
+
+
+def theme_values():
+    return Theme.objects.values(*ThemeSerializer.Meta.fields)
+
+
+def _author(row):
+    return {
+        'id': row['author_id'],
+        'name': row['author__name'],
+        'poems_count': row['author__poems_count'],
+        'views': row['author__views'],
+    }
+
+
+def _theme(row):
+    if row['category_id'] is None:
+        return None
+    return {
+        'id': row['category_id'],
+        'title': row['category__title'],
+        'poems_count': row['category__poems_count'],
+    }
+
+
+POEM_FIELD_BUILDERS = {
+    'id': lambda row: row['id'],
+    'title': lambda row: row['title'],
+    'author': _author,
+    'text': lambda row: row['text'],
+    'excerpt': lambda row: row['excerpt'],
+    'theme': _theme,
+    'created_at': lambda row: _datetime_field.to_representation(row['created_at']),
+}
+
+
+def poems(rows, fields=None, exclude=None):
+    names = selected(PoemSerializer.Meta.fields, fields, exclude)
+    builders = [(name, POEM_FIELD_BUILDERS[name]) for name in names]
+    return [{name: build(row) for name, build in builders} for row in rows]
+
+
+def authors(rows, fields=None, exclude=None):
+    names = selected(AuthorSerializer.Meta.fields, fields, exclude)
+    return [{name: row[name] for name in names} for row in rows]
+
+
+def themes(rows, fields=None, exclude=None):
+    names = selected(ThemeSerializer.Meta.fields, fields, exclude)
+    return [{name: row[name] for name in names} for row in rows]
+
+
+POEM_DETAIL_FIELD_BUILDERS = {
+    **POEM_FIELD_BUILDERS,
+    'content': lambda row: row['text'],
+    'views': lambda row: row['views'],
+    'likes': lambda row: row['likes'],
+    # [{'id', 'title', 'author': {'id', 'name'}}], best first
+    'related': lambda row: row['related'],
+}
+
+
+def poem_detail(row, fields=None, exclude=None):
+    """PoemDetailSerializer's dict from a poem_values() row with views, likes and related"""
+    names = selected(PoemDetailSerializer.Meta.fields, fields, exclude)
+    return {name: POEM_DETAIL_FIELD_BUILDERS[name](row) for name in names}
+
+
+_photo_field = Author._meta.get_field('photo')
+
+
+def author_detail(row, fields=None, exclude=None):
+    """AuthorDetailSerializer's dict from an Author .values() row"""
+    built = {
+        'photo': _photo_field.storage.url(row['photo']) if row['photo'] else None,
+        'created_at': _datetime_field.to_representation(row['created_at']),
+    }
+    names = selected(AuthorDetailSerializer.Meta.fields, fields, exclude)
+    return {name: built[name] if name in built else row[name] for name in names}
@@ -0,0 +1,63 @@
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Author, Poem, RelatedPoem, Theme
+
+
+def poems_for_listing():
+    """
+    Poems with everything PoemSerializer touches fetched in a single query:
+    the author and category rows, which carry their stored poem counts.
+    """
+    return Poem.objects.select_related('author', 'category')
+
+
+def related_poems(lookup='related_entries'):
+    """
+    Prefetch of a poem's precomputed similar poems, best first, with the
+    columns PoemDetailSerializer shows of them: one indexed query for any
+    number of poems.
+    """
+    return Prefetch(lookup, queryset=RelatedPoem.objects.for_display())
+
+
+def poems_for_detail():
+    """poems_for_listing() with the similar poems PoemDetailSerializer adds"""
+    return poems_for_listing().prefetch_related(related_poems())
+
+
+def _poems_count_subquery(field):
+    counts = (
+        Poem.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def recount_poems(author_ids=None, theme_ids=None):
+    """
+    Recompute the stored poems_count of authors and themes from the poems
+    table, with one UPDATE per model. Bulk writes that bypass the Poem
+    signals (bulk_create, queryset updates and deletes, loaddata) call this
+    for the rows they touched.
+
+    Args:
+        author_ids, theme_ids: rows to recount; None recounts every row
+    """
+    for model, field, ids in ((Author, 'author_id', author_ids), (Theme, 'category_id', theme_ids)):
+        rows = model.objects.all() if ids is None else model.objects.filter(id__in=ids)
+        rows.update(poems_count=_poems_count_subquery(field))
+
+
+def drifted_poem_counts():
+    """
+    Returns:
+        dict: ids of the authors and themes whose stored poems_count is wrong, per model
+    """
+    return {
+        model: list(model.objects.exclude(poems_count=_poems_count_subquery(field)).values_list('id', flat=True))
+        for model, field in ((Author, 'author_id'), (Theme, 'category_id'))
+    }
@@ -0,0 +1,114 @@
+"""
+Trending poems and popular authors.
+
+When the view counter flush (poems/counters.py) applies the views it
+buffered, it also adds them to an hourly ViewBucket row per poem and
+author: an append-only log of when things were read, pre-aggregated to
+at most one row per object and hour. The hour is the one the view was
+recorded in, not the flush's.
+
+update_rankings() scores the buckets of the last WINDOW with exponential
+decay (a view counts half as much after HALF_LIFE) and stores the SIZE
+best poems and authors in the TrendingPoem and PopularAuthor tables.
+Views of an author's poems count for the author too. The endpoints read
+those small tables with a single join, and buckets older than the window
+are deleted by the same run. start.sh runs manage.py update_rankings
+every RANKINGS_INTERVAL seconds on each web host, after a flush of the
+host's spool.
+"""
+import datetime
+import heapq
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import cache
+from .models import Author, PopularAuthor, Poem, TrendingPoem, ViewBucket
+
+HALF_LIFE = datetime.timedelta(hours=24)
+WINDOW = datetime.timedelta(days=7)
+SIZE = 50
+
+
+def _hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_views(views):
+    """
+    Add flushed views to their hours' buckets; runs inside the flush's transaction
+
+    Args:
+        views: {(model label, pk, hour): views}, the hour in seconds since the epoch
+    """
+    buckets = {
+        (label, pk, datetime.datetime.fromtimestamp(hour, datetime.timezone.utc)): delta
+        for (label, pk, hour), delta in views.items()
+    }
+    # Create missing rows first, then add: safe against a concurrent flush on another host
+    ViewBucket.objects.bulk_create(
+        [ViewBucket(model=label, object_id=pk, hour=hour) for label, pk, hour in buckets],
+        ignore_conflicts=True,
+    )
+    batches = defaultdict(list)
+    for (label, pk, hour), delta in buckets.items():
+        batches[(label, hour, delta)].append(pk)
+    for (label, hour, delta), pks in batches.items():
+        ViewBucket.objects.filter(model=label, hour=hour, object_id__in=pks).update(views=F('views') + delta)
+
+
+def _best(scores, size):
+    """Best first; ties go to the older object"""
+    return heapq.nlargest(size, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _rows(model, pks, *fields, batch_size=2000):
+    """(id, *fields) of the existing objects among pks, a batch of ids per query"""
+    pks = sorted(pks)
+    for start in range(0, len(pks), batch_size):
+        yield from model.objects.filter(id__in=pks[start:start + batch_size]).values_list('id', *fields)
+
+
+def update_rankings(size=SIZE, half_life=HALF_LIFE, window=WINDOW, now=None):
+    """
+    Recompute the trending poems and popular authors
+
+    Returns:
+        tuple: (number of trending poems, number of popular authors)
+    """
+    now = now or timezone.now()
+    ViewBucket.objects.filter(hour__lt=now - window).delete()
+
+    scores = {Poem._meta.label: defaultdict(float), Author._meta.label: defaultdict(float)}
+    buckets = ViewBucket.objects.values_list('model', 'object_id', 'hour', 'views')
+    for label, pk, hour, views in buckets.iterator(chunk_size=2000):
+        if label in scores:
+            scores[label][pk] += views * 0.5 ** ((now - hour) / half_life)
+
+    # Only the poems and authors with buckets are read; buckets outlive
+    # deleted poems and authors, which are skipped
+    poem_scores, author_scores = {}, defaultdict(float)
+    for pk, author_id in _rows(Poem, scores[Poem._meta.label], 'author_id'):
+        score = scores[Poem._meta.label][pk]
+        if score:
+            poem_scores[pk] = score
+            author_scores[author_id] += score
+    for (pk,) in _rows(Author, scores[Author._meta.label]):
+        author_scores[pk] += scores[Author._meta.label][pk]
+    author_scores = {pk: score for pk, score in author_scores.items() if score}
+
+    trending = _best(poem_scores, size)
+    popular = _best(author_scores, size)
+    with transaction.atomic():
+        TrendingPoem.objects.all().delete()
+        TrendingPoem.objects.bulk_create(
+            TrendingPoem(poem_id=pk, rank=rank, score=score) for rank, (pk, score) in enumerate(trending, 1)
+        )
+        PopularAuthor.objects.all().delete()
+        PopularAuthor.objects.bulk_create(
+            PopularAuthor(author_id=pk, rank=rank, score=score) for rank, (pk, score) in enumerate(popular, 1)
+        )
+    cache.invalidate('rankings')
+    return len(trending), len(popular)
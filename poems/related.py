@@ -0,0 +1,188 @@
+"""
+Precomputed "similar poems" recommendations.
+
+Poems are compared as TF-IDF vectors of their title and text words
+(search.tokenize, so Kabardian spelling variants count as one word) by
+cosine similarity. Each poem's TOP_K most similar poems are stored as
+RelatedPoem rows, and the poem detail endpoint only reads them.
+
+Vectors are sparse dicts, and similarities are summed through an inverted
+index (word -> poems containing it), so only poems sharing a word are ever
+compared: the work of a sparse matrix product, without NumPy or SciPy.
+Words found in more than MAX_DOCUMENT_FREQUENCY of the poems carry little
+meaning and most of the cost, so they are left out, as are words found in
+a single poem.
+
+update_related() is incremental. Only poems saved since their neighbours
+were computed (RelatedComputation), never computed, or which listed a
+poem deleted since, are compared with the corpus; poems listing one of
+them are recomputed too, and every other poem picks up a changed poem if
+it is now among its closest. A poem with fewer than TOP_K neighbours
+above MIN_SCORE is not recomputed until one of these happens. Word
+weights come from the current corpus, so scores stored by earlier runs
+drift as the corpus grows, and a larger top_k only applies to recomputed
+poems; a full run (full=True) now and then recomputes everything.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, catalog, search
+from .models import Poem, RelatedComputation, RelatedPoem
+from .services import FeaturedPoemService
+
+TOP_K = 6
+MAX_DOCUMENT_FREQUENCY = 0.2
+# Below this the poems share little more than a word or two
+MIN_SCORE = 0.05
+
+
+def _vectors():
+    """
+    Returns:
+        dict: poem id -> {word: weight}, normalized to unit length
+    """
+    counts = {}
+    frequency = Counter()
+    for pk, title, text in Poem.objects.values_list('id', 'title', 'text').iterator(chunk_size=500):
+        words = Counter(search.tokenize(title))
+        words.update(search.tokenize(text))
+        counts[pk] = words
+        frequency.update(words.keys())
+
+    limit = max(2, MAX_DOCUMENT_FREQUENCY * len(counts))
+    idf = {
+        word: math.log(len(counts) / count)
+        for word, count in frequency.items() if 1 < count <= limit
+    }
+    vectors = {}
+    for pk, words in counts.items():
+        vector = {word: (1 + math.log(count)) * idf[word] for word, count in words.items() if word in idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        vectors[pk] = {word: weight / norm for word, weight in vector.items()} if norm else {}
+    return vectors
+
+
+class SimilarityIndex:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.postings = defaultdict(list)
+        for pk, vector in vectors.items():
+            for word, weight in vector.items():
+                self.postings[word].append((pk, weight))
+
+    def scores(self, pk):
+        """
+        Returns:
+            dict: id -> cosine similarity, for every other poem sharing a word
+        """
+        scores = defaultdict(float)
+        for word, weight in self.vectors.get(pk, {}).items():
+            for other, other_weight in self.postings[word]:
+                scores[other] += weight * other_weight
+        scores.pop(pk, None)
+        return scores
+
+    @staticmethod
+    def best(scores, top_k):
+        """
+        Returns:
+            list: up to top_k (score, id) pairs, best first; ties go to the older poem
+        """
+        candidates = ((score, pk) for pk, score in scores.items() if score >= MIN_SCORE)
+        return heapq.nlargest(top_k, candidates, key=lambda item: (item[0], -item[1]))
+
+
+def _offer(neighbours, score, pk, top_k):
+    """Insert (score, pk) into a best-first list if it makes the top_k"""
+    if score < MIN_SCORE or (len(neighbours) >= top_k and (score, -pk) <= (neighbours[-1][0], -neighbours[-1][1])):
+        return False
+    neighbours.append((score, pk))
+    neighbours.sort(key=lambda item: (item[0], -item[1]), reverse=True)
+    del neighbours[top_k:]
+    return True
+
+
+def _stored():
+    """
+    Returns:
+        tuple: (poem id -> best-first (score, id) list, poem id -> computed_at)
+    """
+    neighbours = defaultdict(list)
+    rows = RelatedPoem.objects.order_by('poem_id', 'rank').values_list('poem_id', 'related_id', 'score')
+    for pk, related_id, score in rows.iterator(chunk_size=2000):
+        neighbours[pk].append((score, related_id))
+    computed = dict(RelatedComputation.objects.values_list('poem_id', 'computed_at').iterator(chunk_size=2000))
+    return neighbours, computed
+
+
+def _changed_poems(computed):
+    """Poems saved since their neighbours were computed, or not computed since a deletion"""
+    updated = Poem.objects.values_list('id', 'updated_at').iterator(chunk_size=2000)
+    return {pk for pk, updated_at in updated if pk not in computed or updated_at > computed[pk]}
+
+
+def update_related(full=False, top_k=TOP_K, batch_size=500, progress=None):
+    """
+    Recompute the stored similar poems
+
+    Args:
+        full: recompute every poem instead of the changed ones
+        top_k: neighbours kept per poem
+        batch_size: poems written per transaction
+        progress: called with (written, total) after each batch
+
+    Returns:
+        tuple: (poems compared with the corpus, poems whose neighbours changed)
+    """
+    started = timezone.now()
+    index = SimilarityIndex(_vectors())
+    stored, computed = _stored()
+    neighbours = {pk: list(stored[pk]) for pk in index.vectors if pk in stored}
+
+    changed = set(index.vectors) if full else _changed_poems(computed)
+    # Poems listing a changed poem hold an outdated score for it
+    dependent = {pk for pk, entries in neighbours.items() if any(other in changed for _, other in entries)}
+    recompute = changed | dependent
+
+    offered = set()
+    for pk in recompute:
+        scores = index.scores(pk)
+        neighbours[pk] = index.best(scores, top_k)
+        if pk in changed:
+            # Only a changed poem can now belong among another's closest
+            for other, score in scores.items():
+                if other not in recompute and _offer(neighbours.setdefault(other, []), score, pk, top_k):
+                    offered.add(other)
+
+    def differs(pk):
+        return [other for _, other in neighbours[pk]] != [other for _, other in stored.get(pk, ())]
+
+    # Changed poems are always written, to record when they were computed
+    write = sorted(changed | {pk for pk in dependent | offered if differs(pk)})
+    stale = [pk for pk in write if differs(pk)]
+
+    for start in range(0, len(write), batch_size):
+        batch = write[start:start + batch_size]
+        with transaction.atomic():
+            RelatedPoem.objects.filter(poem_id__in=batch).delete()
+            RelatedPoem.objects.bulk_create(
+                RelatedPoem(poem_id=pk, related_id=related_id, rank=rank, score=score, computed_at=started)
+                for pk in batch
+                for rank, (score, related_id) in enumerate(neighbours[pk], 1)
+            )
+            RelatedComputation.objects.bulk_create(
+                [RelatedComputation(poem_id=pk, computed_at=started) for pk in batch],
+                update_conflicts=True, unique_fields=['poem'], update_fields=['computed_at'],
+            )
+        if progress:
+            progress(start + len(batch), len(write))
+
+    if stale:
+        catalog.bump()
+        cache.invalidate('featured', *(f'poem:{pk}' for pk in stale))
+        FeaturedPoemService.clear_cache()
+    return len(recompute), len(stale)
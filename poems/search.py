@@ -0,0 +1,206 @@
+import functools
+import operator
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Poem, SearchIndexEntry
+
+# Kabardian palochka is typed in many ways: the proper Cyrillic letter,
+# its capital, Latin I and l, or the digit 1. Fold them all to one letter.
+PALOCHKA = 'ӏ'
+PALOCHKA_VARIANTS = 'ӀӏIl1'
+_PALOCHKA_TABLE = str.maketrans({variant: PALOCHKA for variant in PALOCHKA_VARIANTS})
+
+TOKEN_RE = re.compile(r'\w+')
+
+TITLE_WEIGHT = 10
+AUTHOR_WEIGHT = 5
+TEXT_WEIGHT = 1
+
+# A shorter last token is matched as a whole word: a one- or two-letter
+# prefix would match a large part of the index
+MIN_PREFIX_LENGTH = 3
+
+SNIPPET_RADIUS = 60
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+
+
+def normalize(text):
+    """
+    Fold Kabardian orthography variants and case.
+
+    The result has the same length as the input, so offsets found in the
+    normalized text can be used to slice the original.
+    """
+    folded = text.translate(_PALOCHKA_TABLE)
+    lowered = folded.lower()
+    if len(lowered) != len(folded):
+        # A handful of characters lowercase to more than one code point
+        lowered = ''.join(c if len(c.lower()) != 1 else c.lower() for c in folded)
+    return lowered
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text or ''))
+
+
+def build_terms(poem):
+    """
+    Compute the weighted terms for a poem
+
+    Returns:
+        dict: term -> weight
+    """
+    weights = Counter()
+    for term in tokenize(poem.title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(poem.author.name):
+        weights[term] += AUTHOR_WEIGHT
+    for term in tokenize(poem.text):
+        weights[term] += TEXT_WEIGHT
+    return weights
+
+
+def _entries_for(poem):
+    max_length = SearchIndexEntry._meta.get_field('term').max_length
+    return [
+        SearchIndexEntry(term=term[:max_length], poem_id=poem.id, weight=weight)
+        for term, weight in build_terms(poem).items()
+    ]
+
+
+def index_poem(poem):
+    """
+    Replace the index entries of a single poem
+    """
+    with transaction.atomic():
+        SearchIndexEntry.objects.filter(poem_id=poem.id).delete()
+        SearchIndexEntry.objects.bulk_create(_entries_for(poem), ignore_conflicts=True)
+
+
+def index_poems(poems, batch_size=500):
+    """
+    Index an iterable of poems, writing entries in batches
+
+    Returns:
+        int: number of poems indexed
+    """
+    count = 0
+    batch = []
+    ids = []
+    for poem in poems:
+        batch.extend(_entries_for(poem))
+        ids.append(poem.id)
+        count += 1
+        if len(ids) >= batch_size:
+            _write_batch(ids, batch)
+            batch, ids = [], []
+    if ids:
+        _write_batch(ids, batch)
+    return count
+
+
+def _write_batch(poem_ids, entries):
+    with transaction.atomic():
+        SearchIndexEntry.objects.filter(poem_id__in=poem_ids).delete()
+        SearchIndexEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def rebuild_index(batch_size=500):
+    """
+    Re-index every poem, replacing the entries of one batch of poems at a
+    time, so searches keep finding the other poems meanwhile. The index is
+    filled by its migration and kept up to date by signals; this repairs
+    it after changes to the tokenizer or the weights.
+    """
+    poems = Poem.objects.select_related('author').order_by('id').iterator(chunk_size=batch_size)
+    return index_poems(poems, batch_size=batch_size)
+
+
+def _prefix(token):
+    # The range lets the term index serve the lookup: SQLite's LIKE is case
+    # insensitive and can't use it. Terms are lowercase words, so every
+    # term starting with the token sorts inside the range.
+    return Q(term__gte=token, term__lt=token + '\U0010ffff', term__startswith=token)
+
+
+def ranked(query):
+    """
+    Poems matching every token of the query, best first
+
+    The last token is matched as a prefix, so results show up while the
+    user is still typing. Matching, intersection and ranking all run in
+    the database; slice the queryset to fetch one page.
+
+    Returns:
+        QuerySet: {'poem_id', 'score', ...} rows ordered by descending score
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return SearchIndexEntry.objects.none().values('poem_id')
+
+    last = len(tokens) - 1
+    filters = [
+        _prefix(token) if i == last and len(token) >= MIN_PREFIX_LENGTH else Q(term=token)
+        for i, token in enumerate(tokens)
+    ]
+    # A poem must match each token with at least one of its terms
+    matched = {f'matched_{i}': Count('id', filter=condition) for i, condition in enumerate(filters)}
+    return (
+        SearchIndexEntry.objects.filter(functools.reduce(operator.or_, filters))
+        .values('poem_id')
+        .annotate(score=Sum('weight'), **matched)
+        .filter(**{f'{name}__gt': 0 for name in matched})
+        .order_by('-score', '-poem_id')
+    )
+
+
+def search(query, limit=None):
+    """
+    Returns:
+        list: ids of the best matching poems, best first; at most limit of them
+    """
+    return [row['poem_id'] for row in ranked(query)[:limit]]
+
+
+def highlight(text, query, radius=SNIPPET_RADIUS):
+    """
+    Build a short snippet of the text around the first match of the query,
+    with every matched token wrapped in <mark> tags
+    """
+    text = text or ''
+    tokens = tokenize(query)
+    normalized = normalize(text)
+
+    spans = []
+    for match in TOKEN_RE.finditer(normalized):
+        word = match.group()
+        if any(word == token or (i == len(tokens) - 1 and word.startswith(token))
+               for i, token in enumerate(tokens)):
+            spans.append(match.span())
+
+    if not spans:
+        snippet = text[:radius * 2]
+        return snippet + ('…' if len(text) > len(snippet) else '')
+
+    start = max(spans[0][0] - radius, 0)
+    end = min(spans[0][1] + radius, len(text))
+
+    parts = ['…'] if start > 0 else []
+    cursor = start
+    for span_start, span_end in spans:
+        if span_start < cursor:
+            continue
+        if span_end > end:
+            break
+        parts.append(text[cursor:span_start])
+        parts.append(HIGHLIGHT_START + text[span_start:span_end] + HIGHLIGHT_END)
+        cursor = span_end
+    parts.append(text[cursor:end])
+    if end < len(text):
+        parts.append('…')
+    return ''.join(parts)
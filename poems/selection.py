@@ -0,0 +1,144 @@
+"""
+Random poem selection without OFFSET scans.
+
+Eligible poem ids are loaded once and shuffled into a bag; each draw takes
+the next id, which is O(1). A poem cannot come up again until the bag is
+empty, i.e. until the corpus is exhausted. The featured poem bag is stored
+in the database, one row per place, so all workers share it and a draw
+reads only the next row; refills skip poems featured within
+FEATURED_NO_REPEAT_DAYS. The random endpoint uses a bag per worker.
+
+Optional weights (FEATURED_THEME_WEIGHTS, FEATURED_AUTHOR_WEIGHTS, keyed by
+slug) bias how early a poem appears in each shuffle; a weight of 0 leaves
+the theme's or author's poems out of the featured bag.
+"""
+import datetime
+import random
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .models import FeaturedPoem, Poem, PoemShuffle, PoemShuffleEntry
+
+DEFAULT_NO_REPEAT_DAYS = 365
+FEATURED_BAG = 'featured'
+
+
+def shuffled(ids, weights=None, rng=random):
+    """
+    Shuffle ids; with weights, heavier ids tend to come first
+    (weighted random permutation, Efraimidis-Spirakis keys) and ids
+    weighted 0 are left out
+    """
+    ids = list(ids)
+    if not weights:
+        rng.shuffle(ids)
+        return ids
+    ids = [pk for pk in ids if weights.get(pk, 1.0) > 0]
+    keys = {pk: rng.random() ** (1.0 / weights.get(pk, 1.0)) for pk in ids}
+    return sorted(ids, key=keys.__getitem__, reverse=True)
+
+
+def poem_weights():
+    """
+    Returns:
+        dict: poem id -> weight, for poems whose theme or author is weighted
+    """
+    theme_weights = getattr(settings, 'FEATURED_THEME_WEIGHTS', {})
+    author_weights = getattr(settings, 'FEATURED_AUTHOR_WEIGHTS', {})
+    for name, configured in [('FEATURED_THEME_WEIGHTS', theme_weights), ('FEATURED_AUTHOR_WEIGHTS', author_weights)]:
+        negative = sorted(slug for slug, weight in configured.items() if weight < 0)
+        if negative:
+            raise ImproperlyConfigured(f"{name} must not be negative: {', '.join(negative)}")
+    if not theme_weights and not author_weights:
+        return {}
+
+    rows = Poem.objects.values_list('id', 'category__slug', 'author__slug')
+    weights = {}
+    for pk, theme_slug, author_slug in rows:
+        weight = theme_weights.get(theme_slug, 1.0) * author_weights.get(author_slug, 1.0)
+        if weight != 1.0:
+            weights[pk] = weight
+    return weights
+
+
+def _refill_featured(date):
+    window = getattr(settings, 'FEATURED_NO_REPEAT_DAYS', DEFAULT_NO_REPEAT_DAYS)
+    recent = set(
+        FeaturedPoem.objects.filter(
+            featured_date__gt=date - datetime.timedelta(days=window),
+            featured_date__lt=date + datetime.timedelta(days=window),
+        ).values_list('poem_id', flat=True)
+    )
+    ids = list(Poem.objects.values_list('id', flat=True))
+    eligible = [pk for pk in ids if pk not in recent]
+    if not eligible:
+        # Every poem was featured within the window: fall back to the whole
+        # corpus, still avoiding the neighbouring days
+        neighbours = set(
+            FeaturedPoem.objects.filter(
+                featured_date__in=[date - datetime.timedelta(days=1), date + datetime.timedelta(days=1)]
+            ).values_list('poem_id', flat=True)
+        )
+        eligible = [pk for pk in ids if pk not in neighbours] or ids
+    return shuffled(eligible, poem_weights())
+
+
+def draw_featured(date):
+    """
+    Draw the poem to feature on a date from the shared bag
+
+    Returns:
+        int: poem id
+
+    Raises:
+        ValueError: If no poems are available
+    """
+    with transaction.atomic():
+        bag, _ = PoemShuffle.objects.select_for_update().get_or_create(name=FEATURED_BAG)
+        for _ in range(2):
+            # Deleted poems took their entries with them
+            entry = (
+                bag.entries.filter(position__gte=bag.position)
+                .order_by('position').values_list('position', 'poem_id').first()
+            )
+            if entry is not None:
+                bag.position = entry[0] + 1
+                bag.save(update_fields=['position'])
+                return entry[1]
+            # Bag exhausted: reshuffle once
+            bag.entries.all().delete()
+            PoemShuffleEntry.objects.bulk_create(
+                PoemShuffleEntry(shuffle=bag, position=position, poem_id=pk)
+                for position, pk in enumerate(_refill_featured(date))
+            )
+            bag.position = 0
+            bag.save(update_fields=['position'])
+        raise ValueError("No poems available in the system")
+
+
+class WorkerBag:
+    """Per-worker shuffle bag of all poem ids"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = []
+
+    def draw(self):
+        """
+        Returns:
+            int or None: a poem id, or None if there are no poems
+        """
+        with self._lock:
+            if not self._ids:
+                self._ids = shuffled(Poem.objects.values_list('id', flat=True))
+            return self._ids.pop() if self._ids else None
+
+    def discard(self):
+        with self._lock:
+            self._ids = []
+
+
+random_bag = WorkerBag()
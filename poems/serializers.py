@@ -2,7 +2,40 @@ from rest_framework import serializers
 from .models import Poem, Author, Theme, FeaturedPoem
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+def sparse_fields(request, default_exclude=()):
+    """
+    Read ?fields= and ?exclude= (comma separated) from the request
+
+    Fields in default_exclude are left out unless ?fields= names them.
+
+    Returns:
+        tuple: (set of fields to keep or None for all, set of fields to drop)
+    """
+    def parse(name):
+        # Plain Django requests (async views) have no query_params
+        value = request.GET.get(name) if request is not None else None
+        return {field.strip() for field in value.split(',') if field.strip()} if value else None
+
+    fields, exclude = parse('fields'), parse('exclude') or set()
+    if fields is None:
+        exclude |= set(default_exclude)
+    return fields, exclude
+
+
+class SparseFieldsetsMixin:
+    """
+    Limit the top-level fields of a serializer with fields=/exclude=
+    keyword arguments. Unknown field names are ignored.
+    """
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in list(self.fields):
+            if (fields is not None and name not in fields) or (exclude and name in exclude):
+                self.fields.pop(name)
+
+
+class AuthorSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     poems_count = serializers.IntegerField(read_only=True)
     
     class Meta:
@@ -10,7 +43,7 @@ class AuthorSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'poems_count', 'views']
 
 
-class AuthorDetailSerializer(serializers.ModelSerializer):
+class AuthorDetailSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     poems_count = serializers.IntegerField(read_only=True)
     
     class Meta:
@@ -18,7 +51,7 @@ class AuthorDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'bio', 'photo', 'views', 'created_at', 'poems_count']
 
 
-class ThemeSerializer(serializers.ModelSerializer):
+class ThemeSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     poems_count = serializers.IntegerField(read_only=True)
     
     class Meta:
@@ -26,32 +59,44 @@ class ThemeSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'poems_count']
 
 
-class PoemSerializer(serializers.ModelSerializer):
+class PoemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     theme = ThemeSerializer(source='category', read_only=True)
     
     class Meta:
         model = Poem
-        fields = ['id', 'title', 'author', 'text', 'theme', 'created_at']
+        fields = ['id', 'title', 'author', 'text', 'excerpt', 'theme', 'created_at']
 
     def get_content(self, obj):
         return obj.text
 
 
-class PoemDetailSerializer(serializers.ModelSerializer):
+class PoemDetailSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     theme = ThemeSerializer(source='category', read_only=True)
     content = serializers.SerializerMethodField()
+    related = serializers.SerializerMethodField()
     
     class Meta:
         model = Poem
-        fields = ['id', 'title', 'author', 'content', 'theme', 'views', 'likes', 'created_at']
+        fields = ['id', 'title', 'author', 'content', 'theme', 'views', 'likes', 'created_at', 'related']
     
     def get_content(self, obj):
         return obj.text 
 
+    def get_related(self, obj):
+        """The precomputed similar poems; fetch with queries.related_poems()"""
+        return [
+            {
+                'id': entry.related.id,
+                'title': entry.related.title,
+                'author': {'id': entry.related.author.id, 'name': entry.related.author.name},
+            }
+            for entry in obj.related_entries.all()
+        ]
+
 
-class FeaturedPoemSerializer(serializers.ModelSerializer):
+class FeaturedPoemSerializer(SparseFieldsetsMixin, serializers.ModelSerializer):
     poem = PoemDetailSerializer(read_only=True)
     
     class Meta:
@@ -1,30 +1,103 @@
 import datetime
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from django.db.models import Q
 
-from .models import Poem, FeaturedPoem
+from . import catalog, selection
+from .models import FeaturedPoem
+from .queries import poems_for_detail
 
 
 class FeaturedPoemService:
     """Service for managing featured poems"""
-    
+
+    # Per-worker cache of today's featured poem:
+    # {'date': date, 'version': catalog version, 'featured': FeaturedPoem}
+    _todays = {}
+
     @staticmethod
     def get_todays_featured_poem():
         """
-        Get or create today's featured poem
-        
+        Get or create today's featured poem, cached in the worker until the
+        day changes or the catalog version does (any worker's catalog write)
+
         Returns:
             FeaturedPoem: The featured poem for today
         """
         today = timezone.now().date()
-        
-        # First try to get an existing featured poem for today
-        featured = FeaturedPoem.objects.get_for_date(today)
+        version = catalog.current_version()
+        cached = FeaturedPoemService._todays
+        if cached.get('date') == today and cached.get('version') == version:
+            return cached['featured']
+
+        featured = FeaturedPoemService.get_or_create_for_date(today)
+        FeaturedPoemService._todays = {'date': today, 'version': version, 'featured': featured}
+        return featured
+
+    @staticmethod
+    async def aget_todays_featured_poem():
+        """
+        Async version of get_todays_featured_poem. Creating a missing
+        featured poem needs a transaction, so that part runs in a thread.
+
+        Returns:
+            FeaturedPoem: The featured poem for today
+        """
+        today = timezone.now().date()
+        version = await catalog.acurrent_version()
+        cached = FeaturedPoemService._todays
+        if cached.get('date') == today and cached.get('version') == version:
+            return cached['featured']
+
+        featured = await FeaturedPoem.objects.aget_for_date(today)
+        if featured is None:
+            featured = await sync_to_async(FeaturedPoemService.get_or_create_for_date)(today)
+        FeaturedPoemService._todays = {'date': today, 'version': version, 'featured': featured}
+        return featured
+
+    @staticmethod
+    def clear_cache():
+        """Drop this worker's copy; other workers notice the catalog version change"""
+        FeaturedPoemService._todays = {}
+
+    @staticmethod
+    def get_or_create_for_date(date):
+        """
+        Get the featured poem for a date, creating it if needed. Safe to call
+        concurrently: the loser of a creation race reads the winner's row.
+
+        Returns:
+            FeaturedPoem: The featured poem for the date
+        """
+        featured = FeaturedPoem.objects.get_for_date(date)
         if featured:
             return featured
-            
-        # Create a new featured poem for today
-        return FeaturedPoemService._create_featured_poem(today)
+
+        try:
+            with transaction.atomic():
+                return FeaturedPoemService._create_featured_poem(date)
+        except IntegrityError:
+            # Another worker featured a poem for this date first
+            return FeaturedPoem.objects.get_for_date(date)
+
+    @staticmethod
+    def schedule(start_date, days):
+        """
+        Make sure every date in [start_date, start_date + days) has a
+        featured poem
+
+        Returns:
+            int: number of dates that were newly scheduled
+        """
+        scheduled = 0
+        for offset in range(days):
+            date = start_date + datetime.timedelta(days=offset)
+            if FeaturedPoem.objects.filter(featured_date=date).exists():
+                continue
+            FeaturedPoemService.get_or_create_for_date(date)
+            scheduled += 1
+        return scheduled
     
     @staticmethod
     def _create_featured_poem(date):
@@ -40,37 +113,11 @@ class FeaturedPoemService:
         Raises:
             ValueError: If no eligible poems are available
         """
-        # Find the most recent featured poem (for avoiding repetition)
-        last_featured = FeaturedPoem.objects.get_latest()
-        
-        # Build an exclusion query for poems we don't want to feature
-        exclusion_query = Q()
-        
-        # Don't repeat yesterday's poem
-        yesterday = date - datetime.timedelta(days=1)
-        if last_featured and last_featured.featured_date == yesterday:
-            exclusion_query |= Q(id=last_featured.poem_id)
-        
-        # Get eligible poems
-        eligible_poems = Poem.objects.exclude(exclusion_query)
-        
-        # Ensure we have poems to choose from
-        poem_count = eligible_poems.count()
-        if poem_count == 0:
-            # Fallback: if all poems have been excluded, but we need one, just use any poem
-            eligible_poems = Poem.objects.all()
-            poem_count = eligible_poems.count()
-            
-            if poem_count == 0:
-                raise ValueError("No poems available in the system")
-        
-        # Get a random poem - use offset for better performance than order_by('?')
-        import random
-        random_index = random.randint(0, poem_count - 1)
-        random_poem = eligible_poems.select_related('author', 'category')[random_index]
-        
+        poem_id = selection.draw_featured(date)
+        poem = poems_for_detail().get(id=poem_id)
+
         # Create and return the new featured poem
         return FeaturedPoem.objects.create(
-            poem=random_poem,
+            poem=poem,
             featured_date=date
-        ) 
+        )
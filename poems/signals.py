@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, catalog, search
+from .models import Author, FeaturedPoem, Poem, RelatedComputation, RelatedPoem, Theme
+from .services import FeaturedPoemService
+
+SEARCH_FIELDS = {'title', 'text', 'author'}
+
+
+@receiver(post_save, sender=Poem)
+def index_saved_poem(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Keep the search index in sync with the poem"""
+    if raw:
+        return
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    search.index_poem(instance)
+
+
+@receiver(post_save, sender=Author)
+def reindex_author_poems(sender, instance, raw=False, created=False, update_fields=None, **kwargs):
+    """The author name is part of every poem's index entry"""
+    if raw or created:
+        return
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    search.index_poems(instance.poems.select_related('author'))
+
+
+def _invalidate(*tags):
+    """
+    Expire the tagged responses once the write commits. Expiring them
+    before would let a request in between cache the old rows again under
+    the new tokens; outside a transaction this runs at once.
+    """
+    def expire():
+        cache.invalidate(*tags)
+        if 'featured' in tags:
+            FeaturedPoemService.clear_cache()
+    transaction.on_commit(expire)
+
+
+def _invalidate_author(author_id):
+    """The author's poem count is shown on the author and on each of their poems"""
+    poem_ids = Poem.objects.filter(author_id=author_id).values_list('id', flat=True)
+    _invalidate('authors', f'author:{author_id}', *(f'poem:{pk}' for pk in poem_ids))
+
+
+def _invalidate_theme(theme_id):
+    poem_ids = Poem.objects.filter(category_id=theme_id).values_list('id', flat=True)
+    _invalidate('themes', f'theme:{theme_id}', *(f'poem:{pk}' for pk in poem_ids))
+
+
+@receiver(pre_save, sender=Poem)
+def remember_poem_relations(sender, instance, raw=False, **kwargs):
+    """Record the current author and theme, so a reassignment can invalidate both sides"""
+    instance._previous_relations = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_relations = (
+        Poem.objects.filter(pk=instance.pk).values_list('author_id', 'category_id').first()
+    )
+
+
+def _listing_poems(**lookup):
+    """Tags of the poems showing the matching poems among their similar poems"""
+    poem_ids = RelatedPoem.objects.filter(**lookup).values_list('poem_id', flat=True).distinct()
+    return [f'poem:{pk}' for pk in poem_ids]
+
+
+@receiver(pre_delete, sender=Poem)
+def remember_listing_poems(sender, instance, **kwargs):
+    """The deletion cascades to the RelatedPoem rows naming this poem"""
+    instance._listed_by = _listing_poems(related_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Poem)
+def recompute_listing_poems(sender, instance, **kwargs):
+    """Poems listing this one are left a neighbour short; the next update_related recomputes them"""
+    listing = RelatedPoem.objects.filter(related_id=instance.pk).values('poem_id')
+    RelatedComputation.objects.filter(poem_id__in=listing).delete()
+
+
+def _add_poems(model, pk, delta):
+    if pk is None:
+        return
+    rows = model.objects.filter(pk=pk)
+    if delta < 0:
+        # Never below zero, even if the count had drifted
+        rows = rows.filter(poems_count__gte=-delta)
+    rows.update(poems_count=F('poems_count') + delta)
+
+
+@receiver(post_save, sender=Poem)
+def count_saved_poem(sender, instance, raw=False, created=False, **kwargs):
+    """Keep Author.poems_count and Theme.poems_count exact"""
+    if raw:
+        # loaddata: run the repair_poem_counts command afterwards
+        return
+    previous = None if created else getattr(instance, '_previous_relations', None)
+    if previous is None:
+        if not created:
+            return
+        previous = (None, None)
+    if previous[0] != instance.author_id:
+        _add_poems(Author, previous[0], -1)
+        _add_poems(Author, instance.author_id, 1)
+    if previous[1] != instance.category_id:
+        _add_poems(Theme, previous[1], -1)
+        _add_poems(Theme, instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Poem)
+def count_deleted_poem(sender, instance, **kwargs):
+    _add_poems(Author, instance.author_id, -1)
+    _add_poems(Theme, instance.category_id, -1)
+
+
+@receiver(post_save, sender=Poem)
+@receiver(post_delete, sender=Poem)
+def invalidate_poem_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    listed_by = getattr(instance, '_listed_by', None)
+    if listed_by is None:
+        listed_by = _listing_poems(related_id=instance.pk)
+    _invalidate('poems', 'featured', f'poem:{instance.pk}', *listed_by)
+
+    previous = getattr(instance, '_previous_relations', None)
+    current = (instance.author_id, instance.category_id)
+    if previous == current:
+        # Counts are unchanged; only the feeds listing this poem are stale
+        tags = [f'author:{instance.author_id}']
+        if instance.category_id:
+            tags.append(f'theme:{instance.category_id}')
+        _invalidate(*tags)
+        return
+
+    for author_id in {current[0], previous[0] if previous else None} - {None}:
+        _invalidate_author(author_id)
+    for theme_id in {current[1], previous[1] if previous else None} - {None}:
+        _invalidate_theme(theme_id)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _invalidate('poems', 'featured', *_listing_poems(related__author_id=instance.pk))
+    _invalidate_author(instance.pk)
+
+
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+def invalidate_theme_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _invalidate('poems', 'featured')
+    _invalidate_theme(instance.pk)
+
+
+@receiver(post_save, sender=Poem)
+@receiver(post_delete, sender=Poem)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+@receiver(post_save, sender=FeaturedPoem)
+@receiver(post_delete, sender=FeaturedPoem)
+def bump_catalog_version(sender, **kwargs):
+    """
+    Workers serving the in-memory catalog reload it, and drop their copies
+    of the featured poem and the autocomplete index (loaddata included)
+    """
+    catalog.bump()
+
+
+@receiver(post_save, sender=FeaturedPoem)
+@receiver(post_delete, sender=FeaturedPoem)
+def invalidate_featured_responses(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _invalidate('featured')
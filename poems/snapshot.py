@@ -0,0 +1,253 @@
+"""
+Static JSON snapshot of the read API.
+
+Pre-renders the read endpoints into files laid out like their URLs, with
+the same JSON the API returns, so WhiteNoise or a CDN can serve them
+without touching Django:
+
+    api/v1/poems.json, api/v1/poems/page/<n>.json   poem list pages
+    api/v1/poems/<id>.json                          poem detail
+    api/v1/poems/latest.json, featured.json, trending.json
+    api/v1/authors.json, api/v1/authors/<id>.json, api/v1/authors/popular.json
+    api/v1/authors/<id>/poems.json, .../poems/page/<n>.json  author feed pages
+    api/v1/themes.json
+    api/v1/themes/<id>/poems.json, .../poems/page/<n>.json   theme feed pages
+
+Pagination links point at the static pages. Search and random poems have
+no static equivalent.
+
+Exports are incremental. manifest.json records a version for every
+file: for poem and author pages it is derived from their source rows,
+so unchanged pages are not even rendered; other files are rendered and
+compared by content. Only files whose version changed are rewritten, and
+files of deleted rows are removed. A poem's version includes a hash of
+its text, computed by the database, as bulk writers such as
+clean_poem_texts leave updated_at alone. View and like counters, and the
+author names of similar poems, are not part of the versions, so they are
+refreshed when a file is rewritten for another reason, or by a full export.
+
+featured.json is today's stored featured poem; the export never picks
+one. Run schedule_featured_poems first.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.functions import MD5
+from django.test import RequestFactory
+from django.utils import timezone
+
+from . import api_views, listings
+from .models import Author, FeaturedPoem, Theme
+from .pagination import StandardResultsSetPagination
+from .queries import poems_for_detail, poems_for_listing
+from .renderers import FastJSONRenderer
+from .serializers import AuthorDetailSerializer, FeaturedPoemSerializer, PoemDetailSerializer
+
+MANIFEST = 'manifest.json'
+
+
+def _digest(*values):
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SnapshotExporter:
+    """
+    Usage:
+        stats = SnapshotExporter('/srv/static-api').export()
+    """
+
+    def __init__(self, directory, base_url='/', full=False, batch_size=500):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/') + '/'
+        self.full = full
+        self.batch_size = batch_size
+        self.renderer = FastJSONRenderer()
+        hosts = [host for host in settings.ALLOWED_HOSTS if '*' not in host and not host.startswith('.')]
+        self.factory = RequestFactory(HTTP_HOST=hosts[0] if hosts else 'localhost')
+
+    def export(self):
+        """
+        Returns:
+            dict: numbers of files written, unchanged and removed
+        """
+        manifest = {} if self.full else self._load_manifest()
+        self.previous = manifest.get('files', {})
+        self.previous_sources = manifest.get('sources', {})
+        self.files = {}
+        self.sources = {}
+        self.stats = {'written': 0, 'unchanged': 0, 'removed': 0}
+
+        self._export_poems()
+        self._export_authors()
+        self._export_poem_pages()
+        self._export_feeds()
+        self._export_views()
+
+        for path in set(self.previous) - set(self.files):
+            try:
+                os.remove(os.path.join(self.directory, path))
+            except FileNotFoundError:
+                pass
+            self.stats['removed'] += 1
+        manifest = {'files': self.files, 'sources': self.sources}
+        self._write_file(MANIFEST, json.dumps(manifest, indent=0, sort_keys=True).encode())
+        return self.stats
+
+    def url(self, path):
+        return self.base_url + path
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST), encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_file(self, path, content):
+        """Write atomically, so a server never sees a half-written file"""
+        target = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, target)
+
+    def _stale(self, path, version):
+        """Record a file's version; True if it has to be (re)written"""
+        self.files[path] = version
+        if self.previous.get(path) == version:
+            self.stats['unchanged'] += 1
+            return False
+        return True
+
+    def _save(self, path, data, version=None):
+        """Write rendered data; without a source version, compare by content"""
+        content = self.renderer.render(data)
+        if version is None:
+            version = hashlib.sha1(content).hexdigest()
+            if not self._stale(path, version):
+                return
+        self._write_file(path, content)
+        self.files[path] = version
+        self.stats['written'] += 1
+
+    def _export_poems(self):
+        rows = poems_for_listing().annotate(
+            text_hash=MD5('text'),
+            # Rewritten when the similar poems are recomputed or one of them is saved
+            related_at=Max('related_entries__computed_at'),
+            related_updated_at=Max('related_entries__related__updated_at'),
+        ).values_list(
+            'id', 'title', 'updated_at', 'text_hash',
+            'author_id', 'author__name', 'author__poems_count',
+            'category_id', 'category__title', 'category__poems_count',
+            'related_at', 'related_updated_at',
+        ).order_by('id')
+        stale = {}
+        # What the list pages show of the poems themselves (the excerpt is
+        # cut from the text), for their version
+        listed = hashlib.sha1()
+        for row in rows.iterator(chunk_size=self.batch_size):
+            version = _digest(*row[1:])
+            path = f'api/v1/poems/{row[0]}.json'
+            if self._stale(path, version):
+                stale[row[0]] = version
+            listed.update(_digest(*row[:5], row[7]).encode())
+        self.listed_poems = listed.hexdigest()
+        for ids in _chunks(list(stale), self.batch_size):
+            # The same queries and serializer as api_views.poem_detail
+            for poem in poems_for_detail().filter(id__in=ids):
+                self._save(f'api/v1/poems/{poem.id}.json', PoemDetailSerializer(poem).data, stale[poem.id])
+
+    def _export_authors(self):
+        rows = Author.objects.values_list('id', 'updated_at', 'poems_count')
+        stale = {}
+        for pk, updated_at, poems_count in rows.iterator(chunk_size=self.batch_size):
+            version = _digest(updated_at, poems_count)
+            if self._stale(f'api/v1/authors/{pk}.json', version):
+                stale[pk] = version
+        for ids in _chunks(list(stale), self.batch_size):
+            for author in Author.objects.filter(id__in=ids):
+                self._save(f'api/v1/authors/{author.id}.json', AuthorDetailSerializer(author).data, stale[author.id])
+
+    def _poem_pages_version(self):
+        """Follows _export_poems, which hashes the poems"""
+        authors = list(Author.objects.order_by('id').values_list('id', 'name', 'poems_count'))
+        themes = list(Theme.objects.order_by('id').values_list('id', 'title', 'poems_count'))
+        return _digest(self.listed_poems, authors, themes)
+
+    def _page_path(self, prefix, number):
+        return f'{prefix}.json' if number == 1 else f'{prefix}/page/{number}.json'
+
+    def _export_poem_pages(self):
+        """Pages of api_views.poem_list"""
+        version = self._poem_pages_version()
+        self.sources['poem_pages'] = version
+        paths = [path for path in self.previous if path == 'api/v1/poems.json' or path.startswith('api/v1/poems/page/')]
+        if paths and self.previous_sources.get('poem_pages') == version:
+            for path in paths:
+                self._stale(path, self.previous[path])
+            return
+        self._export_pages('api/v1/poems')
+
+    def _export_feeds(self):
+        """Pages of api_views.author_poems and api_views.theme_poems"""
+        for pk in Author.objects.values_list('id', flat=True).iterator():
+            self._export_pages(f'api/v1/authors/{pk}/poems', author_id=pk)
+        for pk in Theme.objects.values_list('id', flat=True).iterator():
+            self._export_pages(f'api/v1/themes/{pk}/poems', category_id=pk)
+
+    def _export_pages(self, prefix, **filters):
+        """Every page of a page-number paginated poem feed, rendered in a single pass over its poems"""
+        page_size = StandardResultsSetPagination.page_size
+        fields, exclude = None, set(listings.LIST_DEFAULT_EXCLUDE)
+        poems = listings.feed_rows(fields, exclude, **filters)
+        count = poems.count()
+        pages = max(1, -(-count // page_size))
+
+        rows = []
+        number = 1
+        for row in poems.iterator(chunk_size=self.batch_size):
+            rows.append(row)
+            if len(rows) == page_size:
+                self._save_page(prefix, number, pages, count, listings.serialize_poems(rows, fields, exclude))
+                rows = []
+                number += 1
+        if rows or count == 0:
+            self._save_page(prefix, number, pages, count, listings.serialize_poems(rows, fields, exclude))
+
+    def _save_page(self, prefix, number, pages, count, results):
+        self._save(self._page_path(prefix, number), {
+            'count': count,
+            'next': self.url(self._page_path(prefix, number + 1)) if number < pages else None,
+            'previous': self.url(self._page_path(prefix, number - 1)) if number > 1 else None,
+            'results': results,
+        })
+
+    def _export_views(self):
+        """Endpoints without view counting, rendered by their views"""
+        featured = FeaturedPoem.objects.get_for_date(timezone.now().date())
+        if featured is not None:
+            # api_views.featured_poem would feature a poem if there were none
+            self._save('api/v1/poems/featured.json', FeaturedPoemSerializer(featured).data)
+        views = [
+            ('api/v1/poems/latest.json', api_views.latest_poems),
+            ('api/v1/poems/trending.json', api_views.trending_poems),
+            ('api/v1/authors.json', api_views.author_list),
+            ('api/v1/authors/popular.json', api_views.popular_authors),
+            ('api/v1/themes.json', api_views.theme_list),
+        ]
+        for path, view in views:
+            response = view(self.factory.get('/' + path))
+            if response.status_code == 200:
+                self._save(path, response.data)
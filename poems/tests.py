@@ -1,3 +1,1789 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from poems import (
+    autocomplete, benchmark, cache as response_cache, catalog, counters, metrics, middleware, rankings, related,
+    search, selection,
+)
+from poems.renderers import FastJSONRenderer
+from poems.models import (
+    Author, CatalogVersion, FeaturedPoem, Poem, PoemShuffle, RelatedPoem, SearchIndexEntry, Theme, ViewBucket,
+    make_excerpt,
+)
+from poems.services import FeaturedPoemService
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PoemsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # Never write views, likes or metrics to the spools next to the
+        # developer's database
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        settings_override = override_settings(
+            VIEW_COUNTER_SPOOL=f'{spool_dir.name}/spool.sqlite3',
+            VIEW_COUNTER_FLUSH_INTERVAL=3600,
+            METRICS_SPOOL=f'{spool_dir.name}/metrics.sqlite3',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Drop hit/miss counts left pending by other tests
+        response_cache.flush_stats()
+        cache.clear()
+        FeaturedPoemService.clear_cache()
+        selection.random_bag.discard()
+        autocomplete.index.discard()
+        catalog.discard()
+
+
+def make_poem(author, title, text='', category=None, slug=None):
+    return Poem.objects.create(
+        title=title,
+        slug=slug or f'poem-{Poem.objects.count() + 1}',
+        author=author,
+        text=text,
+        category=category,
+    )
+
+
+class SearchTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Щоджэнцӏыкӏу Алий', slug='shogentsiku-aliy')
+        cls.other = Author.objects.create(name='Кешокъуэ Алим', slug='keshokue-alim')
+        cls.theme = Theme.objects.create(title='Хэку', slug='heku')
+        cls.title_match = make_poem(cls.author, 'Гъащӏэ', 'Псалъэ', cls.theme)
+        cls.text_match = make_poem(cls.other, 'Уэрэд', 'Си гъащӏэр уэращ', cls.theme)
+        make_poem(cls.other, 'Мэз', 'Жыг')
+
+    def test_palochka_variants_normalize_to_one_letter(self):
+        for variant in ['гъащӀэ', 'гъащIэ', 'гъащlэ', 'гъащ1э', 'ГЪАЩӀЭ']:
+            self.assertEqual(search.normalize(variant), 'гъащӏэ')
+
+    def test_search_ranks_title_above_text(self):
+        self.assertEqual(search.search('гъащ1э'), [self.title_match.id, self.text_match.id])
+
+    def test_search_matches_author_name_and_prefix(self):
+        self.assertEqual(search.search('щоджэнцIыкIу'), [self.title_match.id])
+        self.assertEqual(set(search.search('кешо')), set(search.search('кешокъуэ')))
+        self.assertIn(self.text_match.id, search.search('кешо'))
+
+    def test_index_follows_author_rename(self):
+        self.other.name = 'Нало Заур'
+        self.other.save()
+        self.assertEqual(search.search('кешокъуэ'), [])
+        self.assertEqual(len(search.search('нало')), 2)
+
+    def test_rebuild_replaces_stale_entries_batch_by_batch(self):
+        SearchIndexEntry.objects.filter(poem=self.title_match).update(weight=0)
+        SearchIndexEntry.objects.create(term='стале', poem=self.text_match, weight=1)
+        self.assertEqual(search.rebuild_index(batch_size=1), 3)
+        self.assertEqual(search.search('стале'), [])
+        self.assertEqual(search.search('гъащ1э'), [self.title_match.id, self.text_match.id])
+
+    def test_highlight_marks_matches(self):
+        snippet = search.highlight('Си гъащӏэр уэращ', 'гъащlэр')
+        self.assertEqual(snippet, 'Си <mark>гъащӏэр</mark> уэращ')
+
+    def test_api_search_is_paginated_with_snippets(self):
+        response = self.client.get(reverse('api_search_poems'), {'q': 'гъащIэ'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        first, second = response.data['results']
+        self.assertEqual(first['id'], self.title_match.id)
+        self.assertIn('<mark>гъащӏэр</mark>', second['snippet'])
+
+    def test_legacy_search_uses_index(self):
+        response = self.client.get(reverse('search_poems'), {'q': 'уэрэд'})
+        self.assertEqual([poem['id'] for poem in response.json()], [self.text_match.id])
+
+    def test_short_last_token_matches_whole_words(self):
+        make_poem(self.other, 'Си', 'Сикъуэ')
+        self.assertEqual(len(search.search('си')), 2)
+        self.assertEqual(search.search('гъа'), [self.title_match.id, self.text_match.id])
+        self.assertEqual(search.search('гъ'), [])
+
+    def test_legacy_search_is_paginated(self):
+        poems = [make_poem(self.author, f'Гъатхэ {i}') for i in range(25)]
+        url = reverse('search_poems')
+        first = self.client.get(url, {'q': 'гъатхэ'}).json()
+        second = self.client.get(url, {'q': 'гъатхэ', 'page': 2}).json()
+        self.assertEqual(len(first), 20)
+        self.assertCountEqual([poem['id'] for poem in first + second], [poem.id for poem in poems])
+
+    def test_poems_deleted_after_ranking_are_skipped(self):
+        ranked = list(search.ranked('гъащӏэ'))
+        self.title_match.delete()
+        with mock.patch('poems.search.ranked', return_value=ranked):
+            legacy = self.client.get(reverse('search_poems'), {'q': 'гъащӏэ'}).json()
+            api = self.client.get(reverse('api_search_poems'), {'q': 'гъащӏэ'}).json()
+        self.assertEqual([poem['id'] for poem in legacy], [self.text_match.id])
+        self.assertEqual([poem['id'] for poem in api['results']], [self.text_match.id])
+
+
+# Maximum number of queries each named route may run, independent of how
+# many poems are on the page. Every route must declare a budget.
+QUERY_BUDGETS = {
+    'poems_list': 2,
+    'poem': 1,
+    'latest_poems': 1,
+    'authors_list': 2,
+    'authors_list_v2': 1,
+    'author': 1,
+    'get_poems_of_author': 2,
+    # The match count, the ranked page, then the page's poems
+    'search_poems': 3,
+    'themes_list': 1,
+    'poems_by_theme': 2,
+    'api_poems_list': 2,
+    # The poem, then its precomputed similar poems
+    'api_poem_detail': 2,
+    # Reads the stored count; the like itself goes to the counter spool
+    'api_like_poem': 1,
+    'api_latest_poems': 1,
+    # Read from the precomputed ranking tables
+    'api_trending_poems': 1,
+    'api_popular_authors': 1,
+    # The match count, the ranked page, then the page's poems
+    'api_search_poems': 3,
+    'api_authors_list': 1,
+    'api_author_detail': 1,
+    'api_author_poems': 2,
+    'api_themes_list': 1,
+    'api_theme_poems': 2,
+    'api_featured_poem': 2,
+    'api_random_poem': 3,
+    'api_export_poems': 1,
+    'api_export_authors': 1,
+    'api_export_themes': 1,
+    # A catalog version check; served from memory once the prefix index is built
+    'api_autocomplete': 3,
+}
+
+
+class QueryBudgetTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.themes = [Theme.objects.create(title=f'Theme {i}', slug=f'theme-{i}') for i in range(3)]
+        cls.authors = [Author.objects.create(name=f'Author {i}', slug=f'author-{i}') for i in range(5)]
+        for i in range(30):
+            make_poem(cls.authors[i % 5], f'Poem {i}', f'Text {i}', cls.themes[i % 3], slug=f'poem-{i}')
+        # Featured poems are scheduled ahead of time in production
+        FeaturedPoemService.schedule(timezone.now().date(), 1)
+
+    def route_urls(self):
+        from poems import api_urls, urls
+
+        kwargs = {
+            'poem': Poem.objects.first().pk,
+            'author': self.authors[0].pk,
+            'theme': self.themes[0].pk,
+        }
+        for pattern in [*urls.urlpatterns, *api_urls.urlpatterns]:
+            name = pattern.name
+            route_kwargs = {}
+            if 'pk' in pattern.pattern.converters:
+                owner = 'theme' if 'theme' in str(pattern.pattern) else (
+                    'author' if 'author' in str(pattern.pattern) else 'poem'
+                )
+                route_kwargs['pk'] = kwargs[owner]
+            yield name, reverse(name, kwargs=route_kwargs)
+
+    def test_every_route_declares_a_budget(self):
+        for name, _ in self.route_urls():
+            self.assertIn(name, QUERY_BUDGETS)
+
+    def test_routes_stay_within_budget(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for name, url in self.route_urls():
+            with self.subTest(route=name), CaptureQueriesContext(connection) as queries:
+                send = getattr(self.client_class(), benchmark.ROUTE_METHODS.get(name, 'get'))
+                response = send(url, {'q': 'poem'})
+                self.assertEqual(response.status_code, 200)
+                # Streaming responses query as they are read
+                response.getvalue()
+            with self.subTest(route=name):
+                self.assertLessEqual(
+                    len(queries), QUERY_BUDGETS[name],
+                    f'{name} ran {len(queries)} queries:\n' + '\n'.join(q['sql'] for q in queries),
+                )
+
+
+class ViewCounterTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(name='Author', slug='author')
+        self.poem = make_poem(self.author, 'Poem')
+
+    def test_views_are_buffered_until_flush(self):
+        self.poem.update_views()
+        self.poem.update_views()
+        self.author.update_views()
+        self.poem.refresh_from_db()
+        self.assertEqual(self.poem.views, 0)
+
+        call_command('flush_view_counters', stdout=io.StringIO())
+        self.poem.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.poem.views, 2)
+        self.assertEqual(self.author.views, 1)
+        self.assertEqual(counters.pending(), {})
+
+    def test_concurrent_increments_are_never_lost(self):
+        threads_count, per_thread = 8, 50
+
+        def hammer():
+            for _ in range(per_thread):
+                counters.increment(self.poem)
+
+        threads = [threading.Thread(target=hammer) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counters.pending(), {('poems.Poem', self.poem.pk): threads_count * per_thread})
+        counters.flush()
+        self.poem.refresh_from_db()
+        self.assertEqual(self.poem.views, threads_count * per_thread)
+
+    def test_detail_views_count_once_per_client_without_sessions(self):
+        author_url = reverse('api_author_detail', kwargs={'pk': self.author.pk})
+        poem_url = reverse('api_poem_detail', kwargs={'pk': self.poem.pk})
+        for _ in range(3):
+            self.client.get(author_url)
+            self.client.get(poem_url)
+        self.client_class().get(poem_url)
+
+        self.assertEqual(counters.pending(), {
+            ('poems.Author', self.author.pk): 1,
+            ('poems.Poem', self.poem.pk): 2,
+        })
+        self.assertNotIn('sessionid', self.client.cookies)
+        self.assertIn('viewed_authors', self.client.cookies)
+
+    def test_view_is_counted_again_after_the_window(self):
+        url = reverse('api_poem_detail', kwargs={'pk': self.poem.pk})
+        self.client.get(url)
+        later = time.time() + 4 * 60 * 60
+        with mock.patch('time.time', return_value=later):
+            self.client.get(url)
+        self.assertEqual(counters.pending(), {('poems.Poem', self.poem.pk): 2})
+
+    def test_tampered_cookie_is_ignored(self):
+        url = reverse('api_poem_detail', kwargs={'pk': self.poem.pk})
+        self.client.cookies['viewed_poems'] = f'{self.poem.pk:x}.0:forged'
+        self.client.get(url)
+        self.assertEqual(counters.pending(), {('poems.Poem', self.poem.pk): 1})
+
+    def test_author_detail_does_not_write_the_author_row(self):
+        self.client.get(reverse('api_author_detail', kwargs={'pk': self.author.pk}))
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.views, 0)
+        self.assertEqual(counters.pending(), {('poems.Author', self.author.pk): 1})
+
+    def test_interrupted_flushes_are_applied_exactly_once(self):
+        apply = counters._apply
+
+        def killed_after_commit(rows, flush_id=None):
+            apply(rows, flush_id)
+            raise RuntimeError('worker killed')
+
+        self.poem.update_views()
+        with mock.patch.object(counters, '_apply', killed_after_commit), self.assertRaises(RuntimeError):
+            counters.flush()
+        counters.flush()
+        self.poem.refresh_from_db()
+        self.assertEqual(self.poem.views, 1)
+
+        self.poem.update_views()
+        with mock.patch.object(counters, '_apply', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            counters.flush()
+        self.assertEqual(counters.pending(), {('poems.Poem', self.poem.pk): 1})
+        counters.flush()
+        self.poem.refresh_from_db()
+        self.assertEqual(self.poem.views, 2)
+        self.assertEqual(counters.pending(), {})
+
+
+class LikeTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(name='Author', slug='author')
+        self.poem = make_poem(self.author, 'Poem')
+        self.url = reverse('api_like_poem', kwargs={'pk': self.poem.pk})
+
+    def likes(self):
+        self.poem.refresh_from_db()
+        return self.poem.likes
+
+    def test_likes_are_idempotent_per_client(self):
+        self.assertEqual(self.client.post(self.url).json(), {'id': self.poem.pk, 'liked': True, 'likes': 1})
+        self.assertEqual(self.client.post(self.url).json()['likes'], 1)
+        self.assertEqual(self.client_class().post(self.url).json()['likes'], 2)
+        self.assertEqual(self.likes(), 0)
+        self.assertEqual(counters.pending('likes'), {('poems.Poem', self.poem.pk): 2})
+
+        self.assertEqual(self.client.delete(self.url).json(), {'id': self.poem.pk, 'liked': False, 'likes': 1})
+        self.assertEqual(self.client.delete(self.url).json()['likes'], 1)
+        self.assertNotIn('sessionid', self.client.cookies)
+
+        counters.flush()
+        self.assertEqual(self.likes(), 1)
+        self.assertEqual(self.client.post(self.url).json()['likes'], 2)
+
+    def test_likes_and_views_flush_together(self):
+        self.client.get(reverse('api_poem_detail', kwargs={'pk': self.poem.pk}))
+        for _ in range(3):
+            self.client_class().post(self.url)
+        self.assertEqual(counters.flush(), 2)
+        self.poem.refresh_from_db()
+        self.assertEqual((self.poem.views, self.poem.likes), (1, 3))
+
+    def test_unlikes_never_go_below_zero(self):
+        self.client.post(self.url)
+        Poem.objects.filter(pk=self.poem.pk).update(likes=0)
+        counters.flush()
+        self.client.delete(self.url)
+        counters.flush()
+        self.assertEqual(self.likes(), 0)
+
+    def test_tampered_cookie_and_missing_poem(self):
+        self.client.cookies['liked_poems'] = f'{self.poem.pk:x}:forged'
+        self.assertEqual(self.client.delete(self.url).json()['likes'], 0)
+        self.assertEqual(counters.pending('likes'), {})
+        missing = reverse('api_like_poem', kwargs={'pk': self.poem.pk + 100})
+        self.assertEqual(self.client.post(missing).status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    @override_settings(LIKE_THROTTLE_RATE='2/minute')
+    def test_clients_without_the_cookie_are_throttled(self):
+        from poems import async_views
+
+        for _ in range(2):
+            self.assertEqual(self.client_class().post(self.url).status_code, 200)
+        self.assertEqual(self.client_class().post(self.url).status_code, 429)
+        response = async_to_sync(async_views.like_poem)(RequestFactory().post(self.url), pk=self.poem.pk)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(counters.pending('likes'), {('poems.Poem', self.poem.pk): 2})
+
+    def test_likes_from_other_sites_are_refused(self):
+        from poems import async_views
+
+        self.assertEqual(self.client.post(self.url, HTTP_ORIGIN='https://elsewhere.example').status_code, 403)
+        request = RequestFactory().post(self.url, HTTP_ORIGIN='https://elsewhere.example')
+        self.assertEqual(async_to_sync(async_views.like_poem)(request, pk=self.poem.pk).status_code, 403)
+        self.assertEqual(counters.pending('likes'), {})
+        self.assertEqual(self.client.post(self.url, HTTP_ORIGIN='http://testserver').status_code, 200)
+
+    def test_async_view_matches(self):
+        from poems import async_views
+
+        request = RequestFactory().post(self.url)
+        response = async_to_sync(async_views.like_poem)(request, pk=self.poem.pk)
+        self.assertEqual(json.loads(response.content), {'id': self.poem.pk, 'liked': True, 'likes': 1})
+        self.assertIn('liked_poems', response.cookies)
+        request = RequestFactory().get(self.url)
+        self.assertEqual(async_to_sync(async_views.like_poem)(request, pk=self.poem.pk).status_code, 405)
+
+
+class KeysetPaginationTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Author', slug='author')
+        cls.theme = Theme.objects.create(title='Theme', slug='theme')
+        cls.poems = [make_poem(cls.author, f'Poem {i}', category=cls.theme, slug=f'p-{i}') for i in range(7)]
+        # Several poems share a timestamp, so ties must be broken by id
+        Poem.objects.filter(id__in=[p.id for p in cls.poems[2:5]]).update(created_at=cls.poems[2].created_at)
+        cls.newest_first = list(Poem.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def walk(self, url, params):
+        seen, pages = [], 0
+        response = self.client.get(url, {**params, 'cursor': ''})
+        while True:
+            pages += 1
+            seen.extend(poem['id'] for poem in response.data['results'])
+            if not response.data['next']:
+                return seen, pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_api_cursor_walk_visits_every_poem_once(self):
+        seen, pages, _ = self.walk(reverse('api_poems_list'), {'page_size': 3})
+        self.assertEqual(seen, self.newest_first)
+        self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_the_previous_page(self):
+        first = self.client.get(reverse('api_poems_list'), {'cursor': '', 'page_size': 3})
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+
+    def test_feeds_by_author_and_theme(self):
+        for url in [
+            reverse('api_author_poems', kwargs={'pk': self.author.pk}),
+            reverse('api_theme_poems', kwargs={'pk': self.theme.pk}),
+        ]:
+            seen, _, _ = self.walk(url, {'page_size': 2})
+            self.assertEqual(seen, self.newest_first)
+
+    def test_feeds_are_page_number_paginated_by_default(self):
+        for url in [
+            reverse('api_author_poems', kwargs={'pk': self.author.pk}),
+            reverse('api_theme_poems', kwargs={'pk': self.theme.pk}),
+        ]:
+            with self.subTest(url=url):
+                response = self.client.get(url, {'page': 2, 'page_size': 5})
+                self.assertEqual(response.data['count'], 7)
+                self.assertEqual([p['id'] for p in response.data['results']], self.newest_first[5:])
+                self.assertIsNone(response.data['next'])
+
+        for name, pk in [('get_poems_of_author', self.author.pk), ('poems_by_theme', self.theme.pk)]:
+            with self.subTest(route=name):
+                data = self.client.get(reverse(name, kwargs={'pk': pk})).json()
+                self.assertEqual([p['id'] for p in data['poems']], self.newest_first)
+                self.assertEqual(data['total_pages'], 1)
+                data = self.client.get(reverse(name, kwargs={'pk': pk}), {'cursor': ''}).json()
+                self.assertEqual([p['id'] for p in data['poems']], self.newest_first)
+
+    def test_page_number_mode_is_unchanged(self):
+        response = self.client.get(reverse('api_poems_list'), {'page': 2, 'page_size': 5})
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual([p['id'] for p in response.data['results']], self.newest_first[5:])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get(reverse('api_poems_list'), {'cursor': 'nope'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('poems_list'), {'cursor': 'nope'}).status_code, 404)
+
+    def test_legacy_index_cursor(self):
+        data = self.client.get(reverse('poems_list'), {'cursor': ''}).json()
+        self.assertEqual([p['id'] for p in data['poems']], self.newest_first)
+        self.assertIsNone(data['next_cursor'])
+
+
+class ResponseCacheTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Author', slug='author')
+        cls.theme = Theme.objects.create(title='Theme', slug='theme')
+        cls.poem = make_poem(cls.author, 'Poem', category=cls.theme)
+
+    def get(self, name, **kwargs):
+        return self.client.get(reverse(name, kwargs=kwargs or None))
+
+    def test_second_request_is_a_hit(self):
+        self.assertEqual(self.get('api_themes_list')['X-Cache'], 'MISS')
+        self.assertEqual(self.get('api_themes_list')['X-Cache'], 'HIT')
+        self.assertEqual(response_cache.stats(['theme_list']), {'theme_list': {'hits': 1, 'misses': 1}})
+
+    @override_settings(RESPONSE_CACHE_STATS_INTERVAL=3600)
+    def test_stats_are_added_to_the_shared_counters_in_batches(self):
+        for _ in range(3):
+            self.get('api_themes_list')
+        self.assertIsNone(cache.get('response-stats:theme_list:hits'))
+        self.assertEqual(response_cache.stats(['theme_list']), {'theme_list': {'hits': 2, 'misses': 1}})
+        self.assertEqual(cache.get('response-stats:theme_list:hits'), 2)
+
+    def test_poem_save_invalidates_its_detail_and_lists(self):
+        self.get('api_poem_detail', pk=self.poem.pk)
+        self.get('api_latest_poems')
+        self.poem.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poem.save()
+        detail = self.get('api_poem_detail', pk=self.poem.pk)
+        self.assertEqual((detail['X-Cache'], detail.data['title']), ('MISS', 'Renamed'))
+        self.assertEqual(self.get('api_latest_poems')['X-Cache'], 'MISS')
+
+    def test_unrelated_entries_survive(self):
+        other = make_poem(Author.objects.create(name='Other', slug='other'), 'Other')
+        self.get('api_poem_detail', pk=other.pk)
+        self.poem.text = 'New text'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poem.save()
+        self.assertEqual(self.get('api_poem_detail', pk=other.pk)['X-Cache'], 'HIT')
+
+    def test_responses_are_expired_when_the_write_commits(self):
+        self.get('api_poem_detail', pk=self.poem.pk)
+        self.poem.title = 'Renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.poem.save()
+            # Not expired while the write is uncommitted
+            self.assertEqual(self.get('api_poem_detail', pk=self.poem.pk)['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get('api_poem_detail', pk=self.poem.pk).data['title'], 'Renamed')
+
+    def test_new_poem_updates_counts_on_author_and_theme(self):
+        self.get('api_authors_list')
+        self.get('api_poem_detail', pk=self.poem.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_poem(self.author, 'Second', category=self.theme)
+        authors = self.get('api_authors_list')
+        self.assertEqual(authors.data[0]['poems_count'], 2)
+        detail = self.get('api_poem_detail', pk=self.poem.pk)
+        self.assertEqual(detail.data['author']['poems_count'], 2)
+
+    def test_theme_rename_invalidates_theme_list(self):
+        self.get('api_themes_list')
+        self.theme.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.theme.save()
+        self.assertEqual(self.get('api_themes_list').data[0]['title'], 'Renamed')
+
+
+class FeaturedPoemTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author', slug='author')
+        cls.poems = [make_poem(author, f'Poem {i}', slug=f'p-{i}') for i in range(3)]
+
+    def test_featured_poem_is_cached_until_the_day_changes(self):
+        # Scheduled ahead, as in production: creating the row on the
+        # request invalidates the 'featured' tag, costing one more lookup
+        FeaturedPoemService.schedule(timezone.now().date(), 1)
+        self.client.get(reverse('api_featured_poem'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_featured_poem'))
+        self.assertEqual(response.data['featured_date'], str(timezone.now().date()))
+
+        tomorrow = timezone.now() + datetime.timedelta(days=1)
+        with mock.patch('poems.services.timezone.now', return_value=tomorrow):
+            response = self.client.get(reverse('api_featured_poem'))
+        self.assertEqual(response.data['featured_date'], str(tomorrow.date()))
+
+    def test_losing_a_creation_race_returns_the_winner(self):
+        today = timezone.now().date()
+        winner = FeaturedPoem.objects.create(poem=self.poems[0], featured_date=today)
+
+        # Our lookup ran before the other worker inserted its row
+        lookups = mock.Mock(side_effect=[None, winner])
+        with mock.patch.object(FeaturedPoem.objects, 'get_for_date', lookups):
+            featured = FeaturedPoemService.get_or_create_for_date(today)
+        self.assertEqual(featured, winner)
+        self.assertEqual(FeaturedPoem.objects.count(), 1)
+
+    def test_schedule_command_fills_upcoming_days(self):
+        today = timezone.now().date()
+        FeaturedPoem.objects.create(poem=self.poems[1], featured_date=today + datetime.timedelta(days=2))
+        out = io.StringIO()
+        call_command('schedule_featured_poems', days=5, stdout=out)
+        self.assertIn('Scheduled 4', out.getvalue())
+        dates = list(FeaturedPoem.objects.order_by('featured_date').values_list('featured_date', 'poem_id'))
+        self.assertEqual([d for d, _ in dates], [today + datetime.timedelta(days=i) for i in range(5)])
+        for (_, previous), (_, current) in zip(dates, dates[1:]):
+            self.assertNotEqual(previous, current)
+
+    def test_featured_change_clears_the_worker_cache(self):
+        first = self.client.get(reverse('api_featured_poem')).data['poem']['id']
+        replacement = next(p for p in self.poems if p.id != first)
+        FeaturedPoem.objects.filter(featured_date=timezone.now().date()).update(poem=replacement)
+        with self.captureOnCommitCallbacks(execute=True):
+            FeaturedPoem.objects.get(featured_date=timezone.now().date()).save()
+        self.assertEqual(self.client.get(reverse('api_featured_poem')).data['poem']['id'], replacement.id)
+
+    @override_settings(CATALOG_CHECK_INTERVAL=0)
+    def test_change_made_by_another_worker_clears_this_workers_cache(self):
+        from poems import async_views
+
+        url = reverse('api_featured_poem')
+        first = self.client.get(url).data['poem']['id']
+        replacement = next(p for p in self.poems if p.id != first)
+        # The other worker's signal cleared its own copy and bumped the version
+        FeaturedPoem.objects.filter(featured_date=timezone.now().date()).update(poem=replacement)
+        CatalogVersion.objects.update(version=F('version') + 1)
+
+        self.assertEqual(self.client.get(url).data['poem']['id'], replacement.id)
+        response = async_to_sync(async_views.featured_poem)(RequestFactory().get(url))
+        self.assertEqual(json.loads(response.content)['poem']['id'], replacement.id)
+
+
+class SelectionTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Author', slug='author')
+        cls.poems = [make_poem(author, f'Poem {i}', slug=f'p-{i}') for i in range(4)]
+
+    def test_featured_poems_do_not_repeat_until_corpus_is_exhausted(self):
+        today = timezone.now().date()
+        FeaturedPoemService.schedule(today, 8)
+        poem_ids = list(FeaturedPoem.objects.order_by('featured_date').values_list('poem_id', flat=True))
+        self.assertEqual(len(set(poem_ids[:4])), 4)
+        for previous, current in zip(poem_ids, poem_ids[1:]):
+            self.assertNotEqual(previous, current)
+
+    @override_settings(FEATURED_NO_REPEAT_DAYS=3)
+    def test_refill_skips_poems_featured_within_the_window(self):
+        today = timezone.now().date()
+        for i, poem in enumerate(self.poems[:2]):
+            FeaturedPoem.objects.create(poem=poem, featured_date=today - datetime.timedelta(days=i + 1))
+        drawn = {selection.draw_featured(today) for _ in range(2)}
+        self.assertEqual(drawn, {p.id for p in self.poems[2:]})
+
+    def test_weights_put_heavier_ids_first(self):
+        order = selection.shuffled([1, 2, 3], weights={3: 1e9})
+        self.assertEqual(order[0], 3)
+
+    def test_draw_reads_only_the_next_entry(self):
+        today = timezone.now().date()
+        selection.draw_featured(today)
+        bag = PoemShuffle.objects.get(name=selection.FEATURED_BAG)
+        upcoming = list(
+            bag.entries.filter(position__gte=bag.position).order_by('position').values_list('poem_id', flat=True)
+        )
+        Poem.objects.filter(pk=upcoming[0]).delete()
+        with self.assertNumQueries(5):
+            self.assertEqual(selection.draw_featured(today), upcoming[1])
+
+    def test_zero_weight_leaves_poems_out(self):
+        self.assertCountEqual(selection.shuffled([1, 2, 3], weights={2: 0}), [1, 3])
+        kept = self.poems[0]
+        Poem.objects.filter(pk=kept.pk).update(author=Author.objects.create(name='Other', slug='other'))
+        with override_settings(FEATURED_AUTHOR_WEIGHTS={'author': 0}):
+            drawn = {selection.draw_featured(timezone.now().date()) for _ in range(3)}
+        self.assertEqual(drawn, {kept.pk})
+        with override_settings(FEATURED_THEME_WEIGHTS={'heku': -1}), self.assertRaises(ImproperlyConfigured):
+            selection.draw_featured(timezone.now().date())
+
+    def test_random_endpoint_serves_every_poem_once_per_cycle(self):
+        url = reverse('api_random_poem')
+        seen = [self.client.get(url).data['id'] for _ in range(4)]
+        self.assertCountEqual(seen, [p.id for p in self.poems])
+
+    def test_random_endpoint_skips_deleted_poems(self):
+        url = reverse('api_random_poem')
+        self.client.get(url)
+        Poem.objects.filter(id__in=[p.id for p in self.poems[1:]]).delete()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class FastSerializationTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        theme = Theme.objects.create(title='Хэку', slug='heku')
+        authors = [Author.objects.create(name=f'Усакъуэ {i}', slug=f'a-{i}') for i in range(3)]
+        for i in range(10):
+            make_poem(
+                authors[i % 3], f'Усэ {i}', 'Гъащӏэ\u2028"дахэ"\n' * 3,
+                theme if i % 2 else None, slug=f'p-{i}',
+            )
+
+    def test_fast_path_is_byte_identical(self):
+        urls = [
+            reverse('api_poems_list'),
+            reverse('api_poems_list') + '?cursor=&page_size=4',
+            reverse('api_latest_poems'),
+            reverse('api_search_poems') + '?q=усэ',
+            reverse('api_authors_list'),
+            reverse('api_author_poems', kwargs={'pk': Author.objects.first().pk}),
+            reverse('api_themes_list'),
+            reverse('api_theme_poems', kwargs={'pk': Theme.objects.first().pk}),
+            reverse('api_poems_list') + '?fields=id,text,theme',
+            reverse('api_latest_poems') + '?exclude=author,excerpt',
+            reverse('api_search_poems') + '?q=усэ&fields=title,text',
+            reverse('api_authors_list') + '?fields=name',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                with override_settings(API_FAST_SERIALIZATION=True):
+                    cache.clear()
+                    fast = self.client.get(url, HTTP_ACCEPT='application/json')
+                with override_settings(API_FAST_SERIALIZATION=False):
+                    cache.clear()
+                    slow = self.client.get(url, HTTP_ACCEPT='application/json')
+                self.assertEqual(fast.status_code, 200)
+                self.assertEqual(fast.content, slow.content)
+
+    def test_renderer_matches_json_renderer(self):
+        data = {'title': 'Гъащӏэ', 'line': 'a\u2028b\u2029c', 'items': [1, 2.5, None, True], 5: 'int key'}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_floats_render_as_null(self):
+        # JSONRenderer refuses them (strict JSON); orjson writes null
+        data = {'score': float('nan'), 'rank': float('inf')}
+        self.assertEqual(FastJSONRenderer().render(data), b'{"score":null,"rank":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+
+
+class SparseFieldsetTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Author', slug='author')
+        cls.poem = make_poem(cls.author, 'Poem', 'First line\nSecond line\n' + 'word ' * 100)
+
+    def test_excerpt_is_kept_in_sync_with_text(self):
+        self.assertEqual(self.poem.excerpt[:24], 'First line / Second line')
+        self.assertLessEqual(len(self.poem.excerpt), 201)
+        self.assertTrue(self.poem.excerpt.endswith('…'))
+        self.poem.text = 'Short'
+        self.poem.save(update_fields=['text'])
+        self.poem.refresh_from_db()
+        self.assertEqual(self.poem.excerpt, 'Short')
+
+    def test_lists_ship_excerpts_without_loading_text(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(API_FAST_SERIALIZATION=fast):
+                cache.clear()
+                from django.db import connection
+                from django.test.utils import CaptureQueriesContext
+
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('api_latest_poems'))
+                self.assertNotIn('text', response.data[0])
+                self.assertEqual(response.data[0]['excerpt'], self.poem.excerpt)
+                self.assertNotIn('"poems_poem"."text"', queries[-1]['sql'])
+
+    def test_fields_and_exclude(self):
+        response = self.client.get(reverse('api_poems_list'), {'fields': 'id,text'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'text'])
+        response = self.client.get(reverse('api_poem_detail', kwargs={'pk': self.poem.pk}), {'exclude': 'content,author'})
+        self.assertNotIn('content', response.data)
+        self.assertIn('likes', response.data)
+        response = self.client.get(reverse('api_featured_poem'), {'fields': 'featured_date'})
+        self.assertEqual(list(response.data), ['featured_date'])
+
+
+class CompressionTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name='Щоджэнцӏыкӏу Алий', slug='author')
+        for i in range(10):
+            make_poem(author, f'Гъащӏэ {i}', 'Си гъащӏэр уэращ\n' * 50, slug=f'p-{i}')
+
+    def get(self, encoding, name='api_latest_poems', **params):
+        return self.client.get(reverse(name), params, HTTP_ACCEPT_ENCODING=encoding)
+
+    def test_gzip_round_trip(self):
+        plain = self.get('')
+        response = self.get('gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_brotli_is_preferred(self):
+        import brotli
+
+        plain = self.get('')
+        response = self.get('gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+    def test_refused_encodings_and_small_bodies_are_sent_plain(self):
+        self.assertFalse(self.get('br;q=0, gzip;q=0').has_header('Content-Encoding'))
+        self.assertFalse(self.get('identity').has_header('Content-Encoding'))
+        with override_settings(API_COMPRESSION_MIN_SIZE=10 ** 6):
+            self.assertFalse(self.get('gzip').has_header('Content-Encoding'))
+
+    def test_explicit_refusals_win_over_the_wildcard(self):
+        self.assertEqual(middleware.negotiate('br;q=0, *'), 'gzip')
+        self.assertEqual(middleware.negotiate('*, gzip;q=0'), 'br')
+        self.assertIsNone(middleware.negotiate('br;q=0, gzip;q=0, *'))
+        self.assertIsNone(middleware.negotiate('*;q=0'))
+        self.assertEqual(self.get('br;q=0, *')['Content-Encoding'], 'gzip')
+
+    def test_cached_responses_are_compressed_once(self):
+        # Run the background recompression inline
+        with mock.patch('poems.middleware._recompress_later', side_effect=middleware._recompress), \
+                mock.patch('poems.middleware.compress', wraps=middleware.compress) as compress:
+            first = self.get('gzip')
+            with mock.patch.object(FastJSONRenderer, 'render') as render:
+                second = self.get('gzip')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        render.assert_not_called()
+        # Fast settings within the request, the best ones in the background
+        self.assertEqual([call.kwargs.get('best', True) for call in compress.call_args_list], [False, True])
+        plain = gzip.decompress(first.content)
+        self.assertEqual(second.content, middleware.compress(plain, 'gzip'))
+        self.assertIn('Accept-Encoding', second['Vary'])
+
+    def test_compressed_bodies_follow_the_accept_header(self):
+        self.get('gzip')
+        indented = self.client.get(reverse('api_latest_poems'), HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_ACCEPT='application/json; indent=2')
+        self.assertEqual(indented['X-Cache'], 'HIT')
+        self.assertIn(b'\n  ', gzip.decompress(indented.content))
+
+    def test_async_requests_compress_off_the_event_loop(self):
+        body = json.dumps({'text': 'Си гъащӏэр уэращ\n' * 50}).encode()
+
+        async def get_response(request):
+            return HttpResponse(body, content_type='application/json')
+
+        async def send():
+            request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+            return await middleware.CompressionMiddleware(get_response)(request), threading.current_thread()
+
+        threads = []
+        original = middleware.compress
+
+        def compress(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return original(*args, **kwargs)
+
+        with mock.patch('poems.middleware.compress', side_effect=compress):
+            response, loop_thread = async_to_sync(send)()
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+
+    def test_uncached_endpoints_are_compressed_per_request(self):
+        response = self.get('gzip', 'api_search_poems', q='гъащӏэ')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.get('', 'api_search_poems', q='гъащӏэ').content)
+
+
+class ImportCatalogTests(PoemsTestCase):
+    def write(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, 'w', encoding='utf-8') as fp:
+            fp.write(content)
+        return path
+
+    def dump(self):
+        records = [
+            {'model': 'poems.author', 'pk': 7, 'fields': {'name': 'Нало Заур', 'slug': 'nalo-zaur', 'views': 3}},
+            {'model': 'poems.theme', 'pk': 4, 'fields': {'title': 'Хэку', 'slug': 'heku', 'views': 0}},
+        ]
+        records += [
+            {'model': 'poems.poem', 'pk': 100 + i, 'fields': {
+                'title': f'Усэ {i}', 'slug': f'use-{i}', 'author': 7, 'category': 4,
+                'text': 'Гъащӏэр дахэщ', 'created_at': '2020-08-23T13:42:01.856Z',
+            }}
+            for i in range(5)
+        ]
+        return records
+
+    def test_streams_a_json_array_in_small_reads(self):
+        path = self.write('dump.json', json.dumps(self.dump(), ensure_ascii=False, indent=2))
+        with mock.patch('poems.importer.READ_SIZE', 7):
+            call_command('import_catalog', path, batch_size=2, stdout=io.StringIO())
+
+        author = Author.objects.get(slug='nalo-zaur')
+        self.assertEqual(author.views, 3)
+        self.assertEqual(Poem.objects.filter(author=author, category__slug='heku').count(), 5)
+        poem = Poem.objects.get(slug='use-0')
+        self.assertEqual(poem.excerpt, 'Гъащӏэр дахэщ')
+        self.assertEqual(poem.created_at.year, 2020)
+        self.assertEqual(len(search.search('дахэщ')), 5)
+
+    def test_reimport_upserts_by_slug(self):
+        path = self.write('dump.ndjson', '\n'.join(json.dumps(r) for r in self.dump()))
+        call_command('import_catalog', path, stdout=io.StringIO())
+        Poem.objects.filter(slug='use-1').update(views=42)
+
+        updated = [{'title': 'Renamed', 'slug': 'use-1', 'author': 'nalo-zaur', 'text': 'New'}]
+        path = self.write('poems.ndjson', json.dumps(updated))
+        call_command('import_catalog', path, model='poem', stdout=io.StringIO())
+
+        self.assertEqual(Poem.objects.count(), 5)
+        poem = Poem.objects.get(slug='use-1')
+        self.assertEqual((poem.title, poem.text, poem.views, poem.category), ('Renamed', 'New', 42, None))
+        self.assertEqual(Theme.objects.get(slug='heku').poems_count, 4)
+        self.assertEqual(Author.objects.get(slug='nalo-zaur').poems_count, 5)
+
+    def test_invalid_file_is_a_command_error(self):
+        from django.core.management import CommandError
+
+        path = self.write('broken.json', '[{"model": "poems.author", "fields": ')
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path, stdout=io.StringIO())
+
+    def test_unknown_references_name_the_record(self):
+        from django.core.management import CommandError
+
+        records = self.dump()
+        records[4]['fields']['author'] = 'nobody'
+        records[5]['fields']['category'] = 999
+        for record in (records[4], records[5]):
+            path = self.write('dump.json', json.dumps(records[:2] + [record]))
+            with self.subTest(fields=record['fields']), self.assertRaisesMessage(CommandError, f'{path}: record 3'):
+                call_command('import_catalog', path, stdout=io.StringIO())
+        self.assertFalse(Poem.objects.exists())
+
+    def test_top_level_must_be_an_array(self):
+        from django.core.management import CommandError
+
+        path = self.write('dump.json', json.dumps({'model': 'poems.author', 'fields': {'slug': 'a'}}))
+        with self.assertRaisesMessage(CommandError, 'Expected a JSON array'):
+            call_command('import_catalog', path, format='json', stdout=io.StringIO())
+
+
+class CleanPoemTextsTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        author = Author.objects.create(name='Нало Заур', slug='nalo-zaur')
+        self.dirty = make_poem(author, 'Усэ', '<p>Гъащӏэр&nbsp;&amp;\tдахэщ</p>\r\n<b>Хэку</b>   сӏыгъ')
+        self.clean = make_poem(author, 'Усэ 2', 'Гъащӏэр дахэщ')
+
+    def call(self, *args, **options):
+        out = io.StringIO()
+        call_command('clean_poem_texts', *args, workers=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_writes_only_changed_rows_without_touching_updated_at(self):
+        updated_at = Poem.objects.get(pk=self.dirty.pk).updated_at
+        with mock.patch('poems.models.Poem.save', side_effect=AssertionError('save() called')):
+            output = self.call()
+
+        self.assertIn('Checked 2 poems, changed 1', output)
+        poem = Poem.objects.get(pk=self.dirty.pk)
+        self.assertEqual(poem.text, 'Гъащӏэр\xa0&дахэщ\nХэку сӏыгъ')
+        self.assertEqual(poem.excerpt, 'Гъащӏэр\xa0&дахэщ / Хэку сӏыгъ')
+        self.assertEqual(poem.updated_at, updated_at)
+        self.assertEqual(search.search('сӏыгъ'), [self.dirty.pk])
+
+    def test_dry_run_prints_a_diff_and_saves_nothing(self):
+        output = self.call(dry_run=True, diff=True)
+
+        self.assertIn(f'--- poem {self.dirty.pk}', output)
+        self.assertIn('+Хэку сӏыгъ', output)
+        self.assertIn('would change 1', output)
+        self.assertEqual(Poem.objects.get(pk=self.dirty.pk).text, self.dirty.text)
+
+    def test_id_range(self):
+        output = self.call(start_id=self.clean.pk)
+        self.assertIn('Checked 1 poems, changed 0', output)
+        self.assertEqual(Poem.objects.get(pk=self.dirty.pk).text, self.dirty.text)
+
+    def test_process_pool(self):
+        from poems.cleaning import clean_poems
+
+        self.assertEqual(clean_poems(workers=2, batch_size=1), (2, 1))
+        self.assertNotIn('<p>', Poem.objects.get(pk=self.dirty.pk).text)
+
+
+class BenchmarkTests(PoemsTestCase):
+    def test_corpus_is_deterministic(self):
+        first, second = benchmark.Corpus(seed=3), benchmark.Corpus(seed=3)
+        self.assertEqual([first.text() for _ in range(5)], [second.text() for _ in range(5)])
+        self.assertNotEqual(benchmark.Corpus(seed=4).text(), benchmark.Corpus(seed=3).text())
+
+    def test_report_covers_every_route(self):
+        corpus = benchmark.generate_corpus(poems=60, seed=3)
+        self.assertEqual(Poem.objects.count(), 60)
+        self.assertTrue(search.search(corpus.search_term))
+
+        report = benchmark.run(requests=2, warmup=0, search_term=corpus.search_term)
+
+        routes = {name for name, _ in benchmark.route_urls()}
+        self.assertEqual(set(report['routes']), routes)
+        for name, result in report['routes'].items():
+            with self.subTest(route=name):
+                self.assertEqual(result['status'], 200)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+                self.assertLessEqual(result['queries'], QUERY_BUDGETS[name])
+        self.assertEqual(benchmark.regressions(report, report), [])
+
+    def test_regressions(self):
+        route = {'status': 200, 'p50_ms': 2.0, 'p95_ms': 4.0, 'queries': 1, 'bytes': 1000}
+        meta = {'poems': 10, 'cold': False, 'database': 'sqlite'}
+        baseline = {'meta': meta, 'routes': {'poem': route}}
+        slower = {'meta': meta, 'routes': {'poem': {**route, 'p95_ms': 9.0, 'queries': 2}}}
+        noise = {'meta': meta, 'routes': {'poem': {**route, 'p50_ms': 2.9}}}
+
+        self.assertEqual(
+            benchmark.regressions(slower, baseline),
+            ['poem: p95_ms 4.0 -> 9.0', 'poem: queries 1 -> 2'],
+        )
+        self.assertEqual(benchmark.regressions(noise, baseline), [])
+
+
+class MetricsTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(
+            METRICS_FLUSH_INTERVAL=3600,
+            METRICS_TOKEN='secret',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Drop samples recorded by earlier tests
+        metrics._pending.clear()
+
+        author = Author.objects.create(name='Author', slug='author')
+        self.poem = make_poem(author, 'Poem', 'Text')
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_route_metrics(self):
+        url = reverse('api_poem_detail', kwargs={'pk': self.poem.pk})
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get('/no-such-page/')
+
+        output = self.scrape()
+        route = 'method="GET",route="api_poem_detail"'
+        self.assertIn(f'wuserade_http_request_duration_seconds_count{{{route}}} 2', output)
+        self.assertIn(f'wuserade_http_request_duration_seconds_bucket{{{route},le="+Inf"}} 2', output)
+        self.assertIn('wuserade_http_requests_total{method="GET",route="api_poem_detail",status="200"} 2', output)
+        self.assertIn('wuserade_http_requests_total{method="GET",route="unmatched",status="404"} 1', output)
+        self.assertIn('wuserade_response_cache_requests_total{result="hit",route="api_poem_detail"} 1', output)
+        self.assertIn('wuserade_response_cache_requests_total{result="miss",route="api_poem_detail"} 1', output)
+        self.assertRegex(output, rf'wuserade_db_queries_total{{{route}}} [1-9]')
+        self.assertRegex(output, rf'wuserade_http_response_bytes_total{{{route}}} [1-9]')
+
+    def test_aggregates_across_processes(self):
+        import multiprocessing
+
+        def worker():
+            metrics.record('api_poems_list', 'GET', 200, 0.02, 100)
+            metrics.flush()
+
+        processes = [multiprocessing.get_context('fork').Process(target=worker) for _ in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        metrics.record('api_poems_list', 'GET', 200, 3.0, 100)
+
+        output = metrics.render()
+        route = 'method="GET",route="api_poems_list"'
+        self.assertIn(f'wuserade_http_request_duration_seconds_bucket{{{route},le="0.025"}} 3', output)
+        self.assertIn(f'wuserade_http_request_duration_seconds_bucket{{{route},le="5.0"}} 4', output)
+        self.assertIn(f'wuserade_http_request_duration_seconds_count{{{route}}} 4', output)
+        self.assertIn(f'wuserade_http_response_bytes_total{{{route}}} 400', output)
+
+    async def test_counts_queries_of_async_requests(self):
+        # The ORM runs these queries in another thread than the middleware
+        response = await self.async_client.get(reverse('api_themes_list'))
+        self.assertEqual(response.status_code, 200)
+        output = await sync_to_async(metrics.render)()
+        self.assertRegex(output, r'wuserade_db_queries_total{method="GET",route="api_themes_list"} [1-9]')
+
+    def test_streaming_responses_are_measured_when_consumed(self):
+        response = self.client.get(reverse('api_export_poems'))
+        body = b''.join(response.streaming_content)
+        response.close()
+
+        output = self.scrape()
+        route = 'method="GET",route="api_export_poems"'
+        self.assertIn(f'wuserade_http_response_bytes_total{{{route}}} {len(body)}', output)
+        self.assertRegex(output, rf'wuserade_db_queries_total{{{route}}} [1-9]')
+
+    def test_endpoint_requires_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 404)
+
+
+class StaticSnapshotTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        self.theme = Theme.objects.create(title='Хэку', slug='heku')
+        self.author = Author.objects.create(name='Нало Заур', slug='nalo-zaur')
+        self.poems = [make_poem(self.author, f'Усэ {i}', f'Text {i}', self.theme) for i in range(25)]
+        FeaturedPoemService.schedule(timezone.now().date(), 1)
+
+    def export(self, **options):
+        out = io.StringIO()
+        call_command('export_static_api', self.directory, stdout=out, **options)
+        return out.getvalue()
+
+    def read(self, path):
+        with open(os.path.join(self.directory, path), encoding='utf-8') as fp:
+            return json.load(fp)
+
+    def test_files_match_the_api(self):
+        self.export()
+        poem = self.poems[3]
+        cases = [
+            ('api/v1/poems/latest.json', reverse('api_latest_poems')),
+            ('api/v1/poems/featured.json', reverse('api_featured_poem')),
+            ('api/v1/poems/trending.json', reverse('api_trending_poems')),
+            ('api/v1/authors.json', reverse('api_authors_list')),
+            ('api/v1/authors/popular.json', reverse('api_popular_authors')),
+            ('api/v1/themes.json', reverse('api_themes_list')),
+            (f'api/v1/poems/{poem.pk}.json', reverse('api_poem_detail', kwargs={'pk': poem.pk})),
+            (f'api/v1/authors/{self.author.pk}.json', reverse('api_author_detail', kwargs={'pk': self.author.pk})),
+        ]
+        for path, url in cases:
+            with self.subTest(path=path):
+                self.assertEqual(self.read(path), self.client_class().get(url).json())
+
+        feeds = [
+            ('api/v1/poems', reverse('api_poems_list')),
+            (f'api/v1/authors/{self.author.pk}/poems', reverse('api_author_poems', kwargs={'pk': self.author.pk})),
+            (f'api/v1/themes/{self.theme.pk}/poems', reverse('api_theme_poems', kwargs={'pk': self.theme.pk})),
+        ]
+        for prefix, url in feeds:
+            for number, path in [(1, f'{prefix}.json'), (2, f'{prefix}/page/2.json')]:
+                with self.subTest(path=path):
+                    api = self.client.get(url, {'page': number}).json()
+                    page = self.read(path)
+                    self.assertEqual(page['results'], api['results'])
+                    self.assertEqual(page['count'], 25)
+        self.assertEqual(self.read('api/v1/poems.json')['next'], '/api/v1/poems/page/2.json')
+        self.assertEqual(self.read('api/v1/poems/page/2.json')['previous'], '/api/v1/poems.json')
+        self.assertIsNone(self.read('api/v1/poems/page/2.json')['next'])
+
+    def test_rewrites_only_what_changed(self):
+        self.export()
+        self.assertIn('Wrote 0 files, 38 unchanged, 0 removed', self.export())
+
+        # A new title touches the poem's page and the lists and feeds
+        # showing it; the other poem pages stay as they are. The featured
+        # poem is picked at random, so rename another one.
+        featured = FeaturedPoem.objects.get().poem_id
+        poem = next(poem for poem in self.poems if poem.pk != featured)
+        poem.title = 'Renamed'
+        poem.save()
+        self.assertIn('Wrote 4 files, 34 unchanged, 0 removed', self.export())
+        self.assertEqual(self.read(f'api/v1/poems/{poem.pk}.json')['title'], 'Renamed')
+
+        removed = next(other.pk for other in self.poems if other.pk not in (featured, poem.pk))
+        Poem.objects.filter(pk=removed).delete()
+        self.assertIn('1 removed', self.export())
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'api/v1/poems/{removed}.json')))
+        self.assertEqual(self.read('api/v1/poems.json')['count'], 24)
+
+    def test_text_edits_that_keep_updated_at_are_exported(self):
+        self.export()
+        # Like clean_poem_texts: bulk_update, same length, same updated_at
+        poem = self.poems[24]
+        poem.text = 'Text X'
+        poem.excerpt = make_excerpt(poem.text)
+        Poem.objects.bulk_update([poem], ['text', 'excerpt'])
+        self.export()
+        self.assertEqual(self.read(f'api/v1/poems/{poem.pk}.json')['content'], 'Text X')
+        self.assertEqual(self.read('api/v1/poems.json')['results'][0]['excerpt'], 'Text X')
+
+    def test_export_never_features_a_poem(self):
+        self.export()
+        FeaturedPoem.objects.all().delete()
+        self.assertIn('1 removed', self.export())
+        self.assertFalse(FeaturedPoem.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'api/v1/poems/featured.json')))
+
+
+class AsyncViewTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.theme = Theme.objects.create(title='Хэку', slug='heku')
+        cls.author = Author.objects.create(name='Нало Заур', slug='nalo-zaur')
+        cls.poems = [
+            make_poem(cls.author, f'Усэ {i}', f'Гъащӏэр дахэщ {i}', cls.theme if i % 2 else None, slug=f'use-{i}')
+            for i in range(30)
+        ]
+        FeaturedPoemService.schedule(timezone.now().date(), 1)
+
+    def call_async(self, view, path, params=None, **kwargs):
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import RequestFactory
+
+        request = RequestFactory().get(path, params or {})
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_responses_match_the_sync_views(self):
+        from poems import async_views
+
+        poem, author, theme = self.poems[4], self.author, self.theme
+        cases = [
+            (async_views.poem_list, 'api_poems_list', {}, {}),
+            (async_views.poem_list, 'api_poems_list', {}, {'page': 2, 'fields': 'id,title,text'}),
+            (async_views.poem_list, 'api_poems_list', {}, {'page': 9}),
+            (async_views.poem_list, 'api_poems_list', {}, {'cursor': '', 'page_size': 5}),
+            (async_views.poem_list, 'api_poems_list', {}, {'cursor': 'not-a-cursor'}),
+            (async_views.poem_list, 'api_poems_list', {}, {'page': 'last', 'page_size': 4}),
+            (async_views.poem_detail, 'api_poem_detail', {'pk': poem.pk}, {}),
+            (async_views.poem_detail, 'api_poem_detail', {'pk': 0}, {}),
+            (async_views.latest_poems, 'api_latest_poems', {}, {}),
+            (async_views.trending_poems, 'api_trending_poems', {}, {}),
+            (async_views.popular_authors, 'api_popular_authors', {}, {}),
+            (async_views.search_poems, 'api_search_poems', {}, {'q': 'дахэщ', 'page_size': 4}),
+            (async_views.search_poems, 'api_search_poems', {}, {}),
+            (async_views.author_list, 'api_authors_list', {}, {}),
+            (async_views.author_detail, 'api_author_detail', {'pk': author.pk}, {'exclude': 'bio'}),
+            (async_views.author_poems, 'api_author_poems', {'pk': author.pk}, {}),
+            (async_views.theme_list, 'api_themes_list', {}, {}),
+            (async_views.theme_poems, 'api_theme_poems', {'pk': theme.pk}, {'cursor': ''}),
+            (async_views.featured_poem, 'api_featured_poem', {}, {}),
+        ]
+        for view, name, kwargs, params in cases:
+            with self.subTest(route=name, params=params):
+                url = reverse(name, kwargs=kwargs)
+                expected = self.client_class().get(url, params)
+                response = self.call_async(view, url, params, **kwargs)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(json.loads(response.content), expected.json())
+
+    def test_cached_and_counted_like_the_sync_views(self):
+        from poems import async_views
+
+        poem = self.poems[0]
+        url = reverse('api_poem_detail', kwargs={'pk': poem.pk})
+        with mock.patch('poems.counters.increment') as increment:
+            first = self.call_async(async_views.poem_detail, url, pk=poem.pk)
+            second = self.call_async(async_views.poem_detail, url, pk=poem.pk)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(increment.call_count, 2)
+        self.assertIn('viewed_poems', first.cookies)
+
+        random = self.call_async(async_views.random_poem, reverse('api_random_poem'))
+        self.assertIn(json.loads(random.content)['id'], {p.pk for p in self.poems})
+
+    async def test_middleware_runs_in_async_mode(self):
+        response = await self.async_client.get(
+            reverse('api_poems_list'), {'fields': 'id,title,text'}, headers={'Accept-Encoding': 'gzip'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['count'], 30)
+
+
+class PoemCountTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(name='Нало Заур', slug='nalo-zaur')
+        self.other = Author.objects.create(name='Кешокъуэ Алим', slug='keshokue-alim')
+        self.theme = Theme.objects.create(title='Хэку', slug='heku')
+        self.poems = [make_poem(self.author, f'Усэ {i}', 'Гъащӏэр дахэщ', self.theme) for i in range(3)]
+
+    def counts(self):
+        return (
+            Author.objects.get(pk=self.author.pk).poems_count,
+            Author.objects.get(pk=self.other.pk).poems_count,
+            Theme.objects.get(pk=self.theme.pk).poems_count,
+        )
+
+    def test_counts_follow_create_reassign_and_delete(self):
+        self.assertEqual(self.counts(), (3, 0, 3))
+
+        poem = self.poems[0]
+        poem.author = self.other
+        poem.category = None
+        poem.save()
+        self.assertEqual(self.counts(), (2, 1, 2))
+
+        self.poems[1].delete()
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+        self.other.delete()
+        self.assertEqual(Author.objects.get(pk=self.author.pk).poems_count, 1)
+        self.assertEqual(Theme.objects.get(pk=self.theme.pk).poems_count, 1)
+
+    def test_saving_a_stale_instance_keeps_the_count(self):
+        # self.author was loaded before its poems were created
+        self.author.name = 'Нало Заур Афлик'
+        self.author.save()
+        self.theme.save()
+        self.assertEqual(self.counts(), (3, 0, 3))
+
+    def test_api_reads_the_stored_counts(self):
+        Author.objects.filter(pk=self.author.pk).update(poems_count=7)
+        response = self.client.get(reverse('api_author_detail', kwargs={'pk': self.author.pk}))
+        self.assertEqual(response.data['poems_count'], 7)
+        authors = self.client.get(reverse('api_authors_list')).data
+        self.assertEqual([author['id'] for author in authors], [self.author.pk])
+
+    def test_repair_command_fixes_drifted_counts(self):
+        Poem.objects.filter(pk=self.poems[0].pk).update(author=self.other)
+        self.assertEqual(self.counts(), (3, 0, 3))
+        detail = reverse('api_author_detail', kwargs={'pk': self.other.pk})
+        self.client.get(reverse('api_authors_list'))
+
+        out = io.StringIO()
+        call_command('repair_poem_counts', dry_run=True, stdout=out)
+        self.assertIn('Found 2 author and 0 theme counts', out.getvalue())
+        self.assertEqual(self.counts(), (3, 0, 3))
+
+        out = io.StringIO()
+        call_command('repair_poem_counts', stdout=out)
+        self.assertIn('Repaired 2 author and 0 theme counts', out.getvalue())
+        self.assertEqual(self.counts(), (2, 1, 3))
+        self.assertEqual(self.client.get(detail).data['poems_count'], 1)
+        self.assertEqual(len(self.client.get(reverse('api_authors_list')).data), 2)
+
+        out = io.StringIO()
+        call_command('repair_poem_counts', stdout=out)
+        self.assertIn('Repaired 0 author and 0 theme counts', out.getvalue())
+
+
+class ExportTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Нало Заур', slug='nalo-zaur')
+        cls.theme = Theme.objects.create(title='Хэку', slug='heku')
+        cls.poems = [make_poem(cls.author, f'Усэ {i}', f'Гъащӏэр\nдахэщ {i}', cls.theme) for i in range(5)]
+        old = timezone.make_aware(datetime.datetime(2020, 1, 1))
+        Poem.objects.filter(id__in=[p.id for p in cls.poems[:3]]).update(updated_at=old)
+
+    def lines(self, response):
+        return [json.loads(line) for line in response.getvalue().decode().splitlines()]
+
+    def test_poems_are_streamed_as_ndjson(self):
+        with mock.patch('poems.export.CHUNK_SIZE', 2):
+            response = self.client.get(reverse('api_export_poems'), HTTP_ACCEPT='application/x-ndjson')
+            chunks = [chunk for chunk in response.streaming_content if chunk]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('poems.ndjson', response['Content-Disposition'])
+        self.assertEqual(len(chunks), 3)
+
+        rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [p.id for p in self.poems])
+        self.assertEqual(rows[0]['text'], 'Гъащӏэр\nдахэщ 0')
+        self.assertEqual((rows[0]['author_id'], rows[0]['category_id']), (self.author.id, self.theme.id))
+        self.assertTrue(rows[0]['created_at'].endswith('Z'))
+
+    def test_authors_and_themes(self):
+        authors = self.lines(self.client.get(reverse('api_export_authors')))
+        self.assertEqual([(a['slug'], a['poems_count']) for a in authors], [('nalo-zaur', 5)])
+        themes = self.lines(self.client.get(reverse('api_export_themes')))
+        self.assertEqual([(t['slug'], t['poems_count']) for t in themes], [('heku', 5)])
+
+    def test_since_returns_rows_updated_after(self):
+        response = self.client.get(reverse('api_export_poems'), {'since': '2021-01-01'})
+        self.assertEqual([row['id'] for row in self.lines(response)], [p.id for p in self.poems[3:]])
+
+        next_since = response['X-Export-Next-Since']
+        self.assertEqual(self.lines(self.client.get(reverse('api_export_poems'), {'since': next_since})), [])
+
+        for url, params in [
+            (reverse('api_export_poems'), {'since': 'yesterday'}),
+            (reverse('api_export_themes'), {'since': '2021-01-01'}),
+        ]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_gzip_when_accepted(self):
+        plain = self.client.get(reverse('api_export_poems')).getvalue()
+        response = self.client.get(reverse('api_export_poems'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.getvalue()), plain)
+
+    async def test_async_views_stream_the_same_rows(self):
+        from asgiref.sync import sync_to_async
+        from django.test import RequestFactory
+        from poems import async_views
+
+        request = RequestFactory().get(reverse('api_export_poems'), {'since': '2021-01-01'})
+        response = await async_views.export_poems(request)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        expected = await sync_to_async(
+            lambda: self.client.get(reverse('api_export_poems'), {'since': '2021-01-01'}).getvalue()
+        )()
+        self.assertEqual(body, expected)
+
+
+class AutocompleteTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(name='Щоджэнцӏыкӏу Алий', slug='shogentsiku-aliy')
+        Author.objects.create(name='Щоджэнов', slug='no-poems')
+        cls.first = make_poem(cls.author, 'Гъащӏэ')
+        cls.inner = make_poem(cls.author, 'Си гъащӏэр')
+        cls.other = make_poem(cls.author, 'Мэз')
+
+    def complete(self, q, **params):
+        response = self.client.get(reverse('api_autocomplete'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['id']) for item in response.json()]
+
+    def test_prefixes_match_titles_and_author_names(self):
+        self.assertEqual(self.complete('ГЪАЩ1'), [('poem', self.first.id), ('poem', self.inner.id)])
+        self.assertEqual(self.complete('щоджэн'), [('author', self.author.id)])
+        self.assertEqual(self.complete('алий'), [('author', self.author.id)])
+        self.assertEqual(self.complete('си  гъа'), [('poem', self.inner.id)])
+        self.assertEqual(self.complete('гъащӏэ', limit=1), [('poem', self.first.id)])
+        self.assertEqual(self.complete('жыг'), [])
+
+        item = self.client.get(reverse('api_autocomplete'), {'q': 'мэ'}).json()[0]
+        self.assertEqual(item, {'type': 'poem', 'id': self.other.id, 'label': 'Мэз', 'author': 'Щоджэнцӏыкӏу Алий'})
+
+    def test_lookups_do_not_query_the_database(self):
+        self.complete('гъа')
+        with self.assertNumQueries(0):
+            self.complete('мэ')
+
+    @override_settings(CATALOG_CHECK_INTERVAL=0)
+    def test_rebuilds_after_catalog_changes(self):
+        self.assertEqual(self.complete('жыг'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            poem = make_poem(self.author, 'Жыг')
+        self.assertEqual(self.complete('жыг'), [('poem', poem.id)])
+        with self.captureOnCommitCallbacks(execute=True):
+            poem.delete()
+        self.assertEqual(self.complete('жыг'), [])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get(reverse('api_autocomplete'), {'q': ' '}).status_code, 400)
+
+    def test_async_view_matches(self):
+        from poems import async_views
+
+        expected = self.client.get(reverse('api_autocomplete'), {'q': 'гъа'}).json()
+        autocomplete.index.discard()
+        request = RequestFactory().get(reverse('api_autocomplete'), {'q': 'гъа'})
+        response = async_to_sync(async_views.autocomplete_titles)(request)
+        self.assertEqual(json.loads(response.content), expected)
+
+
+@mock.patch('poems.related.MAX_DOCUMENT_FREQUENCY', 0.5)
+class RelatedPoemTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = Author.objects.create(name='Нало Заур', slug='nalo-zaur')
+        self.forest = make_poem(self.author, 'Мэз', 'Мэз псы уэшх')
+        self.river = make_poem(self.author, 'Псы', 'Мэз псы жьыбгъэ')
+        self.autumn = make_poem(self.author, 'Бжьыхьэ', 'Бжьыхьэ пшахъуэ')
+        self.sea = make_poem(self.author, 'Тенджыз', 'Бжьыхьэ пшахъуэ тенджыз')
+        self.wind = make_poem(self.author, 'Жьыбгъэ', 'Уэшх жьыбгъэ')
+
+    def related(self, poem):
+        response = self.client.get(reverse('api_poem_detail', kwargs={'pk': poem.pk}))
+        return [item['id'] for item in response.data['related']]
+
+    def test_detail_lists_the_most_similar_poems(self):
+        self.assertEqual(self.related(self.forest), [])
+        call_command('update_related_poems', top_k=1, stdout=io.StringIO())
+
+        self.assertEqual(self.related(self.forest), [self.river.pk])
+        self.assertEqual(self.related(self.autumn), [self.sea.pk])
+        item = self.client.get(reverse('api_poem_detail', kwargs={'pk': self.sea.pk})).data['related'][0]
+        self.assertEqual(item, {
+            'id': self.autumn.pk, 'title': 'Бжьыхьэ', 'author': {'id': self.author.pk, 'name': 'Нало Заур'},
+        })
+
+    def test_incremental_runs_only_compare_changed_poems(self):
+        self.assertEqual(related.update_related(top_k=1), (5, 5))
+        self.assertEqual(related.update_related(top_k=1), (0, 0))
+        self.assertEqual(self.related(self.sea), [self.autumn.pk])
+
+        copy = make_poem(self.author, 'Тенджыз', 'Бжьыхьэ пшахъуэ тенджыз')
+        self.assertEqual(related.update_related(top_k=1), (1, 2))
+        self.assertEqual(self.related(self.sea), [copy.pk])
+        self.assertEqual(self.related(copy), [self.sea.pk])
+
+        self.sea.title = self.sea.text = 'Уафэ'
+        self.sea.save()
+        related.update_related(top_k=1)
+        self.assertEqual(self.related(copy), [self.autumn.pk])
+        self.assertEqual(self.related(self.sea), [])
+
+    def test_poems_short_of_neighbours_settle(self):
+        related.update_related(top_k=related.TOP_K)
+        self.assertLess(RelatedPoem.objects.filter(poem=self.forest).count(), related.TOP_K)
+        self.assertEqual(related.update_related(top_k=related.TOP_K), (0, 0))
+
+        self.river.delete()
+        self.assertGreater(related.update_related(top_k=related.TOP_K)[0], 0)
+        self.assertNotIn(self.river.pk, self.related(self.forest))
+        self.assertEqual(related.update_related(top_k=related.TOP_K), (0, 0))
+
+    def test_renamed_and_deleted_poems_leave_the_cached_lists(self):
+        related.update_related(top_k=1)
+        url = reverse('api_poem_detail', kwargs={'pk': self.forest.pk})
+        self.client.get(url)
+
+        self.river.title = 'Псыхъуэ'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.river.save()
+        self.assertEqual(self.client.get(url).data['related'][0]['title'], 'Псыхъуэ')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.river.delete()
+        self.assertEqual(self.client.get(url).data['related'], [])
+
+
+class RankingTests(PoemsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.authors = [Author.objects.create(name=f'Author {i}', slug=f'author-{i}') for i in range(3)]
+        self.poems = [make_poem(self.authors[i % 2], f'Poem {i}') for i in range(4)]
+
+    def views(self, instance, views, hours_ago=0):
+        ViewBucket.objects.create(
+            model=instance._meta.label, object_id=instance.pk, views=views,
+            hour=rankings._hour(self.now - datetime.timedelta(hours=hours_ago)),
+        )
+
+    def ids(self, name):
+        return [item['id'] for item in self.client.get(reverse(name)).json()]
+
+    def test_flush_adds_views_to_hourly_buckets(self):
+        for _ in range(3):
+            self.poems[0].update_views()
+        self.authors[2].update_views()
+        counters.flush()
+        self.poems[0].update_views()
+        counters.flush()
+
+        buckets = ViewBucket.objects.values_list('model', 'object_id', 'views')
+        self.assertCountEqual(buckets, [
+            ('poems.Poem', self.poems[0].pk, 4),
+            ('poems.Author', self.authors[2].pk, 1),
+        ])
+
+    def test_views_are_bucketed_in_the_hour_they_were_recorded(self):
+        viewed = time.time() - 3 * 60 * 60
+        with mock.patch('time.time', return_value=viewed):
+            self.poems[0].update_views()
+        self.poems[0].update_views()
+        counters.flush()
+
+        viewed_hour = datetime.datetime.fromtimestamp(viewed - viewed % 3600, datetime.timezone.utc)
+        buckets = ViewBucket.objects.filter(hour=viewed_hour).values_list('object_id', 'views')
+        self.assertEqual(list(buckets), [(self.poems[0].pk, 1)])
+        self.assertEqual(ViewBucket.objects.count(), 2)
+
+    def test_recent_views_outrank_older_ones(self):
+        self.views(self.poems[0], 10, hours_ago=48)
+        self.views(self.poems[1], 4)
+        self.views(self.poems[2], 1, hours_ago=1)
+        self.views(self.poems[3], 100, hours_ago=24 * 8)
+        self.views(self.authors[2], 3)
+
+        self.assertEqual(self.ids('api_trending_poems'), [])
+        call_command('update_rankings', stdout=io.StringIO())
+
+        self.assertEqual(self.ids('api_trending_poems'), [self.poems[1].pk, self.poems[0].pk, self.poems[2].pk])
+        # Poems 0 and 2 (3.47 decayed views) are by author 0, poem 1 (4) by author 1
+        self.assertEqual(self.ids('api_popular_authors'), [self.authors[1].pk, self.authors[0].pk, self.authors[2].pk])
+        # Outside the window
+        self.assertFalse(ViewBucket.objects.filter(object_id=self.poems[3].pk, model='poems.Poem').exists())
+        self.assertNotIn('text', self.client.get(reverse('api_trending_poems')).json()[0])
+
+    def test_deleted_poems_leave_the_rankings(self):
+        self.views(self.poems[0], 5)
+        self.views(self.poems[1], 1)
+        rankings.update_rankings()
+        self.poems[0].delete()
+        self.assertEqual(self.ids('api_trending_poems'), [self.poems[1].pk])
+        self.assertEqual(rankings.update_rankings(size=1), (1, 1))
+        self.assertEqual(self.ids('api_popular_authors'), [self.authors[1].pk])
+
+    def test_only_objects_with_views_are_read(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.views(self.poems[1], 2)
+        self.views(self.authors[2], 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(rankings.update_rankings(), (1, 2))
+        reads = [query['sql'] for query in queries if 'FROM "poems_poem"' in query['sql']
+                 or 'FROM "poems_author"' in query['sql']]
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all(' IN (' in sql for sql in reads))
+
+    def test_async_views_match(self):
+        from poems import async_views
+
+        self.views(self.poems[1], 2)
+        self.views(self.poems[0], 1)
+        rankings.update_rankings()
+        for view, name in [(async_views.trending_poems, 'api_trending_poems'),
+                           (async_views.popular_authors, 'api_popular_authors')]:
+            with self.subTest(route=name):
+                expected = self.client_class().get(reverse(name)).json()
+                response = async_to_sync(view)(RequestFactory().get(reverse(name)))
+                self.assertEqual(json.loads(response.content), expected)
+                self.assertEqual(len(expected), 2)
+
+
+@override_settings(API_CATALOG_SNAPSHOT=True, CATALOG_CHECK_INTERVAL=0)
+class CatalogTests(PoemsTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.theme = Theme.objects.create(title='Хэку', slug='heku')
+        Theme.objects.create(title='Мэз', slug='mez')
+        cls.author = Author.objects.create(name='Нало Заур', slug='nalo-zaur', photo='photos/nalo.jpg')
+        cls.other = Author.objects.create(name='Бемырзэ', slug='bemyrze')
+        Author.objects.create(name='Абыдэ', slug='no-poems')
+        cls.poems = [
+            make_poem(
+                cls.author if i % 3 else cls.other, f'Усэ {i}', f'Гъащӏэр\n"дахэщ" {i}',
+                cls.theme if i % 2 else None, slug=f'use-{i}',
+            )
+            for i in range(30)
+        ]
+        RelatedPoem.objects.bulk_create(
+            RelatedPoem(poem=cls.poems[4], related=related, rank=rank, score=1 / rank, computed_at=timezone.now())
+            for rank, related in enumerate([cls.poems[9], cls.poems[2]], 1)
+        )
+
+    def get(self, url, params=None, snapshot=True):
+        cache.clear()
+        with override_settings(API_CATALOG_SNAPSHOT=snapshot):
+            return self.client.get(url, params or {}, HTTP_ACCEPT='application/json')
+
+    def test_responses_match_the_database(self):
+        poem, author, theme = self.poems[4], self.author, self.theme
+        cases = [
+            ('api_poems_list', {}, {}),
+            ('api_poems_list', {}, {'page': 2, 'page_size': 7, 'fields': 'id,title,text'}),
+            ('api_poems_list', {}, {'page': 9}),
+            ('api_poems_list', {}, {'cursor': '', 'page_size': 5}),
+            ('api_poem_detail', {'pk': poem.pk}, {}),
+            ('api_poem_detail', {'pk': poem.pk}, {'exclude': 'content,related'}),
+            ('api_poem_detail', {'pk': 0}, {}),
+            ('api_latest_poems', {}, {'exclude': 'excerpt'}),
+            ('api_authors_list', {}, {}),
+            ('api_author_detail', {'pk': author.pk}, {}),
+            ('api_author_detail', {'pk': self.other.pk}, {'fields': 'photo,created_at'}),
+            ('api_author_detail', {'pk': 0}, {}),
+            ('api_author_poems', {'pk': author.pk}, {'page_size': 4, 'page': 'last'}),
+            ('api_author_poems', {'pk': 0}, {}),
+            ('api_themes_list', {}, {}),
+            ('api_theme_poems', {'pk': theme.pk}, {'cursor': ''}),
+            ('poems_list', {}, {'page': 2}),
+            ('poems_list', {}, {'cursor': ''}),
+            ('poem', {'pk': poem.pk}, {}),
+            ('poem', {'pk': 0}, {}),
+            ('latest_poems', {}, {}),
+            ('authors_list', {}, {}),
+            ('authors_list_v2', {}, {}),
+            ('author', {'pk': author.pk}, {}),
+            ('author', {'pk': 0}, {}),
+            ('get_poems_of_author', {'pk': self.other.pk}, {}),
+            ('themes_list', {}, {}),
+            ('poems_by_theme', {'pk': theme.pk}, {'page': 'x'}),
+        ]
+        for name, kwargs, params in cases:
+            with self.subTest(route=name, params=params):
+                url = reverse(name, kwargs=kwargs)
+                served = self.get(url, params)
+                expected = self.get(url, params, snapshot=False)
+                self.assertEqual(served.status_code, expected.status_code)
+                self.assertEqual(served.content, expected.content)
+
+        related = self.get(reverse('api_poem_detail', kwargs={'pk': poem.pk})).json()['related']
+        self.assertEqual([item['id'] for item in related], [self.poems[9].pk, self.poems[2].pk])
+
+    def test_keyset_pages_match_the_database(self):
+        # Ties on created_at are broken by id, as in the database
+        Poem.objects.filter(pk__in=[poem.pk for poem in self.poems[5:12]]).update(created_at=self.poems[5].created_at)
+        newest_first = list(
+            Poem.objects.filter(author=self.author).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        url = reverse('api_author_poems', kwargs={'pk': self.author.pk}) + '?cursor=&page_size=6'
+        pages = []
+        while url:
+            served = self.get(url).json()
+            self.assertEqual(served, self.get(url, snapshot=False).json())
+            pages.append([poem['id'] for poem in served['results']])
+            previous, url = served['previous'], served['next']
+        self.assertEqual(sum(pages, []), newest_first)
+
+        back = self.get(previous).json()
+        self.assertEqual([poem['id'] for poem in back['results']], pages[-2])
+        self.assertEqual(back, self.get(previous, snapshot=False).json())
+        self.assertEqual(self.get(reverse('api_poems_list'), {'cursor': 'nonsense'}).status_code, 404)
+
+    @override_settings(CATALOG_CHECK_INTERVAL=3600)
+    def test_reads_do_not_query_the_database(self):
+        urls = [
+            reverse('api_poems_list'),
+            reverse('api_theme_poems', kwargs={'pk': self.theme.pk}) + '?cursor=',
+            reverse('api_authors_list'),
+            reverse('api_themes_list'),
+            reverse('poems_list'),
+            reverse('author', kwargs={'pk': self.author.pk}),
+        ]
+        self.get(urls[0])
+        for url in urls:
+            with self.subTest(url=url), self.assertNumQueries(0):
+                self.assertEqual(self.get(url).status_code, 200)
+
+    def test_writes_reload_the_snapshot(self):
+        list_url = reverse('api_poems_list')
+        self.assertEqual(self.get(list_url).json()['count'], 30)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            poem = make_poem(self.other, 'Жыг', category=self.theme)
+        self.assertEqual(self.get(list_url).json()['results'][0]['title'], 'Жыг')
+        self.author.name = 'Нало Заур Абубэчыр'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        names = [author['name'] for author in self.get(reverse('api_authors_list')).json()]
+        self.assertEqual(names, ['Бемырзэ', 'Нало Заур Абубэчыр'])
+        url = reverse('api_poem_detail', kwargs={'pk': poem.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            poem.delete()
+        self.assertEqual(self.get(url).status_code, 404)
+
+    def test_version_is_bumped_when_the_write_commits(self):
+        self.get(reverse('api_poems_list'))
+        version = catalog.version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            make_poem(self.other, 'Жыг')
+            self.assertEqual(catalog.version(), version)
+            self.assertIsNotNone(catalog.store.snapshot)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(catalog.version(), version)
+        self.assertIsNone(catalog.store.snapshot)
+
+    def test_reloads_when_another_worker_bumps_the_version(self):
+        poem = self.poems[0]
+        url = reverse('api_poem_detail', kwargs={'pk': poem.pk})
+        self.assertEqual(self.get(url).json()['title'], 'Усэ 0')
+
+        # Written by another process: no signal reaches this worker
+        Poem.objects.filter(pk=poem.pk).update(title='Жыг')
+        self.assertEqual(self.get(url).json()['title'], 'Усэ 0')
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        self.assertEqual(self.get(url).json()['title'], 'Жыг')
+
+    def test_async_views_match(self):
+        from poems import async_views
+
+        cases = [
+            (async_views.poem_list, 'api_poems_list', {}, {'page': 2}),
+            (async_views.poem_list, 'api_poems_list', {}, {'cursor': '', 'page_size': 5}),
+            (async_views.poem_detail, 'api_poem_detail', {'pk': self.poems[4].pk}, {}),
+            (async_views.latest_poems, 'api_latest_poems', {}, {}),
+            (async_views.author_list, 'api_authors_list', {}, {}),
+            (async_views.author_detail, 'api_author_detail', {'pk': self.author.pk}, {}),
+            (async_views.author_poems, 'api_author_poems', {'pk': self.author.pk}, {}),
+            (async_views.theme_list, 'api_themes_list', {}, {}),
+            (async_views.theme_poems, 'api_theme_poems', {'pk': self.theme.pk}, {'cursor': ''}),
+        ]
+        for view, name, kwargs, params in cases:
+            with self.subTest(route=name, params=params):
+                url = reverse(name, kwargs=kwargs)
+                expected = self.get(url, params, snapshot=False).json()
+                cache.clear()
+                response = async_to_sync(view)(RequestFactory().get(url, params), **kwargs)
+                self.assertEqual(json.loads(response.content), expected)
+
+        random = async_to_sync(async_views.random_poem)(RequestFactory().get(reverse('api_random_poem')))
+        self.assertIn(json.loads(random.content)['id'], {poem.pk for poem in self.poems})
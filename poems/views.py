@@ -1,17 +1,62 @@
+import functools
 from http import HTTPStatus
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.db.models import Q, Count
 
 # Create your views here.
 from django.http import JsonResponse
+from rest_framework.exceptions import NotFound
 
+from poems import catalog, search
+from poems.pagination import KeysetPagination
 from poems.models import Poem, Author, Theme
 
 
 def index(request):
-    poems = Poem.objects.all().order_by('-created_at')
+    return _paginated_poems(request)
+
+
+def _poem_data(poem):
+    return {
+        'id': poem.id,
+        'title': poem.title,
+        'author': {
+            "id": poem.author.id,
+            "name": poem.author.name,
+        },
+        'content': poem.text
+    }
+
+
+def _snapshot_poem_data(snapshot, pk):
+    """_poem_data() of a poem in the catalog snapshot"""
+    poem = snapshot.poem_rows[pk]
+    return {
+        'id': poem.id,
+        'title': poem.title,
+        'author': {
+            "id": poem.author_id,
+            "name": snapshot.author_rows[poem.author_id].name,
+        },
+        'content': poem.text
+    }
+
+
+def _paginated_poems(request, **filters):
+    """Newest first, 20 per page; keyset pages when ?cursor= is sent"""
+    if catalog.enabled():
+        snapshot = catalog.get()
+        feed = snapshot.feed(**filters)
+        if KeysetPagination.requested(request):
+            return _poems_by_cursor(request, feed, snapshot)
+        poems, poem_data = feed.ids, functools.partial(_snapshot_poem_data, snapshot)
+    else:
+        poems = Poem.objects.filter(**filters).select_related('author').order_by('-created_at', '-id')
+        if KeysetPagination.requested(request):
+            return _poems_by_cursor(request, poems)
+        poem_data = _poem_data
+
     page = request.GET.get('page', 1)
     paginator = Paginator(poems, 20)
 
@@ -22,17 +67,7 @@ def index(request):
     except EmptyPage:
         poems = paginator.page(paginator.num_pages)
 
-    poems_data = [
-        {
-            'id': poem.id,
-            'title': poem.title,
-            'author': {
-                "id": poem.author.id,
-                "name": poem.author.name,
-            },
-            'content': poem.text
-        } for poem in poems
-    ]
+    poems_data = [poem_data(poem) for poem in poems]
 
     return JsonResponse(
         {
@@ -44,64 +79,91 @@ def index(request):
     )
 
 
-def get_poem(request, pk):
+def _poems_by_cursor(request, poems, snapshot=None):
+    """Keyset pages of a queryset, or of a catalog feed with its snapshot"""
+    paginator = KeysetPagination(page_size=20)
     try:
-        poem = Poem.objects.get(id=pk)
-    except ObjectDoesNotExist:
+        if snapshot is None:
+            poems = paginator.paginate_queryset(poems, request)
+        else:
+            poem_ids = catalog.keyset_page(paginator, poems, request)
+    except NotFound:
         return JsonResponse(
-            {'error': 'Poem does not exist'},
+            {'error': 'Invalid cursor'},
             safe=False,
             status=HTTPStatus.NOT_FOUND
         )
-    poem_response = {
-        'id': poem.id,
-        'title': poem.title,
-        'author': {
-            "id": poem.author.id,
-            "name": poem.author.name,
+
+    if snapshot is None:
+        poems_data = [_poem_data(poem) for poem in poems]
+    else:
+        poems_data = [_snapshot_poem_data(snapshot, pk) for pk in poem_ids]
+
+    return JsonResponse(
+        {
+            'poems': poems_data,
+            'next_cursor': paginator.get_next_cursor(),
+            'previous_cursor': paginator.get_previous_cursor(),
         },
-        'content': poem.text
-    }
-    return JsonResponse(poem_response, safe=False)
+        safe=False,
+    )
+
+
+def get_poem(request, pk):
+    if catalog.enabled():
+        snapshot = catalog.get()
+        if pk in snapshot.poem_rows:
+            return JsonResponse(_snapshot_poem_data(snapshot, pk), safe=False)
+    else:
+        try:
+            poem = Poem.objects.select_related('author').get(id=pk)
+            return JsonResponse(_poem_data(poem), safe=False)
+        except ObjectDoesNotExist:
+            pass
+    return JsonResponse(
+        {'error': 'Poem does not exist'},
+        safe=False,
+        status=HTTPStatus.NOT_FOUND
+    )
 
 
 def search_poems(request):
-    query = request.GET.get("q")
-    poems = Poem.objects.filter(
-            Q(title__icontains=query) | Q(author__name__icontains=query)
-        ).distinct()
-    poems_data = [
-        {
-            'id': poem.id,
-            'title': poem.title,
-            'author': {
-                "id": poem.author.id,
-                "name": poem.author.name,
-            },
-            'content': poem.text
-        } for poem in poems
-    ]
+    """The best matches first, 20 per page (?page=)"""
+    query = request.GET.get("q", "")
+    paginator = Paginator(search.ranked(query), 20)
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+
+    poem_ids = [row['poem_id'] for row in page]
+    poems_by_id = Poem.objects.select_related('author').in_bulk(poem_ids)
+    # A poem deleted since the page was ranked is left out
+    poems_data = [_poem_data(poems_by_id[poem_id]) for poem_id in poem_ids if poem_id in poems_by_id]
     return JsonResponse(poems_data, safe=False)
 
 
 def get_latest_poems(request):
-    latest_poems = Poem.objects.all().order_by('created_at')[:10]
-    poems_data = [
-        {
-            'id': poem.id,
-            'title': poem.title,
-            'author': {
-                "id": poem.author.id,
-                "name": poem.author.name,
-            },
-            'content': poem.text
-        } for poem in latest_poems
-    ]
+    if catalog.enabled():
+        snapshot = catalog.get()
+        poems_data = [_snapshot_poem_data(snapshot, pk) for _, pk in snapshot.feed().keys[:10]]
+        return JsonResponse(poems_data, safe=False)
+    latest_poems = Poem.objects.select_related('author').order_by('created_at')[:10]
+    poems_data = [_poem_data(poem) for poem in latest_poems]
     return JsonResponse(poems_data, safe=False)
 
 
+def _authors_by_name():
+    if catalog.enabled():
+        snapshot = catalog.get()
+        return [snapshot.author_rows[pk] for pk in snapshot.authors_by_name]
+    return Author.objects.filter(poems_count__gt=0).order_by('name')
+
+
 def get_authors(request):
-    authors = Author.objects.annotate(poems_count=Count('poems')).filter(poems_count__gt=0).order_by('name')
+    authors = _authors_by_name()
     page = request.GET.get('page', 1)
     paginator = Paginator(authors, 20)
 
@@ -129,7 +191,7 @@ def get_authors(request):
 
 
 def get_authors_v2(request):
-    authors = Author.objects.annotate(poems_count=Count('poems')).filter(poems_count__gt=0).order_by('name')
+    authors = _authors_by_name()
 
     author_data = [
         {
@@ -142,13 +204,16 @@ def get_authors_v2(request):
 
 def get_author(request, pk):
     try:
-        author = Author.objects.get(id=pk)
+        if catalog.enabled():
+            author = catalog.get().author_rows[pk]
+        else:
+            author = Author.objects.get(id=pk)
         author_data = {
             'id': author.id,
             'name': author.name,
         }
         return JsonResponse(author_data, safe=False)
-    except ObjectDoesNotExist:
+    except (ObjectDoesNotExist, KeyError):
         return JsonResponse(
             data={'error': 'Author does not exist'},
             safe=False,
@@ -157,23 +222,11 @@ def get_author(request, pk):
 
 
 def get_poems_of_author(request, pk):
-    poems = Poem.objects.filter(author_id=pk)
-    poems_data = [
-        {
-            'id': poem.id,
-            'title': poem.title,
-            'author': {
-                "id": poem.author.id,
-                "name": poem.author.name,
-            },
-            'content': poem.text
-        } for poem in poems
-    ]
-    return JsonResponse(poems_data, safe=False)
+    return _paginated_poems(request, author_id=pk)
 
 
 def get_themes(request):
-    themes = Theme.objects.all()
+    themes = catalog.get().theme_rows.values() if catalog.enabled() else Theme.objects.all()
     theme_data = [
         {
             "id": theme.id,
@@ -184,16 +237,4 @@ def get_themes(request):
 
 
 def get_poems_by_theme(request, pk):
-    poems = Poem.objects.filter(category_id=pk)
-    poems_data = [
-        {
-            'id': poem.id,
-            'title': poem.title,
-            'author': {
-                "id": poem.author.id,
-                "name": poem.author.name,
-            },
-            'content': poem.text
-        } for poem in poems
-    ]
-    return JsonResponse(poems_data, safe=False)
+    return _paginated_poems(request, category_id=pk)
@@ -0,0 +1,24 @@
+#!/usr/bin/env bash
+# Start the web server. SERVER_PROFILE=asgi serves the app from
+# wuserade/asgi.py on uvicorn workers, with the async API views; the
+# default profile serves the sync WSGI app. The asgi profile opens a
+# database connection per request; see DATABASES in the settings.
+set -o errexit
+
+# Flush the view counter spool and recompute the trending poems and popular
+# authors every RANKINGS_INTERVAL seconds (0 turns it off). It runs on the
+# web host because the spool and the response cache it invalidates are
+# local files; a separate cron instance would see neither.
+RANKINGS_INTERVAL="${RANKINGS_INTERVAL:-600}"
+if [ "$RANKINGS_INTERVAL" -gt 0 ]; then
+  (
+    while sleep "$RANKINGS_INTERVAL"; do
+      python manage.py flush_view_counters && python manage.py update_rankings || true
+    done
+  ) &
+fi
+
+if [ "${SERVER_PROFILE:-wsgi}" = "asgi" ]; then
+  exec gunicorn wuserade.asgi:application --worker-class uvicorn.workers.UvicornWorker
+fi
+exec gunicorn wuserade.wsgi:application
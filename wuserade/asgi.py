@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wuserade.settings')
+# Serve the async versions of the API views (see poems/async_views.py)
+os.environ.setdefault('API_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -48,7 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'poems.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'poems.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +58,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'poems.middleware.WhiteNoiseMiddleware',
 ]
 
 ROOT_URLCONF = 'wuserade.urls'
@@ -84,8 +86,17 @@ WSGI_APPLICATION = 'wuserade.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Served by wuserade/asgi.py with the async API views (see poems/api_urls.py)
+API_ASYNC_VIEWS = os.getenv("API_ASYNC_VIEWS") == "1"
+
 DATABASES = {
-    'default': config(default=os.getenv("DATABASE_URL"), conn_max_age=600)
+    # Async views run their queries in per-request threads, which can't
+    # reuse persistent connections. Under ASGI every request therefore
+    # connects to PostgreSQL anew: a TCP and TLS handshake, authentication
+    # and a new server backend, milliseconds that can outweigh what the
+    # async views save on a fast query. Point DATABASE_URL at a pooler such
+    # as PgBouncer (transaction mode) when serving the asgi profile.
+    'default': config(default=os.getenv("DATABASE_URL"), conn_max_age=0 if API_ASYNC_VIEWS else 600)
 }
 # pg_restore --verbose --clean --no-acl --no-owner -h localhost -U username -d new_database_name backup_file.dump
 
@@ -169,3 +180,72 @@ CORS_ALLOWED_ORIGINS = [
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 10800  # 3 hours
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Session persists even after a browser closes
+
+# Page view counters are buffered in a local SQLite spool and flushed
+# to the database in batches (see poems/counters.py)
+VIEW_COUNTER_SPOOL = BASE_DIR / 'view_counters.sqlite3'
+VIEW_COUNTER_FLUSH_INTERVAL = 30  # seconds
+
+# Shared by all workers on a host, so signal-driven invalidation in one
+# worker is seen by the others (see poems/cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', '/tmp/wuserade-cache'),
+        # One file per key: a cached response, its gzip and brotli bodies,
+        # and a version token per poem, author and theme tag, so a few
+        # keys per poem. The default of 300 culled constantly and evicted
+        # tag tokens. The count is checked by listing the directory on
+        # every set, so don't raise it far past the catalog's needs.
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 30000)),
+            'CULL_FREQUENCY': 4,  # drop a quarter of the entries when full
+        },
+    }
+}
+RESPONSE_CACHE_TIMEOUT = 300  # seconds
+RESPONSE_CACHE_STATS_INTERVAL = 30  # seconds between adding a worker's hit/miss counts to the shared ones
+
+# Featured poem selection (see poems/selection.py)
+FEATURED_NO_REPEAT_DAYS = 365
+FEATURED_THEME_WEIGHTS = {}  # theme slug -> weight, e.g. {'hekum-teuhuaue': 2.0}; 0 never features it
+FEATURED_AUTHOR_WEIGHTS = {}  # author slug -> weight
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'poems.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Proxies in front of the app: throttles key on the client address
+    # the nearest one saw, not on the proxy's
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
+}
+
+# Build list responses from .values() rows instead of ModelSerializers
+# (see poems/projections.py)
+API_FAST_SERIALIZATION = True
+
+# Smaller JSON bodies are not worth compressing (see poems/middleware.py)
+API_COMPRESSION_MIN_SIZE = 512  # bytes
+
+# A client's repeat views of an author or poem within this many seconds
+# count once (tracked in a signed cookie, see poems/decorators.py)
+VIEW_DEDUP_WINDOW = 10800  # 3 hours
+
+# Poem likes a client is remembered for, most recent first, in a signed
+# cookie (see poems/likes.py); the counts share the view counter spool
+LIKED_POEMS_LIMIT = 500
+# Likes and unlikes per client address; bounds clients that drop the cookie
+LIKE_THROTTLE_RATE = '30/minute'
+
+# Serve the read endpoints from a per-worker in-memory copy of the catalog,
+# reloaded when a write bumps its version (see poems/catalog.py). Each
+# worker holds every poem's text, so mind the memory of many workers.
+API_CATALOG_SNAPSHOT = os.getenv("API_CATALOG_SNAPSHOT") == "1"
+CATALOG_CHECK_INTERVAL = 1  # seconds between version checks
+
+# Per-route request metrics, aggregated across workers in a local SQLite
+# file and scraped from /metrics with the token (see poems/metrics.py)
+METRICS_SPOOL = BASE_DIR / 'metrics.sqlite3'
+METRICS_FLUSH_INTERVAL = 10  # seconds
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
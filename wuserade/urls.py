@@ -17,10 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from poems.metrics import metrics_view
+
 urlpatterns = [
     path("", include("poems.urls")),
     path("admin/", admin.site.urls),
     path("api/v1/", include("poems.api_urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 admin.site.site_header = "Wuserade administration"